@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PING_INTERVAL = 30.0   # seconds between offset samples once settled
+BURST_PINGS = 5        # quick samples after (re)connecting
+BURST_INTERVAL = 0.2   # seconds between burst pings
+SAMPLE_WINDOW = 16     # samples kept; the one with the lowest round trip wins
+MAX_RTT = 2.0          # seconds; slower replies say little about the offset
+
+class ClockSync:
+    """Estimates the offset between this Pi's clock and the server-agent's from MQTT round trips.
+
+    Each ping carries our send time t0; the server answers with its own time. Assuming the
+    reply was stamped halfway through the round trip, offset = server_time - (t0 + t1) / 2.
+    The sample with the smallest round trip in the window has the least queueing in it and
+    is the one used. NTP keeps the clocks close already; this corrects what is left,
+    including the path through the broker.
+    """
+
+    def __init__(self, send_ping):
+        self.send_ping = send_ping  # callable(t0) that publishes one ping
+        self.samples = deque(maxlen=SAMPLE_WINDOW)  # (rtt, offset)
+        self.best = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.burst_remaining = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True, name="clock-sync")
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def request_burst(self):
+        """Take a few samples quickly, e.g. after reconnecting to the broker."""
+        self.burst_remaining = BURST_PINGS
+        self.wakeup.set()
+
+    def _run(self):
+        while self.running:
+            if self.burst_remaining > 0:
+                self.burst_remaining -= 1
+                interval = BURST_INTERVAL
+            else:
+                interval = PING_INTERVAL
+            try:
+                self.send_ping(time.time())
+            except Exception as e:
+                logger.warning(f"Clock ping failed: {e}")
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+
+    def handle_reply(self, reply):
+        """Record a server reply {'t0': ..., 'server_time': ...}."""
+        received = time.time()
+        try:
+            sent = float(reply['t0'])
+            server_time = float(reply['server_time'])
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"Malformed clock reply: {reply}")
+            return
+        rtt = received - sent
+        if rtt < 0 or rtt > MAX_RTT:
+            return  # Our clock stepped mid-ping, or the reply sat in a queue
+        offset = server_time - (sent + received) / 2
+        with self.lock:
+            self.samples.append((rtt, offset))
+            self.best = min(self.samples)
+
+    def has_sample(self):
+        """Whether any server reply has been recorded yet."""
+        with self.lock:
+            return self.best is not None
+
+    def offset(self):
+        """Seconds to add to local time to get server time (0 until a sample arrives)."""
+        with self.lock:
+            return self.best[1] if self.best else 0.0
+
+    def to_local(self, server_time):
+        """Local wall-clock time corresponding to a server timestamp."""
+        return server_time - self.offset()
+
+    def get_status(self):
+        with self.lock:
+            if not self.best:
+                return None
+            rtt, offset = self.best
+        return {'offset_ms': round(offset * 1000, 1), 'rtt_ms': round(rtt * 1000, 1)}
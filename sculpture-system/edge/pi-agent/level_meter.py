@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import array
+import collections
+import logging
+import math
+import subprocess
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Levels are still computed, just without vectorisation
+    np = None
+
+try:
+    import alsaaudio
+except ImportError:  # Falls back to a long-lived arecord/parec pipe
+    alsaaudio = None
+
+logger = logging.getLogger(__name__)
+
+SILENCE_DB = -60.0
+FULL_SCALE = 32767.0
+
+def to_db(value):
+    """Convert a linear 16-bit sample magnitude to dBFS, floored at SILENCE_DB."""
+    if value <= 0:
+        return SILENCE_DB
+    return max(SILENCE_DB, min(0.0, 20 * math.log10(value / FULL_SCALE)))
+
+def block_levels(data):
+    """Return (peak, sum of squares, sample count) for a block of S16_LE samples."""
+    if np is not None:
+        samples = np.frombuffer(data, dtype='<i2', count=len(data) // 2).astype(np.float32)
+        if samples.size == 0:
+            return 0.0, 0.0, 0
+        return float(np.max(np.abs(samples))), float(np.dot(samples, samples)), samples.size
+
+    samples = array.array('h')
+    samples.frombytes(data[:len(data) - len(data) % 2])
+    if not samples:
+        return 0.0, 0.0, 0
+    return float(max(max(samples), -min(samples))), float(sum(s * s for s in samples)), len(samples)
+
+class LevelMeter:
+    """Continuously meters one capture device in a background thread.
+
+    Capture stays open instead of being re-spawned for every reading: pyalsaaudio is used
+    when it is installed and the device is an ALSA PCM, otherwise a single long-lived
+    arecord/parec process is read through a pipe. Peak and RMS are kept per block, and
+    get_levels() summarises the last window without blocking.
+    """
+
+    def __init__(self, name, alsa_device=None, command=None, env=None,
+                 samplerate=48000, channels=1, block_ms=50, window=1.0):
+        self.name = name
+        self.alsa_device = alsa_device
+        self.command = command  # Raw S16_LE capture command for the pipe backend
+        self.env = env
+        self.samplerate = samplerate
+        self.channels = channels
+        self.block_frames = max(1, int(samplerate * block_ms / 1000))
+        self.block_bytes = self.block_frames * channels * 2
+        self.window = window
+        self.blocks = collections.deque(maxlen=max(1, int(window * 1000 / block_ms)) * 4)
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.process = None
+        self.backend = None
+
+    def start(self):
+        """Start metering in a background thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True, name=f"level-meter-{self.name}")
+        self.thread.start()
+
+    def stop(self):
+        """Stop metering and release the capture device."""
+        self.running = False
+        self._stop_process()
+
+    def get_levels(self):
+        """Return (peak_db, rms_db) over the last window, or None if no recent audio was read."""
+        cutoff = time.monotonic() - self.window
+        with self.lock:
+            recent = [block for block in self.blocks if block[0] >= cutoff]
+        if not recent:
+            return None
+        peak = max(block[1] for block in recent)
+        total = sum(block[2] for block in recent)
+        count = sum(block[3] for block in recent)
+        rms = math.sqrt(total / count) if count else 0.0
+        return to_db(peak), to_db(rms)
+
+    def get_peak_db(self, default=SILENCE_DB):
+        """Latest peak level in dBFS, or default when the meter has no recent audio."""
+        levels = self.get_levels()
+        return levels[0] if levels else default
+
+    def _record(self, data):
+        peak, squares, count = block_levels(data)
+        if count:
+            with self.lock:
+                self.blocks.append((time.monotonic(), peak, squares, count))
+
+    def _run(self):
+        """Capture with the best available backend, reopening the device after failures."""
+        retry_delay = 1
+        while self.running:
+            started = time.monotonic()
+            try:
+                if alsaaudio is not None and self.alsa_device:
+                    self._capture_alsaaudio()
+                elif self.command:
+                    self._capture_pipe()
+                else:
+                    logger.error(f"Level meter '{self.name}' has no capture backend available")
+                    return
+            except Exception as e:
+                if self.running:
+                    logger.warning(f"Level meter '{self.name}' capture error ({self.backend}): {e}")
+            finally:
+                self._stop_process()
+
+            if not self.running:
+                break
+            # Back off while the device keeps failing, reset once capture has been stable
+            retry_delay = 1 if time.monotonic() - started > 30 else min(retry_delay * 2, 30)
+            time.sleep(retry_delay)
+
+    def _capture_alsaaudio(self):
+        self.backend = 'pyalsaaudio'
+        pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_CAPTURE,
+            mode=alsaaudio.PCM_NORMAL,
+            device=self.alsa_device,
+            channels=self.channels,
+            rate=self.samplerate,
+            format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=self.block_frames
+        )
+        logger.info(f"Level meter '{self.name}' capturing from ALSA device {self.alsa_device} via pyalsaaudio")
+        try:
+            while self.running:
+                length, data = pcm.read()
+                if length > 0:
+                    self._record(data)
+                elif length < 0:
+                    logger.debug(f"Level meter '{self.name}' capture overrun")
+        finally:
+            pcm.close()
+
+    def _capture_pipe(self):
+        self.backend = 'pipe'
+        self.process = subprocess.Popen(
+            self.command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=self.env, bufsize=0
+        )
+        logger.info(f"Level meter '{self.name}' capturing via {self.command[0]} (pid {self.process.pid})")
+        stdout = self.process.stdout
+        pending = b''
+        while self.running:
+            chunk = stdout.read(self.block_bytes - len(pending))
+            if not chunk:
+                raise RuntimeError(f"{self.command[0]} exited with code {self.process.wait(timeout=2)}")
+            pending += chunk
+            if len(pending) >= self.block_bytes:
+                self._record(pending)
+                pending = b''
+
+    def _stop_process(self):
+        process, self.process = self.process, None
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
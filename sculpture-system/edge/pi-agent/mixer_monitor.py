@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import re
+import select
+import subprocess
+import threading
+import time
+
+try:
+    import alsaaudio
+except ImportError:  # Falls back to parsing `alsactl monitor`
+    alsaaudio = None
+
+logger = logging.getLogger(__name__)
+
+EVENT_SETTLE_TIME = 0.02  # seconds to let a burst of mixer events settle before re-reading the state
+
+class MixerMonitor:
+    """Cached mute/volume state of the output mixer, kept current by mixer change events.
+
+    With the ALSA backend the card's control events are watched through pyalsaaudio (or a
+    long-lived `alsactl monitor` process); with PulseAudio through `pactl subscribe`. The
+    state is only re-read when an event arrives, so get_state() never spawns a process.
+    """
+
+    def __init__(self, audio_backend, card, control, sink, env=None):
+        self.audio_backend = audio_backend
+        self.card = card
+        self.control = control
+        self.sink = sink
+        self.env = env
+        self.state = None  # {'muted': bool, 'volume': percent} while the event stream is live
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.process = None
+        self.events = 0
+
+    def start(self):
+        """Start watching mixer events in a background thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True, name="mixer-monitor")
+        self.thread.start()
+
+    def stop(self):
+        """Stop watching; get_state() returns None afterwards."""
+        self.running = False
+        self._set_state(None)
+        self._stop_process()
+
+    def get_state(self):
+        """Cached {'muted', 'volume'} state, or None when no event stream is keeping it current."""
+        with self.lock:
+            return dict(self.state) if self.state else None
+
+    def update(self, **values):
+        """Write through a change we made ourselves, ahead of its event."""
+        with self.lock:
+            if self.state:
+                self.state.update(values)
+
+    def _set_state(self, state):
+        with self.lock:
+            changed = state != self.state
+            self.state = state
+        if changed and state:
+            logger.debug(f"Mixer state: {state}")
+
+    def read_state(self):
+        """Read the mixer state directly (one subprocess) without going through the cache."""
+        if self.audio_backend == 'pulse':
+            mute = subprocess.run(['pactl', 'get-sink-mute', self.sink],
+                                  capture_output=True, text=True, check=True, env=self.env)
+            volume = subprocess.run(['pactl', 'get-sink-volume', self.sink],
+                                    capture_output=True, text=True, check=True, env=self.env)
+            # Output is "Mute: yes" or "Mute: no"
+            muted = 'yes' in mute.stdout.lower()
+            volume_match = re.search(r'(\d+)%', volume.stdout)
+        else: # alsa
+            result = subprocess.run(['amixer', '-c', self.card, 'get', self.control],
+                                    capture_output=True, text=True, check=True)
+            # [off] marks a muted playback switch
+            muted = '[off]' in result.stdout
+            volume_match = re.search(r'\[(\d+)%\]', result.stdout)
+        return {'muted': muted, 'volume': int(volume_match.group(1)) if volume_match else None}
+
+    def _run(self):
+        """Watch events with the best available backend, restarting the watcher after failures."""
+        retry_delay = 1
+        while self.running:
+            started = time.monotonic()
+            try:
+                if self.audio_backend == 'pulse':
+                    self._watch_pipe(['pactl', 'subscribe'], lambda line: 'on sink' in line)
+                elif alsaaudio is not None:
+                    self._watch_alsaaudio()
+                else:
+                    self._watch_pipe(['alsactl', 'monitor', f'hw:{self.card}'], lambda line: self.control in line)
+            except Exception as e:
+                if self.running:
+                    logger.warning(f"Mixer event monitor failed: {e}")
+            finally:
+                # Without events the cache cannot be trusted; readers fall back to direct reads
+                self._set_state(None)
+                self._stop_process()
+
+            if not self.running:
+                break
+            retry_delay = 1 if time.monotonic() - started > 30 else min(retry_delay * 2, 30)
+            time.sleep(retry_delay)
+
+    def _watch_alsaaudio(self):
+        mixer = alsaaudio.Mixer(control=self.control, cardindex=alsaaudio.cards().index(self.card))
+        poller = select.poll()
+        for fd, mask in mixer.polldescriptors():
+            poller.register(fd, mask)
+
+        def read_mixer():
+            # Re-reading the element after handleevents() picks up the new values
+            return {'muted': bool(mixer.getmute()[0]), 'volume': int(mixer.getvolume()[0])}
+
+        self._set_state(read_mixer())
+        logger.info(f"Watching {self.card} {self.control} mixer events via pyalsaaudio")
+        try:
+            while self.running:
+                if poller.poll(1000):
+                    time.sleep(EVENT_SETTLE_TIME)
+                    mixer.handleevents()
+                    self.events += 1
+                    self._set_state(read_mixer())
+        finally:
+            mixer.close()
+
+    def _watch_pipe(self, command, is_relevant):
+        """Follow an event stream and re-read the state once per burst of relevant events."""
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        env=self.env if self.audio_backend == 'pulse' else None)
+        fd = self.process.stdout.fileno()
+        # Subscribe first, then read, so no change can slip in between
+        self._set_state(self.read_state())
+        logger.info(f"Watching mixer events via {' '.join(command)} (pid {self.process.pid})")
+
+        pending = b''
+        while self.running:
+            ready, _, _ = select.select([fd], [], [], 1.0)
+            if not ready:
+                continue
+            relevant = False
+            # Drain the whole burst before re-reading the state
+            while ready:
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    raise RuntimeError(f"{command[0]} exited with code {self.process.wait(timeout=2)}")
+                *lines, pending = (pending + chunk).split(b'\n')
+                relevant = relevant or any(is_relevant(line.decode(errors='replace')) for line in lines)
+                ready, _, _ = select.select([fd], [], [], EVENT_SETTLE_TIME)
+            if relevant:
+                self.events += 1
+                self._set_state(self.read_state())
+
+    def _stop_process(self):
+        process, self.process = self.process, None
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import itertools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class MpvError(Exception):
+    """mpv answered a command with an error."""
+
+class MpvController:
+    """Client for a long-lived mpv instance's JSON IPC socket (--input-ipc-server).
+
+    One connection is kept open and reused; it is re-established transparently when mpv
+    restarts. Requests are matched to replies by request_id, and the event messages mpv
+    interleaves on the same socket are skipped.
+    """
+
+    def __init__(self, socket_path, timeout=2.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = b''
+        self.request_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.buffer = b''
+        logger.debug(f"Connected to mpv IPC socket {self.socket_path}")
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.buffer = b''
+
+    def wait_until_ready(self, timeout=5.0):
+        """Wait for a freshly started mpv to create its socket; returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(self.socket_path):
+                try:
+                    self.command('get_property', 'idle-active')
+                    return True
+                except (OSError, MpvError):
+                    pass
+            time.sleep(0.05)
+        return False
+
+    def _read_reply(self, request_id):
+        while True:
+            while b'\n' not in self.buffer:
+                chunk = self.sock.recv(4096)
+                if not chunk:
+                    raise ConnectionError("mpv closed the IPC connection")
+                self.buffer += chunk
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            if message.get('request_id') == request_id:
+                return message
+            # Events and replies to abandoned requests are not ours
+
+    def command(self, *args):
+        """Run one IPC command and return its data; raises MpvError or OSError."""
+        with self.lock:
+            for attempt in range(2):
+                reused = self.sock is not None
+                try:
+                    if not reused:
+                        self.connect()
+                    request_id = next(self.request_ids)
+                    self.sock.sendall(json.dumps({'command': list(args), 'request_id': request_id}).encode() + b'\n')
+                    reply = self._read_reply(request_id)
+                    break
+                except (OSError, ValueError) as e:
+                    self.close()
+                    # mpv may have been restarted since the connection was opened: retry once
+                    if reused and attempt == 0:
+                        logger.debug(f"mpv IPC connection lost ({e}), reconnecting")
+                        continue
+                    raise OSError(f"mpv IPC command {args[0]} failed: {e}") from e
+
+        if reply.get('error') != 'success':
+            raise MpvError(f"{args[0]}: {reply.get('error')}")
+        return reply.get('data')
+
+    def get_property(self, name):
+        return self.command('get_property', name)
+
+    def set_property(self, name, value):
+        return self.command('set_property', name, value)
+
+    def is_idle(self):
+        """True when mpv is running with nothing loaded."""
+        return bool(self.get_property('idle-active'))
+
+    def load_file(self, path):
+        """Replace whatever is playing with one file, looped."""
+        self.set_property('loop-playlist', 'no')
+        self.set_property('loop-file', 'inf')
+        self.command('loadfile', path, 'replace')
+        self.set_property('pause', False)
+
+    def load_playlist(self, path):
+        """Replace whatever is playing with an m3u playlist, looped as a whole (gapless between tracks)."""
+        self.set_property('loop-file', 'no')
+        self.set_property('loop-playlist', 'inf')
+        self.command('loadlist', path, 'replace')
+        self.set_property('pause', False)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+INDEX_SAVE_INTERVAL = 300  # seconds between index writes for last-used times alone
+
+class SampleCache:
+    """Playback-native PCM copies of samples that mpv would otherwise resample on the fly.
+
+    Copies are keyed by a hash of the source content plus the target format, so renamed or
+    re-uploaded files reuse an existing copy, and changing the playback format starts a
+    fresh set. Conversions run in one low-priority background thread; until a copy exists
+    the original is played. The least recently used copies are evicted to stay within the
+    disk budget; an evicted sample is only converted again when it is played, not on every
+    catalog change.
+    """
+
+    def __init__(self, cache_dir, budget_bytes, samplerate, channels):
+        self.cache_dir = str(cache_dir)
+        self.index_path = os.path.join(self.cache_dir, 'index.json')
+        self.budget_bytes = budget_bytes
+        self.samplerate = int(samplerate)
+        self.channels = int(channels)
+        self.target = f"pcm_s16le/{self.samplerate}/{self.channels}"
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.lock = threading.Lock()
+        self.sources = {}  # source path -> {'size', 'mtime', 'key'[, 'evicted']}
+        self.entries = {}  # key -> {'size', 'last_used'}
+        self.last_saved = time.monotonic()
+        self.dirty = False  # last_used times changed since the index was written
+        self.pending = queue.Queue()
+        self.queued = set()
+        self.worker_running = False  # Set and cleared under lock, with the queue state it depends on
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not create sample cache directory {self.cache_dir}: {e}")
+        self.load()
+
+    def is_native(self, info):
+        """Whether a catalog entry already matches the playback format."""
+        return (info.get('format') == 'pcm' and info.get('bits') == 16
+                and info.get('samplerate') == self.samplerate and info.get('channels') == self.channels)
+
+    def load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get('target') == self.target:
+                self.sources, self.entries = index['sources'], index['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        try:
+            temp_path = f"{self.index_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'target': self.target, 'sources': self.sources, 'entries': self.entries}, f)
+            os.replace(temp_path, self.index_path)
+            self.last_saved = time.monotonic()
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"Could not save sample cache index: {e}")
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def lookup(self, path, info):
+        """Path to play for a source file: its cached native copy if there is one, else the source."""
+        if self.is_native(info):
+            return path
+        with self.lock:
+            source = self.sources.get(path)
+            if source and source['size'] == info.get('size') and source['mtime'] == info.get('mtime'):
+                entry = self.entries.get(source['key'])
+                if entry and os.path.exists(self.cache_path(source['key'])):
+                    # Written with the next conversion, or here at most every INDEX_SAVE_INTERVAL
+                    entry['last_used'] = time.time()
+                    self.dirty = True
+                    if time.monotonic() - self.last_saved >= INDEX_SAVE_INTERVAL:
+                        self.save()
+                    return self.cache_path(source['key'])
+        # Not converted yet, evicted, or the source changed: play the original and convert for next time
+        self.prepare(path, info, on_demand=True)
+        return path
+
+    def prepare(self, path, info, on_demand=False):
+        """Queue a background conversion of a non-native source that has no current copy.
+
+        Samples evicted for the budget are skipped unless on_demand (they are being played),
+        so a catalog change does not convert them again only to evict them again.
+        """
+        if self.is_native(info) or not self.ffmpeg:
+            return
+        with self.lock:
+            source = self.sources.get(path)
+            if source and source['size'] == info.get('size') and source['mtime'] == info.get('mtime'):
+                if source.get('evicted') and not on_demand:
+                    return
+                if source['key'] in self.entries and os.path.exists(self.cache_path(source['key'])):
+                    return
+            if path in self.queued:
+                return
+            self.queued.add(path)
+            self.pending.put((path, info.get('size'), info.get('mtime')))
+            if not self.worker_running:
+                self.worker_running = True
+                threading.Thread(target=self.worker_loop, daemon=True, name="sample-cache").start()
+
+    def content_key(self, path):
+        digest = hashlib.blake2b(self.target.encode(), digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def worker_loop(self):
+        while True:
+            try:
+                path, size, mtime = self.pending.get(timeout=60)
+            except queue.Empty:
+                with self.lock:
+                    if not self.pending.empty():
+                        continue  # Queued between the timeout and taking the lock
+                    # Idle: the next prepare() starts a new worker
+                    self.worker_running = False
+                    if self.dirty:
+                        self.save()
+                    return
+            try:
+                self.convert(path, size, mtime)
+            except Exception as e:
+                logger.error(f"Failed to convert {path} for the sample cache: {e}")
+            finally:
+                with self.lock:
+                    self.queued.discard(path)
+
+    def convert(self, path, size, mtime):
+        key = self.content_key(path)
+        target_path = self.cache_path(key)
+        if not os.path.exists(target_path):
+            started = time.monotonic()
+            temp_path = f"{target_path}.tmp.wav"
+            # Lowest CPU and I/O priority: conversions must not compete with darkice
+            subprocess.run(
+                ['nice', '-n', '19', 'ionice', '-c', '3', self.ffmpeg, '-nostdin', '-loglevel', 'error', '-y',
+                 '-i', path, '-map', '0:a:0', '-ac', str(self.channels), '-ar', str(self.samplerate),
+                 '-sample_fmt', 's16', '-c:a', 'pcm_s16le', temp_path],
+                check=True, capture_output=True
+            )
+            os.replace(temp_path, target_path)
+            logger.info(f"Converted {os.path.basename(path)} to {self.target} in {time.monotonic() - started:.1f}s")
+
+        with self.lock:
+            self.sources[path] = {'size': size, 'mtime': mtime, 'key': key}
+            self.entries[key] = {'size': os.path.getsize(target_path), 'last_used': time.time()}
+            self.evict()
+            self.save()
+
+    def evict(self):
+        """Drop least recently used copies until the cache fits its budget (caller holds the lock)."""
+        total = sum(entry['size'] for entry in self.entries.values())
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.budget_bytes:
+                break
+            try:
+                os.remove(self.cache_path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict cached sample {key}: {e}")
+                continue
+            total -= entry['size']
+            del self.entries[key]
+            logger.info(f"Evicted cached sample {key} ({entry['size'] // 1024}KB)")
+        # Remember sources whose copy was evicted, so only playing them converts them again
+        for source in self.sources.values():
+            if source['key'] in self.entries:
+                source.pop('evicted', None)
+            else:
+                source['evicted'] = True
@@ -1,46 +1,132 @@
 #!/usr/bin/env python3
 
-import subprocess
+import os
 import logging
 import time
-import re
 
 logger = logging.getLogger(__name__)
 
+THERMAL_DIR = '/sys/class/thermal'
+# Firmware throttling flags, exposed by the raspberrypi-hwmon driver (same value as `vcgencmd get_throttled`)
+THROTTLED_PATH = '/sys/devices/platform/soc/soc:firmware/get_throttled'
+THROTTLED_FLAGS = {
+    0: 'under_voltage',
+    1: 'freq_capped',
+    2: 'throttled',
+    3: 'soft_temp_limit'
+}
+# Processes whose CPU usage is reported individually, by /proc/<pid>/comm
+WATCHED_PROCESSES = ('mpv', 'darkice')
+PROCESS_RESCAN_INTERVAL = 10  # seconds between /proc scans for new watched processes
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+def decode_throttled(value):
+    """Split the firmware throttling bitmask into current and since-boot flag names."""
+    return {
+        'now': [name for bit, name in THROTTLED_FLAGS.items() if value & (1 << bit)],
+        'since_boot': [name for bit, name in THROTTLED_FLAGS.items() if value & (1 << (bit + 16))]
+    }
+
+class ProcFile:
+    """A procfs/sysfs file kept open and re-read from the start on every sample."""
+    
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+    
+    def read(self):
+        if self.handle is None:
+            self.handle = open(self.path, 'rb', buffering=0)
+        try:
+            self.handle.seek(0)
+            chunks = []
+            while True:
+                chunk = self.handle.read(65536)
+                if not chunk:
+                    return b''.join(chunks).decode()
+                chunks.append(chunk)
+        except OSError:
+            self.close()
+            raise
+    
+    def close(self):
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
 class StatusCollector:
-    """Handles system status collection including CPU, temperature, and metrics."""
+    """Handles system status collection including CPU, temperature, and metrics.
+    
+    Everything is sampled from /proc and /sys through persistent file handles; CPU figures
+    are deltas between successive calls, so they cover the whole status interval rather
+    than a single snapshot.
+    """
     
     def __init__(self, sculpture_id):
         self.sculpture_id = sculpture_id
-        
+        self.stat_file = ProcFile('/proc/stat')
+        self.loadavg_file = ProcFile('/proc/loadavg')
+        self.meminfo_file = ProcFile('/proc/meminfo')
+        self.thermal_file = ProcFile(self.find_thermal_zone())
+        self.throttled_file = ProcFile(THROTTLED_PATH) if os.path.exists(THROTTLED_PATH) else None
+    
+        self.last_cpu_times = None  # cpu name -> (busy, total) jiffies
+        self.process_files = {}  # pid -> (name, ProcFile of /proc/<pid>/stat)
+        self.last_process_times = {}  # pid -> jiffies
+        self.last_process_sample = None
+        self.last_process_scan = 0
+    
+        # Prime the counters so the first status report already has a delta
+        self.last_cpu_times = self.sample_cpu_times()
+        self.get_process_cpu()
+    
+    def find_thermal_zone(self):
+        """Path of the CPU thermal zone's temperature file."""
+        try:
+            for zone in sorted(os.listdir(THERMAL_DIR)):
+                if not zone.startswith('thermal_zone'):
+                    continue
+                with open(os.path.join(THERMAL_DIR, zone, 'type')) as f:
+                    if 'cpu' in f.read().lower():
+                        return os.path.join(THERMAL_DIR, zone, 'temp')
+        except OSError:
+            pass
+        return os.path.join(THERMAL_DIR, 'thermal_zone0', 'temp')
+    
+    def sample_cpu_times(self):
+        """Read cumulative (busy, total) jiffies for the aggregate CPU and each core."""
+        times = {}
+        for line in self.stat_file.read().splitlines():
+            if not line.startswith('cpu'):
+                break
+            fields = line.split()
+            values = [int(value) for value in fields[1:]]
+            # user nice system idle iowait irq softirq steal (guest time is already counted in user)
+            total = sum(values[:8])
+            idle = values[3] + (values[4] if len(values) > 4 else 0)
+            times[fields[0]] = (total - idle, total)
+        return times
+    
+    def get_cpu_times_usage(self):
+        """Aggregate and per-core CPU usage percentages since the previous call."""
+        current = self.sample_cpu_times()
+        previous, self.last_cpu_times = self.last_cpu_times, current
+    
+        usage = {}
+        for name, (busy, total) in current.items():
+            last_busy, last_total = (previous or {}).get(name, (0, 0))
+            elapsed = total - last_total
+            usage[name] = round(100.0 * (busy - last_busy) / elapsed, 1) if elapsed > 0 else 0.0
+    
+        cores = [usage[name] for name in sorted(usage, key=lambda n: int(n[3:]) if n[3:].isdigit() else -1)
+                 if name != 'cpu']
+        return usage.get('cpu', 0.0), cores
+    
     def get_cpu_usage(self):
         """Get CPU usage percentage."""
         try:
-            cpu_result = subprocess.run(['top', '-bn1'], capture_output=True, text=True, check=True)
-            cpu_line = next((line for line in cpu_result.stdout.split('\n') if 'Cpu(s)' in line), None)
-
-            if cpu_line:
-                try:
-                    # More robust CPU parsing to handle different 'top' formats
-                    match = re.search(r'(\d+[\.,]\d+)\s*us', cpu_line)
-                    if match:
-                        cpu_usage = float(match.group(1).replace(',', '.'))
-                    else:
-                        # Fallback for formats like "2.5% us"
-                        parts = cpu_line.replace(',', ' ').split()
-                        try:
-                            us_index = parts.index('us')
-                            cpu_usage = float(parts[us_index - 1])
-                        except (ValueError, IndexError):
-                            raise ValueError("Could not find 'us' CPU value.")
-                except (ValueError, IndexError) as e:
-                    error_message = f"Could not parse CPU usage from 'top' output: '{cpu_line}'. Error: {e}"
-                    logger.warning(error_message + " Defaulting to 0.")
-                    return 0.0, error_message
-            else:
-                logger.warning("Could not find 'Cpu(s)' line in top output.")
-                return 0.0, None
-                
+            cpu_usage, _ = self.get_cpu_times_usage()
             return cpu_usage, None
         except Exception as e:
             logger.error(f"Failed to get CPU usage: {e}")
@@ -49,23 +135,93 @@ class StatusCollector:
     def get_temperature(self):
         """Get system temperature in Celsius."""
         try:
-            temp_result = subprocess.run(['vcgencmd', 'measure_temp'], capture_output=True, text=True, check=True)
-            temp_str = temp_result.stdout.strip().replace('temp=', '').replace("'C", '')
-            temperature = float(temp_str)
-            return temperature
+            return int(self.thermal_file.read().strip()) / 1000.0
         except Exception as e:
             logger.error(f"Failed to get temperature: {e}")
             return 0.0
     
+    def get_load_average(self):
+        """1, 5 and 15 minute load averages."""
+        return [float(value) for value in self.loadavg_file.read().split()[:3]]
+    
+    def get_memory(self):
+        """Memory usage percentage and available memory in MB."""
+        meminfo = {}
+        for line in self.meminfo_file.read().splitlines():
+            key, _, rest = line.partition(':')
+            if key in ('MemTotal', 'MemAvailable'):
+                meminfo[key] = int(rest.split()[0])  # kB
+        total = meminfo.get('MemTotal', 0)
+        available = meminfo.get('MemAvailable', 0)
+        used_percent = round(100.0 * (total - available) / total, 1) if total else 0.0
+        return used_percent, round(available / 1024)
+    
+    def get_throttled(self):
+        """Decoded firmware throttling state, or None when the kernel does not expose it."""
+        if not self.throttled_file:
+            return None
+        return decode_throttled(int(self.throttled_file.read().strip(), 16))
+    
+    def scan_processes(self):
+        """Open /proc/<pid>/stat for watched processes that are not tracked yet."""
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit() or int(entry) in self.process_files:
+                continue
+            try:
+                with open(f'/proc/{entry}/comm') as f:
+                    name = f.read().strip()
+            except OSError:
+                continue  # Process exited while scanning
+            if name in WATCHED_PROCESSES:
+                self.process_files[int(entry)] = (name, ProcFile(f'/proc/{entry}/stat'))
+    
+    def get_process_cpu(self):
+        """CPU usage of each watched process name in percent of one core since the previous call."""
+        now = time.monotonic()
+        if now - self.last_process_scan >= PROCESS_RESCAN_INTERVAL:
+            self.scan_processes()
+            self.last_process_scan = now
+    
+        elapsed = now - self.last_process_sample if self.last_process_sample else 0
+        self.last_process_sample = now
+    
+        usage = {name: 0.0 for name in WATCHED_PROCESSES}
+        for pid, (name, stat_file) in list(self.process_files.items()):
+            try:
+                # Fields after the parenthesised command name; utime and stime are fields 14 and 15
+                head, tail = stat_file.read().rsplit(')', 1)
+                if head.split('(', 1)[1] != name:
+                    raise ValueError("pid reused by another process")
+                fields = tail.split()
+                ticks = int(fields[11]) + int(fields[12])
+            except (OSError, IndexError, ValueError):
+                # Process exited: look for its replacement on the next call
+                stat_file.close()
+                del self.process_files[pid]
+                self.last_process_times.pop(pid, None)
+                self.last_process_scan = 0
+                continue
+            last_ticks = self.last_process_times.get(pid)
+            self.last_process_times[pid] = ticks
+            if last_ticks is not None and elapsed > 0:
+                usage[name] += 100.0 * (ticks - last_ticks) / CLOCK_TICKS / elapsed
+    
+        return {name: round(value, 1) for name, value in usage.items()}
+    
     def build_status(self, current_mode, is_muted, mic_level, output_level, current_plan=None, error_message=None):
         """Build the complete status dictionary."""
-        cpu_usage, cpu_error = self.get_cpu_usage()
+        cpu_error = None
+        try:
+            cpu_usage, cpu_cores = self.get_cpu_times_usage()
+        except Exception as e:
+            logger.error(f"Failed to get CPU usage: {e}")
+            cpu_usage, cpu_cores, cpu_error = 0.0, [], str(e)
         temperature = self.get_temperature()
-        
+    
         # Use CPU error if no other error provided
         if error_message is None:
             error_message = cpu_error
-        
+    
         status = {
             'id': self.sculpture_id,
             'cpu': round(cpu_usage),
@@ -76,12 +232,24 @@ class StatusCollector:
             'is_muted': is_muted,
             'time': round(time.time())
         }
-        
+    
+        # Extended metrics are best effort and never hold back the core status
+        try:
+            status['cpu_cores'] = [round(core) for core in cpu_cores]
+            status['load'] = self.get_load_average()
+            status['mem'], status['mem_available'] = self.get_memory()
+            status['processes'] = self.get_process_cpu()
+            throttled = self.get_throttled()
+            if throttled is not None:
+                status['throttled'] = throttled
+        except Exception as e:
+            logger.warning(f"Failed to collect extended metrics: {e}")
+    
         # Include current plan if provided
         if current_plan:
             status['plan'] = current_plan
-        
+    
         if error_message:
             status['error'] = error_message
-            
-        return status 
\ No newline at end of file
+    
+        return status
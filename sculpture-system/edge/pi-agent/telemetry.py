@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LEVEL_INTERVAL = 0.25     # seconds between mic/output level samples
+REPORT_INTERVAL = 1.0     # seconds between level aggregates (and the fastest a delta is sent)
+SLOW_INTERVAL = 5.0       # seconds between full status collections (CPU, temperature, memory, mode)
+KEYFRAME_INTERVAL = 30.0  # seconds between full status messages
+
+# Minimum change before a field is re-sent; fields not listed are sent on any change
+THRESHOLDS = {
+    'cpu': 5,
+    'cpu_cores': 10,
+    'temp': 1,
+    'mem': 2,
+    'mem_available': 50,
+    'load': 0.25,
+    'processes': 5,
+    'mic': 1,
+    'output': 1,
+    'clock': 5,
+}
+LEVEL_FIELDS = ('mic', 'output')
+UNTRACKED_FIELDS = ('id', 'time')  # Part of every message, never a reason to send one
+
+def exceeds(old, new, threshold):
+    """Whether new differs from old by at least threshold (numbers, lists or dicts of numbers)."""
+    if isinstance(new, dict) and isinstance(old, dict):
+        return new.keys() != old.keys() or any(exceeds(old[key], new[key], threshold) for key in new)
+    if isinstance(new, list) and isinstance(old, list):
+        return len(new) != len(old) or any(exceeds(a, b, threshold) for a, b in zip(old, new))
+    if isinstance(new, (int, float)) and isinstance(old, (int, float)) \
+            and not isinstance(new, bool) and not isinstance(old, bool):
+        return abs(new - old) >= threshold
+    return new != old
+
+class TelemetryScheduler:
+    """Publishes sculpture status as periodic keyframes plus threshold-gated deltas.
+    
+    Levels are sampled every LEVEL_INTERVAL and reported as min/avg/max per REPORT_INTERVAL;
+    the rest of the status is collected every SLOW_INTERVAL. A delta message carries only
+    the fields that moved past their threshold since they were last sent (and nothing is
+    sent when nothing moved); every KEYFRAME_INTERVAL a full status is sent instead.
+    
+    Keyframes are the status dict as before plus 'seq' and 'levels'. Deltas additionally
+    carry 'delta': true; a field that disappeared is sent as null.
+    """
+    
+    def __init__(self, publish, collect_status, sample_levels):
+        self.publish = publish                # callable(dict) that sends one status message
+        self.collect_status = collect_status  # callable() -> full status dict
+        self.sample_levels = sample_levels    # callable() -> (mic_db, output_db)
+        self.current = {}
+        self.last_sent = {}
+        self.level_samples = {field: [] for field in LEVEL_FIELDS}
+        self.sequence = 0
+        self.keyframe_requested = True
+        self.update_requested = False
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.stats = {'keyframes': 0, 'deltas': 0, 'skipped': 0}
+    
+    def start(self):
+        """Start the scheduler thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True, name="telemetry")
+        self.thread.start()
+    
+    def stop(self):
+        """Stop the scheduler thread."""
+        self.running = False
+        self.wakeup.set()
+    
+    def request_keyframe(self):
+        """Send a full status at the next report, e.g. after reconnecting to the broker."""
+        self.keyframe_requested = True
+        self.wakeup.set()
+    
+    def request_update(self):
+        """Re-collect the status and report straight away, e.g. after a mode change."""
+        self.update_requested = True
+        self.wakeup.set()
+    
+    def run(self):
+        now = time.monotonic()
+        next_level = next_report = next_slow = now
+        next_keyframe = now + KEYFRAME_INTERVAL
+    
+        while self.running:
+            now = time.monotonic()
+            update = self.update_requested
+            self.update_requested = False
+            try:
+                if now >= next_level:
+                    self.add_level_sample()
+                    next_level = now + LEVEL_INTERVAL
+                if now >= next_slow or update:
+                    self.update_status(self.collect_status())
+                    next_slow = now + SLOW_INTERVAL
+                if now >= next_report or update:
+                    self.aggregate_levels()
+                    if self.keyframe_requested or now >= next_keyframe:
+                        self.keyframe_requested = False
+                        self.send_keyframe()
+                        next_keyframe = now + KEYFRAME_INTERVAL
+                    else:
+                        self.send_delta()
+                    next_report = now + REPORT_INTERVAL
+            except Exception as e:
+                logger.error(f"Telemetry update failed: {e}")
+    
+            self.wakeup.wait(max(0.0, min(next_level, next_report, next_slow) - time.monotonic()))
+            self.wakeup.clear()
+    
+    def update_status(self, status):
+        """Merge a collected status; once sampling has started, levels come from the aggregates."""
+        for field in list(self.current):
+            if field not in status and field not in LEVEL_FIELDS and field != 'levels':
+                del self.current[field]  # e.g. an error that has cleared
+        for field, value in status.items():
+            if field not in LEVEL_FIELDS or field not in self.current:
+                self.current[field] = value
+    
+    def add_level_sample(self):
+        for field, value in zip(LEVEL_FIELDS, self.sample_levels()):
+            self.level_samples[field].append(value)
+    
+    def aggregate_levels(self):
+        """Fold the samples since the last report into the status: peak as the level, plus min/avg/max."""
+        levels = {}
+        for field, samples in self.level_samples.items():
+            if samples:
+                self.current[field] = round(max(samples))
+                levels[field] = [round(min(samples), 1), round(sum(samples) / len(samples), 1), round(max(samples), 1)]
+                samples.clear()
+        if levels:
+            self.current['levels'] = levels
+    
+    def next_sequence(self):
+        self.sequence += 1
+        return self.sequence
+    
+    def send_keyframe(self):
+        message = dict(self.current, seq=self.next_sequence(), time=round(time.time()))
+        self.publish(message)
+        self.last_sent = dict(self.current)
+        self.stats['keyframes'] += 1
+    
+    def send_delta(self):
+        changes = {}
+        for field, value in self.current.items():
+            if field in UNTRACKED_FIELDS or field == 'levels':
+                continue
+            if field not in self.last_sent or exceeds(self.last_sent[field], value, THRESHOLDS.get(field, 0)):
+                changes[field] = value
+        for field in self.last_sent:
+            if field not in self.current:
+                changes[field] = None
+    
+        # Level aggregates ride along whenever a level moved enough to be sent
+        if any(field in changes for field in LEVEL_FIELDS) and 'levels' in self.current:
+            changes['levels'] = self.current['levels']
+    
+        if not changes:
+            self.stats['skipped'] += 1
+            return
+    
+        message = {'id': self.current.get('id'), 'delta': True, 'seq': self.next_sequence(), 'time': round(time.time())}
+        message.update(changes)
+        self.publish(message)
+        for field, value in changes.items():
+            if value is None:
+                self.last_sent.pop(field, None)
+            else:
+                self.last_sent[field] = value
+        self.stats['deltas'] += 1
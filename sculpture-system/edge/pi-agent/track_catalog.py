@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac')
+CATALOG_VERSION = 1
+EVENT_SETTLE_TIME = 0.5  # seconds to collect a burst of file events (e.g. an rsync) before re-indexing
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+# MPEG-1 Layer III bitrates (kbps) and sample rates, indexed by header fields
+MP3_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+def parse_wav(f, size):
+    """Read format and duration from RIFF/WAVE chunk headers without touching the audio data."""
+    riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError("not a RIFF/WAVE file")
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            format_tag, channels, samplerate, _, block_align, bits = struct.unpack('<HHIIHH', f.read(16))
+            fmt = {'format': 'float' if format_tag == 3 else 'pcm', 'channels': channels,
+                   'samplerate': samplerate, 'bits': bits, 'block_align': block_align}
+            f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if not fmt:
+                raise ValueError("data chunk before fmt chunk")
+            # Streaming writers leave the size at 0 or 0xFFFFFFFF: use what is actually there
+            data_size = min(chunk_size, size - f.tell()) if chunk_size not in (0, 0xFFFFFFFF) else size - f.tell()
+            block_align = fmt.pop('block_align') or 1
+            fmt['duration'] = round(data_size / block_align / fmt['samplerate'], 3) if fmt['samplerate'] else None
+            return fmt
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    raise ValueError("no data chunk")
+
+def parse_flac(f, size):
+    """Read the STREAMINFO block of a FLAC file."""
+    if f.read(4) != b'fLaC':
+        raise ValueError("not a FLAC file")
+    f.read(4)  # METADATA_BLOCK_HEADER; STREAMINFO is always first
+    info = f.read(34)
+    # 20 bits sample rate, 3 bits channels-1, 5 bits bits-per-sample-1, 36 bits total samples
+    packed = int.from_bytes(info[10:18], 'big')
+    samplerate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    return {'format': 'flac', 'channels': channels, 'samplerate': samplerate, 'bits': bits,
+            'duration': round(total_samples / samplerate, 3) if samplerate and total_samples else None}
+
+def parse_mp3(f, size):
+    """Read the first MPEG audio frame header; duration is estimated from its bitrate."""
+    offset = 0
+    header = f.read(10)
+    if header[:3] == b'ID3':
+        # Skip the ID3v2 tag (syncsafe size)
+        offset = 10 + ((header[6] & 0x7F) << 21 | (header[7] & 0x7F) << 14 | (header[8] & 0x7F) << 7 | (header[9] & 0x7F))
+    f.seek(offset)
+    data = f.read(4096)
+    for i in range(len(data) - 3):
+        if data[i] == 0xFF and data[i + 1] & 0xE0 == 0xE0:
+            version = (data[i + 1] >> 3) & 0x3
+            bitrate_index = data[i + 2] >> 4
+            rate_index = (data[i + 2] >> 2) & 0x3
+            if version == 1 or rate_index == 3 or not 0 < bitrate_index < 15:
+                continue  # Not a valid frame header
+            samplerate = MP3_SAMPLE_RATES[version][rate_index]
+            bitrate = MP3_BITRATES[bitrate_index] * 1000
+            return {'format': 'mp3', 'channels': 1 if data[i + 3] >> 6 == 3 else 2, 'samplerate': samplerate,
+                    'bits': None, 'duration': round((size - offset - i) * 8 / bitrate, 1)}
+    raise ValueError("no MPEG frame header found")
+
+PARSERS = {'.wav': parse_wav, '.flac': parse_flac, '.mp3': parse_mp3}
+
+def read_audio_info(path, size):
+    """Audio format, channels, sample rate, bit depth and duration from the file header."""
+    with open(path, 'rb') as f:
+        return PARSERS[os.path.splitext(path)[1].lower()](f, size)
+
+class TrackCatalog:
+    """Persistent index of the samples directory keyed by file name, size and mtime.
+
+    Only new or changed files have their headers read; the index is kept on disk so a
+    restart does not re-read a multi-GB library, and (when watching) is updated from
+    inotify events instead of re-scanning the directory.
+    """
+
+    def __init__(self, samples_dir, cache_path):
+        self.samples_dir = str(samples_dir)
+        self.cache_path = str(cache_path)
+        self.tracks = {}  # name -> {'size', 'mtime', 'format', 'channels', 'samplerate', 'bits', 'duration'}
+        self.dir_mtime = None
+        self.lock = threading.Lock()
+        self.watching = False
+        self.watch_thread = None
+        self.on_change = None  # Optional callable() after the catalog changed
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+            if cached.get('version') == CATALOG_VERSION:
+                self.tracks = cached['tracks']
+                logger.info(f"Loaded track catalog with {len(self.tracks)} tracks from {self.cache_path}")
+        except (OSError, ValueError, KeyError):
+            self.tracks = {}
+
+    def save(self):
+        try:
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'version': CATALOG_VERSION, 'tracks': self.tracks}, f)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not save track catalog: {e}")
+
+    def _index(self, name, stat, previous):
+        """Catalog entry for one file, re-reading its header only if size or mtime changed."""
+        if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+            return previous
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        try:
+            entry.update(read_audio_info(os.path.join(self.samples_dir, name), stat.st_size))
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Could not read audio header of {name}: {e}")
+            entry.update({'format': None, 'channels': None, 'samplerate': None, 'bits': None, 'duration': None})
+        return entry
+
+    def refresh(self, force=False):
+        """Re-index the directory if it changed since the last scan; returns True if the catalog changed.
+
+        While inotify is watching the directory this is a no-op unless forced.
+        """
+        try:
+            dir_mtime = os.stat(self.samples_dir).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        if not force and (self.watching or (dir_mtime == self.dir_mtime and dir_mtime is not None)):
+            return False
+
+        started = time.monotonic()
+        tracks = {}
+        try:
+            with os.scandir(self.samples_dir) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith(AUDIO_EXTENSIONS) and entry.is_file():
+                        tracks[entry.name] = self._index(entry.name, entry.stat(), self.tracks.get(entry.name))
+        except OSError as e:
+            logger.warning(f"Could not scan {self.samples_dir}: {e}")
+
+        with self.lock:
+            changed = tracks != self.tracks
+            self.tracks = tracks
+            self.dir_mtime = dir_mtime
+        if changed:
+            self.save()
+        logger.info(f"Indexed {len(tracks)} tracks in {(time.monotonic() - started) * 1000:.0f}ms"
+                    f"{' (changed)' if changed else ''}")
+        return changed
+
+    def update_names(self, names):
+        """Re-index individual files after inotify events; returns True if the catalog changed."""
+        changed = False
+        with self.lock:
+            for name in names:
+                if not name.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                path = os.path.join(self.samples_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    stat = None
+                if stat is None or not os.path.isfile(path):
+                    changed = self.tracks.pop(name, None) is not None or changed
+                    continue
+                entry = self._index(name, stat, self.tracks.get(name))
+                if entry != self.tracks.get(name):
+                    self.tracks[name] = entry
+                    changed = True
+        if changed:
+            self.save()
+        return changed
+
+    def get_tracks(self):
+        """Sorted track names."""
+        with self.lock:
+            return sorted(self.tracks)
+
+    def get_metadata(self):
+        """Track name -> format, channels, sample rate, bit depth and duration."""
+        with self.lock:
+            return {name: {key: value for key, value in entry.items() if key not in ('size', 'mtime')}
+                    for name, entry in sorted(self.tracks.items())}
+
+    def get_entry(self, name):
+        """Full catalog entry (including size and mtime) for one track, or None."""
+        with self.lock:
+            entry = self.tracks.get(name)
+            return dict(entry) if entry else None
+
+    def contains(self, name):
+        with self.lock:
+            return name in self.tracks
+
+    def duration(self, name):
+        with self.lock:
+            entry = self.tracks.get(name)
+            return entry.get('duration') if entry else None
+
+    def start_watching(self, on_change=None):
+        """Follow the directory with inotify; returns False when inotify is unavailable."""
+        self.on_change = on_change
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            if libc.inotify_add_watch(fd, self.samples_dir.encode(), WATCH_MASK) < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, f"inotify_add_watch failed for {self.samples_dir}")
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Track catalog cannot watch {self.samples_dir}, falling back to rescans: {e}")
+            return False
+
+        # Catch anything that changed before the watch was in place
+        self.refresh(force=True)
+        self.watching = True
+        self.watch_thread = threading.Thread(target=self.watch_loop, args=(fd,), daemon=True, name="track-catalog")
+        self.watch_thread.start()
+        logger.info(f"Watching {self.samples_dir} for track changes")
+        return True
+
+    def read_events(self, fd):
+        """Names touched by the pending inotify events (None if a full rescan is needed), and
+        whether the directory itself was deleted or moved, which ends the watch."""
+        data = os.read(fd, 64 * 1024)
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                return None, True
+            if mask & IN_Q_OVERFLOW:
+                names = None
+            elif name and names is not None:
+                names.add(name)
+        return names, False
+
+    def watch_loop(self, fd):
+        watch_gone = False
+        try:
+            while self.watching and not watch_gone:
+                ready, _, _ = select.select([fd], [], [], 5.0)
+                if not ready:
+                    continue
+                # Let a burst of events (copying a library) settle and handle it as one update
+                names = set()
+                while ready and names is not None:
+                    events, watch_gone = self.read_events(fd)
+                    names = None if events is None else names | events
+                    ready, _, _ = select.select([fd], [], [], EVENT_SETTLE_TIME)
+                if watch_gone:
+                    break
+                changed = self.refresh(force=True) if names is None else self.update_names(names)
+                if changed and self.on_change:
+                    self.on_change()
+        except Exception as e:
+            logger.error(f"Track catalog watcher stopped: {e}")
+        finally:
+            self.watching = False
+            os.close(fd)
+        if watch_gone:
+            self.rewatch()
+
+    def rewatch(self):
+        """The kernel dropped the watch with the directory: watch the new one, or go back to rescans."""
+        logger.warning(f"{self.samples_dir} was moved or deleted, re-adding the watch")
+        if self.start_watching(self.on_change):
+            changed = True  # start_watching() rescanned
+        else:
+            self.dir_mtime = None
+            changed = self.refresh(force=True)
+        if changed and self.on_change:
+            self.on_change()
+
+    def stop_watching(self):
+        self.watching = False
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+
+try:
+    import alsaaudio
+except ImportError:  # Falls back to piping into aplay
+    alsaaudio = None
+
+logger = logging.getLogger(__name__)
+
+CROSSFADE_MS = 10      # Length of the crossfade spliced in at loop and playlist seams
+PERIOD_FRAMES = 1024   # Frames per device write
+
+def parse_wav_header(data):
+    """Locate the PCM data in a mapped WAV file: (samplerate, channels, data offset, data length)."""
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError("not a RIFF/WAVE file")
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', data, offset)
+        offset += 8
+        if chunk_id == b'fmt ':
+            format_tag, channels, samplerate, _, _, bits = struct.unpack_from('<HHIIHH', data, offset)
+            if format_tag == 0xFFFE:  # WAVE_FORMAT_EXTENSIBLE: the real format tag leads the sub-format GUID
+                format_tag = struct.unpack_from('<H', data, offset + 24)[0]
+            if format_tag != 1 or bits != 16:
+                raise ValueError(f"only 16-bit PCM is supported (format {format_tag}, {bits} bits)")
+            fmt = (samplerate, channels)
+        elif chunk_id == b'data':
+            if not fmt:
+                raise ValueError("data chunk before fmt chunk")
+            length = min(chunk_size, len(data) - offset) if chunk_size not in (0, 0xFFFFFFFF) else len(data) - offset
+            return fmt[0], fmt[1], offset, length - length % (2 * fmt[1])
+        offset += chunk_size + (chunk_size & 1)
+    raise ValueError("no data chunk")
+
+class WavTrack:
+    """A memory-mapped 16-bit PCM WAV file; audio is handed to the device as slices of the mapping."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.samplerate, self.channels, offset, length = parse_wav_header(self.map)
+        except Exception:
+            self.map.close()
+            raise
+        self.frame_bytes = 2 * self.channels
+        self.frames = length // self.frame_bytes
+        self.audio = memoryview(self.map)[offset:offset + length]
+
+    def slice(self, start, end):
+        return self.audio[start * self.frame_bytes:end * self.frame_bytes]
+
+    def close(self):
+        self.audio.release()
+        self.map.close()
+
+def crossfade(outgoing, incoming, frames):
+    """Equal-gain crossfade of the last frames of one track into the first frames of the next."""
+    fading_out = array.array('h', outgoing.slice(outgoing.frames - frames, outgoing.frames).tobytes())
+    fading_in = array.array('h', incoming.slice(0, frames).tobytes())
+    if sys.byteorder == 'big':
+        fading_out.byteswap()
+        fading_in.byteswap()
+    channels = outgoing.channels
+    mixed = array.array('h', bytes(len(fading_in) * 2))
+    for i in range(len(fading_in)):
+        gain = (i // channels) / frames
+        mixed[i] = int(fading_out[i] * (1.0 - gain) + fading_in[i] * gain)
+    if sys.byteorder == 'big':
+        mixed.byteswap()
+    return memoryview(mixed.tobytes())
+
+class AlsaOutput:
+    """Blocking PCM output, via pyalsaaudio or an aplay pipe; reopened when the format changes."""
+
+    def __init__(self, device):
+        self.device = device
+        self.format = None
+        self.pcm = None
+        self.process = None
+
+    def open(self, samplerate, channels):
+        if self.format == (samplerate, channels):
+            return
+        self.close()
+        if alsaaudio is not None:
+            self.pcm = alsaaudio.PCM(type=alsaaudio.PCM_PLAYBACK, mode=alsaaudio.PCM_NORMAL, device=self.device,
+                                     channels=channels, rate=samplerate, format=alsaaudio.PCM_FORMAT_S16_LE,
+                                     periodsize=PERIOD_FRAMES)
+        else:
+            self.process = subprocess.Popen(
+                ['aplay', '-q', '-D', self.device, '-t', 'raw', '-f', 'S16_LE', '-r', str(samplerate), '-c', str(channels)],
+                stdin=subprocess.PIPE, bufsize=0
+            )
+        self.format = (samplerate, channels)
+        logger.info(f"Opened {self.device} at {samplerate}Hz, {channels} channel(s) via {'pyalsaaudio' if self.pcm else 'aplay'}")
+
+    def write(self, data):
+        if self.pcm:
+            self.pcm.write(data)
+        else:
+            self.process.stdin.write(data)
+
+    def close(self):
+        if self.pcm:
+            self.pcm.close()
+            self.pcm = None
+        if self.process:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+        self.format = None
+
+class WavLoopPlayer:
+    """Gapless looping player for PCM WAV tracks and playlists.
+
+    Each track is played straight from its memory mapping. Where one track runs into the
+    next (or into itself when looping) the last and first CROSSFADE_MS are replaced by a
+    precomputed crossfade, so seams are sample-accurate and click-free.
+    """
+
+    def __init__(self, device):
+        self.output = AlsaOutput(device)
+        self.condition = threading.Condition()
+        self.tracks = []
+        self.retired = []
+        self.generation = 0  # Bumped on every load so the playback thread drops what it was playing
+        self.properties = {'pause': False, 'mute': False, 'loop-file': 'no', 'loop-playlist': 'no'}
+        self.current_index = None
+        self.running = True
+
+    # Playlist management
+
+    def load(self, paths):
+        """Replace what is playing with paths; returns the unplayable ones and loads nothing if there are any."""
+        tracks, unplayable = [], []
+        for path in paths:
+            try:
+                tracks.append(WavTrack(path))
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Cannot play {path}: {e}")
+                unplayable.append(path)
+        if unplayable:
+            # A playlist missing tracks is refused as a whole; the current content keeps playing
+            for track in tracks:
+                track.close()
+            return unplayable
+        with self.condition:
+            self.retired.extend(self.tracks)  # Unmapped by the playback thread once it lets go of them
+            self.tracks = tracks
+            self.current_index = 0 if tracks else None
+            self.generation += 1
+            self.condition.notify_all()
+        logger.info(f"Loaded {len(tracks)} track(s)")
+        return []
+
+    def stop(self):
+        self.load([])
+
+    def is_looping(self, key):
+        return str(self.properties[key]).lower() not in ('no', 'false', '0')
+
+    def next_index(self, tracks, index):
+        if self.is_looping('loop-file'):
+            return index
+        if index + 1 < len(tracks):
+            return index + 1
+        return 0 if self.is_looping('loop-playlist') else None
+
+    @staticmethod
+    def seam(outgoing, incoming):
+        """Crossfade length in frames and the crossfade data for one track running into the next."""
+        if (outgoing.samplerate, outgoing.channels) != (incoming.samplerate, incoming.channels):
+            return 0, None  # No splice across a format change; the device is reopened instead
+        frames = min(outgoing.samplerate * CROSSFADE_MS // 1000, outgoing.frames // 4, incoming.frames // 4)
+        return frames, crossfade(outgoing, incoming, frames) if frames else None
+
+    # Playback
+
+    def write(self, data, generation):
+        """Write one buffer unless a newer load superseded it; honours pause and mute."""
+        with self.condition:
+            while self.properties['pause'] and generation == self.generation and self.running:
+                self.condition.wait()
+            if generation != self.generation or not self.running:
+                return False
+            muted = self.properties['mute']
+        self.output.write(bytes(len(data)) if muted else data)
+        return True
+
+    def play_range(self, track, start, end, generation):
+        for offset in range(start, end, PERIOD_FRAMES):
+            if not self.write(track.slice(offset, min(offset + PERIOD_FRAMES, end)), generation):
+                return False
+        return True
+
+    def release_retired(self):
+        with self.condition:
+            retired, self.retired = self.retired, []
+        for track in retired:
+            try:
+                track.close()
+            except BufferError:
+                pass  # A slice is still referenced somewhere; the mapping goes with it
+
+    def run(self):
+        while self.running:
+            self.release_retired()
+            with self.condition:
+                while self.running and self.current_index is None:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                generation = self.generation
+                tracks = self.tracks
+                index = self.current_index
+
+            seams = {}  # (index, next index) -> (frames, crossfade), computed once per load
+            start = 0
+            while index is not None:
+                track = tracks[index]
+                self.output.open(track.samplerate, track.channels)
+                next_index = self.next_index(tracks, index)
+                fade_frames, fade = 0, None
+                if next_index is not None:
+                    if (index, next_index) not in seams:
+                        seams[(index, next_index)] = self.seam(track, tracks[next_index])
+                    fade_frames, fade = seams[(index, next_index)]
+                if not self.play_range(track, start, track.frames - fade_frames, generation):
+                    break
+                if fade is not None and not self.write(fade, generation):
+                    break
+                start = fade_frames  # The next track's first frames were already in the crossfade
+                index = next_index
+                with self.condition:
+                    if generation == self.generation:
+                        self.current_index = index
+            else:
+                logger.info("Playback finished, idle")
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            self.generation += 1
+            self.condition.notify_all()
+        self.output.close()
+
+    # mpv-compatible JSON IPC, so PlaylistManager drives this player exactly like mpv
+
+    def get_property(self, name):
+        with self.condition:
+            if name == 'idle-active':
+                return self.current_index is None
+            if name == 'path':
+                return self.tracks[self.current_index].path if self.current_index is not None else None
+            if name == 'playlist-count':
+                return len(self.tracks)
+            if name in self.properties:
+                return self.properties[name]
+        raise KeyError(name)
+
+    def set_property(self, name, value):
+        if name not in self.properties:
+            raise KeyError(name)
+        with self.condition:
+            self.properties[name] = value
+            self.condition.notify_all()
+
+    def handle_command(self, command):
+        name, args = command[0], command[1:]
+        if name == 'get_property':
+            return self.get_property(args[0])
+        if name == 'set_property':
+            return self.set_property(args[0], args[1])
+        if name in ('loadfile', 'loadlist'):
+            paths = [args[0]]
+            if name == 'loadlist':
+                with open(args[0]) as f:
+                    paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            if not paths:
+                raise ValueError("empty playlist")
+            unplayable = self.load(paths)
+            if unplayable:
+                # Lets PlaylistManager fall back to mpv (e.g. for an MP3 not yet in the sample cache)
+                names = ', '.join(os.path.basename(path) for path in unplayable)
+                raise ValueError(f"not playable (only 16-bit PCM WAV is supported): {names}")
+            return None
+        if name == 'stop':
+            return self.stop()
+        raise KeyError(name)
+
+    def serve_client(self, conn):
+        with conn, conn.makefile('rwb') as stream:
+            for line in stream:
+                request = None
+                try:
+                    request = json.loads(line)
+                    data = self.handle_command(request['command'])
+                    reply = {'error': 'success', 'data': data}
+                except KeyError as e:
+                    reply = {'error': f"unsupported: {e}"}
+                except Exception as e:
+                    reply = {'error': str(e)}
+                if isinstance(request, dict) and 'request_id' in request:
+                    reply['request_id'] = request['request_id']
+                stream.write(json.dumps(reply).encode() + b'\n')
+                stream.flush()
+
+    def serve(self, socket_path):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(4)
+        logger.info(f"IPC server listening on {socket_path}")
+        while self.running:
+            conn, _ = server.accept()
+            threading.Thread(target=self.serve_client, args=(conn,), daemon=True).start()
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped gapless WAV loop player with an mpv-compatible IPC socket")
+    parser.add_argument('--device', default='tee_output', help="ALSA playback device")
+    parser.add_argument('--input-ipc-server', required=True, help="Path of the IPC socket")
+    parser.add_argument('files', nargs='*', help="Optional tracks to start looping straight away")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    player = WavLoopPlayer(args.device)
+    if args.files:
+        player.set_property('loop-playlist', 'inf')
+        player.load(args.files)
+    threading.Thread(target=player.serve, args=(args.input_ipc_server,), daemon=True).start()
+    try:
+        player.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        player.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+AsyncAgentCore module for server-agent
+Runs log tailing, log streams, health monitoring, restarts and status publishing as tasks on one asyncio loop
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+# Import configuration
+from config import (
+    MQTT_BROKER, MQTT_PORT, PI_SYSTEMS, LOG_PATHS, CONNECTION_CONFIG, ASYNC_CONFIG
+)
+
+logger = logging.getLogger(__name__)
+
+class AsyncMQTTBridge:
+    """Drive a paho MQTT client from the asyncio loop instead of paho's network thread."""
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc_task = None
+        self.disconnected = asyncio.Event()
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _on_loop(self, func, *args):
+        """Run func on the event loop; paho may call back from executor threads (connect, publish)."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._socket_opened, sock)
+
+    def _socket_opened(self, sock):
+        self.disconnected.clear()
+        self.loop.add_reader(sock, self.client.loop_read)
+        self.misc_task = self.loop.create_task(self.misc_loop(), name="mqtt-misc")
+
+    def on_socket_close(self, client, userdata, sock):
+        # paho closes the socket right after this callback, so unregister by file descriptor now
+        fd = sock.fileno()
+        self._on_loop(self._socket_closed, fd)
+
+    def _socket_closed(self, fd):
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+        self.disconnected.set()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    async def misc_loop(self):
+        """Run paho's keepalive and retry housekeeping while connected."""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+class AsyncAgentCore:
+    """Asyncio engine for ServerAgent: one event loop, a bounded executor and cancellable tasks."""
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.loop = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=ASYNC_CONFIG['executor_workers'],
+            thread_name_prefix="agent-blocking"
+        )
+        self.mqtt_bridge = None
+        self.stop_event = None
+        self.services = {}  # Long-running tasks by name
+        self.background = set()  # Short-lived tasks such as darkice restarts
+
+    def run(self):
+        """Run the agent until SIGINT/SIGTERM, then shut down in bounded time."""
+        return asyncio.run(self.main())
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.stop_event.set)
+
+        self.setup_mqtt_client()
+
+        # Monitors register with the shared log stream; the streams themselves run as tasks here
+        self.agent.darkice_monitor.restart_runner = self.spawn_blocking
+        self.agent.underrun_monitor.start_monitoring()
+        self.agent.darkice_monitor.start_monitoring()
+        self.agent.log_stream.running = True
+
+        self.start_service("mqtt", self.run_mqtt())
+        for name, path in LOG_PATHS.items():
+            if os.path.exists(path):
+                self.start_service(f"log-tail-{name}", self.tail_log(name, path))
+                logger.info(f"[ASYNC] Started log tailing for {name}: {path}")
+            else:
+                logger.warning(f"[ASYNC] Log file not found: {path}")
+        for system in PI_SYSTEMS:
+            self.start_service(f"logstream-{system['name']}", self.stream_system_logs(system))
+        self.start_service("health-monitor", self.monitor_health())
+        self.start_service("status-publisher", self.publish_status_periodically())
+
+        logger.info(f"[ASYNC] Server agent running {len(self.services)} tasks on one event loop "
+                    f"({ASYNC_CONFIG['executor_workers']} executor threads for blocking work)")
+
+        await self.stop_event.wait()
+        await self.shutdown()
+        return 0
+
+    def setup_mqtt_client(self):
+        """Create the MQTT client and attach it to the event loop."""
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        client.on_connect = self.agent.mqtt_handlers.on_connect
+        client.on_message = self.on_message
+        self.mqtt_bridge = AsyncMQTTBridge(self.loop, client)
+
+        self.agent.mqtt_client = client
+        self.agent.underrun_monitor.set_mqtt_client(client)
+        self.agent.darkice_monitor.set_mqtt_client(client)
+        if self.agent.stream_health:
+            self.agent.stream_health.set_mqtt_client(client)
+        if self.agent.liquidsoap_metrics:
+            self.agent.liquidsoap_metrics.set_mqtt_client(client)
+
+    @property
+    def mqtt_client(self):
+        return self.agent.mqtt_client
+
+    def on_message(self, client, userdata, msg):
+        """Route MQTT messages; blocking work is queued on the command dispatcher, not run on the loop."""
+        self.agent.mqtt_handlers.on_message(client, userdata, msg)
+
+    def start_service(self, name, coro):
+        """Start a long-running task that is expected to live until shutdown."""
+        self.services[name] = self.loop.create_task(coro, name=name)
+
+    def spawn_blocking(self, func, *args):
+        """Run a blocking function in the executor as a tracked task; safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._spawn_blocking, func, args)
+
+    def _spawn_blocking(self, func, args):
+        task = self.loop.create_task(self.run_blocking(func, *args), name=f"blocking-{func.__name__}")
+        self.background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"[ASYNC] Task {task.get_name()} failed: {task.exception()}")
+
+    async def run_blocking(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def run_mqtt(self):
+        """Keep the MQTT connection up, reconnecting after losses."""
+        while True:
+            try:
+                self.mqtt_bridge.disconnected.clear()
+                await self.run_blocking(self.mqtt_client.connect, MQTT_BROKER, MQTT_PORT, 60)
+                logger.info(f"[ASYNC] MQTT client connected to {MQTT_BROKER}:{MQTT_PORT}")
+                await self.mqtt_bridge.disconnected.wait()
+                logger.warning("[ASYNC] MQTT connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[ASYNC] MQTT connection error: {e}")
+            await asyncio.sleep(ASYNC_CONFIG['mqtt_reconnect_interval'])
+
+    async def tail_log(self, name, path):
+        """Continuously tail a log file and print new lines with a prefix."""
+        proc = await asyncio.create_subprocess_exec(
+            'tail', '-F', path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            async for line in proc.stdout:
+                logger.info(f"[{name.upper()}] {line.decode(errors='replace').strip()}")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+    async def read_channel_lines(self, channel):
+        """Yield decoded lines from an SSH channel, waking only when paramiko signals data."""
+        data_ready = asyncio.Event()
+        fd = channel.fileno()  # paramiko backs this with a pipe that is readable while data is buffered
+        self.loop.add_reader(fd, data_ready.set)
+        pending = b''
+        try:
+            while True:
+                await data_ready.wait()
+                data_ready.clear()
+                if not channel.recv_ready():
+                    if channel.eof_received or channel.closed:
+                        break
+                    continue
+                chunk = channel.recv(ASYNC_CONFIG['stream_read_size'])
+                if not chunk:
+                    break
+                pending += chunk
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    yield line.decode('utf-8', errors='replace')
+        finally:
+            self.loop.remove_reader(fd)
+            channel.close()
+
+    async def stream_system_logs(self, system):
+        """Follow the shared journal stream for one system with reconnection logic."""
+        system_name = system['name']
+        log_stream = self.agent.log_stream
+
+        while True:
+            if not log_stream.get_connection(system_name):
+                if not await self.run_blocking(log_stream.setup_ssh_connection, system):
+                    await asyncio.sleep(log_stream.retry_delay(system_name))
+                    continue
+
+            try:
+                channel = await self.run_blocking(
+                    log_stream.open_stream_channel, system_name, log_stream.get_connection(system_name)
+                )
+                async for line in self.read_channel_lines(channel):
+                    log_stream.dispatch_journal_line(system_name, line)
+                logger.warning(f"[ASYNC] Log stream ended for {system_name}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[ASYNC] Error streaming logs from {system_name}: {e}")
+
+            # Mark connection as failed so the next pass reconnects
+            log_stream.drop_connection(system_name)
+            delay = log_stream.retry_delay(system_name)
+            logger.info(f"[ASYNC] Waiting {delay:.0f}s before restarting log stream for {system_name}")
+            await asyncio.sleep(delay)
+
+    async def monitor_health(self):
+        """Periodically log task and connection health."""
+        while True:
+            await asyncio.sleep(CONNECTION_CONFIG['heartbeat_interval'])
+            dead_tasks = [name for name, task in self.services.items() if task.done()]
+            if dead_tasks:
+                logger.warning(f"[ASYNC] {len(dead_tasks)} tasks have stopped: {dead_tasks}")
+            else:
+                logger.debug(f"[ASYNC] All {len(self.services)} tasks are running ({len(self.background)} background)")
+
+            for system_name, line_count in self.agent.log_stream.line_counts.items():
+                logger.info(f"[ASYNC] Monitoring active - {system_name}: {line_count} lines processed")
+            self.agent.log_stream.log_connection_status()
+
+    async def publish_status_periodically(self):
+        """Publish status changes when they are due, waking early when something is marked dirty."""
+        publisher = self.agent.status_publisher
+        wake = asyncio.Event()
+        publisher.wakeup = lambda: self.loop.call_soon_threadsafe(wake.set)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=publisher.seconds_until_due(time.time()))
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+                
+                try:
+                    await self.run_blocking(publisher.run_pending, self.mqtt_client)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"[STATUS] Publisher error: {e}")
+        finally:
+            publisher.wakeup = None
+
+    async def shutdown(self):
+        """Cancel every task, wait a bounded time for them, then release connections."""
+        logger.info("[ASYNC] Shutting down event loop tasks...")
+        tasks = list(self.services.values()) + list(self.background)
+        if self.mqtt_bridge and self.mqtt_bridge.misc_task:
+            tasks.append(self.mqtt_bridge.misc_task)
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=ASYNC_CONFIG['shutdown_timeout'])
+            if pending:
+                logger.warning(f"[ASYNC] {len(pending)} tasks did not stop within {ASYNC_CONFIG['shutdown_timeout']}s: "
+                               f"{[task.get_name() for task in pending]}")
+
+        # Closing SSH connections also unblocks any executor thread still waiting on a Pi
+        self.agent.shutdown()
+        self.executor.shutdown(wait=False, cancel_futures=True)
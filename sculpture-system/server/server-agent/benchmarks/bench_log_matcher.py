@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Log matching benchmark for server-agent
+Compares per-line underrun detection before and after LogMatcher on a journal corpus
+
+Usage (from the server-agent directory):
+    python3 benchmarks/bench_log_matcher.py [corpus] [--debug]
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import UNDERRUN_PATTERNS, UNDERRUN_PREFILTER_KEYWORDS
+from log_matcher import LogMatcher
+
+logger = logging.getLogger("bench")
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal_corpus.log")
+
+
+def legacy_handle_line(line, line_count, system_name="sculpture1", service="player-live"):
+    """Per-line work done by the monitor before LogMatcher: every pattern, then eager debug logging."""
+    if any(pattern.search(line) for pattern in UNDERRUN_PATTERNS):
+        return True
+    if any(keyword in line.lower() for keyword in ['mpv', 'audio', 'pulse', 'ao/']):
+        logger.debug(f"[UNDERRUN] Audio line from {system_name}/{service}: {line}")
+    if line_count % 100 == 0:
+        logger.debug(f"[UNDERRUN] Sample line {line_count} from {system_name}/{service}: {line}")
+    return False
+
+
+def matcher_handle_line(matcher, line, line_count, system_name="sculpture1", service="player-live"):
+    """Per-line work done by the monitor with LogMatcher and debug work gated on the log level."""
+    if matcher.search(line):
+        return True
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    if any(keyword in line.lower() for keyword in ['mpv', 'audio', 'pulse', 'ao/']):
+        logger.debug(f"[UNDERRUN] Audio line from {system_name}/{service}: {line}")
+    if line_count % 100 == 0:
+        logger.debug(f"[UNDERRUN] Sample line {line_count} from {system_name}/{service}: {line}")
+    return False
+
+
+def run_legacy(lines):
+    return sum(1 for count, line in enumerate(lines, 1) if legacy_handle_line(line, count))
+
+
+def run_matcher(matcher, lines):
+    return sum(1 for count, line in enumerate(lines, 1) if matcher_handle_line(matcher, line, count))
+
+
+def measure(func, lines, repeat=5):
+    """Return the best lines/second over several runs."""
+    runs = max(1, 200000 // len(lines))
+    best = min(timeit.repeat(func, number=runs, repeat=repeat))
+    return len(lines) * runs / best
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    corpus = args[0] if args else DEFAULT_CORPUS
+    logger.setLevel(logging.DEBUG if '--debug' in sys.argv else logging.INFO)
+
+    with open(corpus) as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+
+    matcher = LogMatcher(UNDERRUN_PATTERNS, UNDERRUN_PREFILTER_KEYWORDS)
+
+    legacy_hits = run_legacy(lines)
+    matcher_hits = run_matcher(matcher, lines)
+    if legacy_hits != matcher_hits:
+        print(f"Mismatch: legacy found {legacy_hits} underruns, LogMatcher found {matcher_hits}")
+        return 1
+
+    legacy_rate = measure(lambda: run_legacy(lines), lines)
+    matcher_rate = measure(lambda: run_matcher(matcher, lines), lines)
+
+    print(f"Corpus: {corpus} ({len(lines)} lines, {matcher_hits} underruns)")
+    print(f"Log level: {logging.getLevelName(logger.level)}")
+    print(f"Legacy patterns:  {legacy_rate:12,.0f} lines/s")
+    print(f"LogMatcher:       {matcher_rate:12,.0f} lines/s ({matcher_rate / legacy_rate:.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+CommandDispatcher module for server-agent
+Runs MQTT commands on a bounded worker pool with priority lanes, per-key deduplication and latency metrics
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, most urgent first
+PRIORITY_URGENT = 0      # Emergency stop, mute: always has a reserved worker
+PRIORITY_CONTROL = 1     # Plan, mode and track changes, volume
+PRIORITY_BACKGROUND = 2  # Restarts, reboots, summaries, queries
+
+LANE_NAMES = {PRIORITY_URGENT: 'urgent', PRIORITY_CONTROL: 'control', PRIORITY_BACKGROUND: 'background'}
+
+class CommandDispatcher:
+    """Priority command queue drained by a small pool of worker threads.
+
+    One worker only takes urgent commands, so an emergency stop never waits behind a
+    restart. Commands with the same key never run concurrently, and a command submitted
+    while another with its key is still queued replaces it (latest wins).
+    """
+
+    def __init__(self, name, workers=2, max_pending=100):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        self.queue = []  # heap of (priority, seq, key)
+        self.pending = {}  # key -> queued command
+        self.running_keys = set()
+        self.sequence = itertools.count()
+        self.threads = []
+        self.running = False
+        self.metrics = {}  # key -> counters and timings
+
+    def start(self):
+        """Start the reserved urgent worker and the general workers."""
+        self.running = True
+        lanes = [PRIORITY_URGENT] + [PRIORITY_BACKGROUND] * self.workers
+        for index, max_priority in enumerate(lanes):
+            role = 'urgent' if max_priority == PRIORITY_URGENT else f"worker{index}"
+            thread = threading.Thread(target=self.worker_loop, args=(max_priority,),
+                                      daemon=True, name=f"{self.name}-{role}")
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"[DISPATCH] {self.name} dispatcher started with {self.workers} workers + 1 urgent worker")
+
+    def stop(self):
+        """Stop the workers; queued commands are dropped."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def _metrics_for(self, key):
+        return self.metrics.setdefault(key, {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'deduplicated': 0, 'cancelled': 0,
+            'wait_total': 0.0, 'wait_max': 0.0, 'run_total': 0.0, 'run_max': 0.0
+        })
+
+    def submit(self, key, func, *args, priority=PRIORITY_CONTROL, preempt=False):
+        """Queue func(*args) under key; returns False if the queue is full.
+
+        preempt=True drops every queued command of a lower priority (for example, restarts
+        and track changes that were waiting when an emergency stop arrived).
+        """
+        with self.condition:
+            metrics = self._metrics_for(key)
+            metrics['submitted'] += 1
+
+            if preempt:
+                for other_key, command in list(self.pending.items()):
+                    if command['priority'] > priority:
+                        del self.pending[other_key]
+                        self._metrics_for(other_key)['cancelled'] += 1
+                        logger.info(f"[DISPATCH] {key} preempted queued command {other_key}")
+
+            queued = self.pending.get(key)
+            if queued:
+                # Latest wins, but keep the original submit time and the most urgent lane
+                queued['func'], queued['args'] = func, args
+                if priority < queued['priority']:
+                    queued['priority'] = priority
+                    heapq.heappush(self.queue, (priority, next(self.sequence), key))
+                metrics['deduplicated'] += 1
+                logger.debug(f"[DISPATCH] Replaced queued command {key}")
+                return True
+
+            if len(self.pending) >= self.max_pending:
+                logger.warning(f"[DISPATCH] Queue full ({self.max_pending}), dropping command {key}")
+                return False
+
+            self.pending[key] = {'func': func, 'args': args, 'priority': priority, 'submitted': time.time()}
+            heapq.heappush(self.queue, (priority, next(self.sequence), key))
+            self.condition.notify_all()
+            return True
+
+    def _take(self, max_priority):
+        """Pop the most urgent runnable command this worker may take, or None."""
+        skipped = []
+        taken = None
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            priority, _, key = entry
+            command = self.pending.get(key)
+            if not command or command['priority'] != priority:
+                continue  # Stale heap entry (replaced, re-prioritised or preempted)
+            if priority > max_priority:
+                skipped.append(entry)
+                break
+            if key in self.running_keys:
+                skipped.append(entry)
+                continue
+            taken = (key, self.pending.pop(key))
+            break
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+        return taken
+
+    def worker_loop(self, max_priority):
+        """Run commands up to max_priority until stopped."""
+        while True:
+            with self.condition:
+                taken = self._take(max_priority)
+                while self.running and not taken:
+                    self.condition.wait()
+                    taken = self._take(max_priority)
+                if not self.running:
+                    return
+                key, command = taken
+                self.running_keys.add(key)
+
+            started = time.time()
+            failed = False
+            try:
+                command['func'](*command['args'])
+            except Exception as e:
+                failed = True
+                logger.error(f"[DISPATCH] Command {key} failed: {e}")
+            finished = time.time()
+
+            with self.condition:
+                self.running_keys.discard(key)
+                self.record(key, started - command['submitted'], finished - started, failed)
+                self.condition.notify_all()
+
+    def record(self, key, wait, run, failed):
+        """Update latency metrics for one finished command."""
+        metrics = self._metrics_for(key)
+        metrics['failed' if failed else 'completed'] += 1
+        metrics['wait_total'] += wait
+        metrics['wait_max'] = max(metrics['wait_max'], wait)
+        metrics['run_total'] += run
+        metrics['run_max'] = max(metrics['run_max'], run)
+        logger.debug(f"[DISPATCH] {key} waited {wait * 1000:.0f}ms, ran {run * 1000:.0f}ms")
+
+    def get_metrics(self):
+        """Per-key counts and average/max queue wait and run time in milliseconds."""
+        with self.condition:
+            summary = {}
+            for key, metrics in self.metrics.items():
+                finished = metrics['completed'] + metrics['failed']
+                summary[key] = {
+                    'submitted': metrics['submitted'],
+                    'completed': metrics['completed'],
+                    'failed': metrics['failed'],
+                    'deduplicated': metrics['deduplicated'],
+                    'cancelled': metrics['cancelled'],
+                    'wait_avg_ms': round(metrics['wait_total'] / finished * 1000, 1) if finished else None,
+                    'wait_max_ms': round(metrics['wait_max'] * 1000, 1),
+                    'run_avg_ms': round(metrics['run_total'] / finished * 1000, 1) if finished else None,
+                    'run_max_ms': round(metrics['run_max'] * 1000, 1),
+                }
+            queued = {lane: 0 for lane in LANE_NAMES.values()}
+            for command in self.pending.values():
+                queued[LANE_NAMES[command['priority']]] += 1
+            return {
+                'queued': queued,
+                'running': sorted(self.running_keys),
+                'commands': summary
+            }
@@ -6,7 +6,9 @@ Contains all configuration constants and default values
 
 import os
 import re
-from collections import defaultdict, deque
+from collections import defaultdict
+
+from rolling_counter import RollingCounter
 
 # MQTT Configuration
 MQTT_BROKER = os.environ.get('CONTROL_HOST', 'localhost')
@@ -16,10 +18,71 @@ STATUS_TOPIC = "system/status"
 PLAN_TOPIC = "system/plan"
 UNDERRUN_TOPIC = "system/underruns"
 DARKICE_TOPIC = "system/darkice"
+HISTORY_TOPIC = "system/history"
+DISPATCH_TOPIC = "system/dispatch"
+STREAMS_TOPIC = "system/streams"
+LIQUIDSOAP_METRICS_TOPIC = "system/liquidsoap/metrics"
+AUDIO_PARAMS_TOPIC = "system/audio/params"  # full DSP parameter set and preset names (retained)
+SCULPTURE_STATUS_TOPIC = "sculpture/+/status"
+CLOCK_PING_TOPIC = "system/clock/ping"  # answered on sculpture/<id>/clock
 
 # Liquidsoap telnet configuration
 LIQUIDSOAP_HOST = 'localhost'
 LIQUIDSOAP_PORT = 1234
+LIQUIDSOAP_CONFIG = {
+    'timeout': 5,  # seconds for connect and for each response
+}
+
+# Liquidsoap metering (get_metrics): input/mix levels and readiness, published on LIQUIDSOAP_METRICS_TOPIC
+LIQUIDSOAP_METRICS_CONFIG = {
+    'enabled': True,
+    'poll_interval': 2,  # seconds between get_metrics polls (and publishes)
+    'floor_db': -90.0,  # levels below this (including silence, -inf) are reported as this
+}
+
+# Icecast server (stream mounts for each sculpture)
+ICECAST_HOST = 'localhost'
+ICECAST_PORT = 8000
+
+# Stream health: Icecast statistics for every sculpture mount, plus an Ogg reader per mount
+STREAM_HEALTH_CONFIG = {
+    'enabled': True,
+    'poll_interval': 5,  # seconds between Icecast statistics polls (and system/streams publishes)
+    'admin_user': 'admin',  # /admin/stats credentials; the public status-json.xsl is used if refused
+    'admin_password': 'hackme',
+    'ogg_readers': True,  # listen to each mount (counts as one Icecast listener per mount)
+    'stall_timeout': 5,  # seconds without new bytes or pages before a mount is reported stalled
+    'gap_threshold': 0.5,  # seconds a page may arrive later than its audio time before it counts as a gap
+    'silence_bytes_per_sec': 1000,  # Vorbis payload rate below which a stream is considered silent
+    'silence_seconds': 5,  # window over which the payload rate is measured
+}
+
+# DSP parameters settable from system/audio/cmd (each maps to a set_<param> Liquidsoap command)
+AUDIO_PARAMS = [
+    'compress_ratio', 'compress_threshold', 'attack_time', 'release_time',
+    'highpass_freq', 'lowpass_freq', 'delay_time', 'delay_feedback',
+    'gate_threshold', 'normalize_target'
+]
+
+# Named DSP parameter sets saved and loaded with save_preset/load_preset on system/audio/cmd
+AUDIO_PRESETS_FILE = '/opt/sculpture-system/server-agent/audio_presets.json'
+
+# MQTT command dispatch: commands run on worker threads instead of the MQTT network thread
+DISPATCH_CONFIG = {
+    'workers': 2,  # general workers; one more is reserved for urgent commands
+    'max_pending': 100,  # queued commands before new ones are dropped
+}
+
+# Parameter updates arriving within this window are collapsed to the latest value per parameter
+PARAM_COALESCE_CONFIG = {
+    'window': 0.05,  # seconds
+}
+
+# Plan changes are announced with an apply_at time this far ahead so Liquidsoap and every Pi
+# switch together (Pis convert it with their clock offset from CLOCK_PING_TOPIC round trips)
+PLAN_SCHEDULE_CONFIG = {
+    'lead_time': 0.4,  # seconds; must cover MQTT delivery to the slowest Pi
+}
 
 # Plan state management
 PLAN_STATE_FILE = "/tmp/current_plan.json"
@@ -54,13 +117,22 @@ DARKICE_SERVICES = ["darkice"]
 # Connection configuration
 CONNECTION_CONFIG = {
     'ssh_timeout': 15,
-    'connection_retry_interval': 30,  # seconds between connection attempts
+    'connection_retry_interval': 30,  # longest wait between connection attempts (the backoff cap)
     'max_connection_attempts': 3,
     'ssh_key_file': '/home/unix/.ssh/id_rsa',  # Explicit path to unix user SSH key
     'test_connection': True,  # Test connection before starting monitoring
     'heartbeat_interval': 30,  # seconds between heartbeat logs
 }
 
+# Host selection: TCP connects to all of a system's host names are raced, the first to answer is used
+HOST_RESOLVER_CONFIG = {
+    'connect_timeout': 3,  # seconds for a TCP connect to port 22
+    'stagger': 0.25,  # seconds between starting successive candidates (last good host first)
+    'address_ttl': 300,  # seconds a resolved address is reused
+    'negative_ttl': 30,  # seconds a failed lookup is remembered
+    'backoff_initial': 2,  # seconds before the first retry; doubles per failure up to connection_retry_interval
+}
+
 # Paths to logs you want to tail
 LOG_PATHS = {
     "icecast2": "/var/log/icecast2/icecast.log",
@@ -88,13 +160,58 @@ UNDERRUN_PATTERNS = [
     re.compile(r'ao_pulse.*underrun', re.IGNORECASE),
 ]
 
+# Literal keywords (case-insensitive) that every underrun pattern contains; lines without one skip the regexes
+UNDERRUN_PREFILTER_KEYWORDS = ['underrun']
+
+# Darkice buffer overrun detection pattern and its pre-filter keywords
+BUFFER_OVERRUN_PATTERNS = [
+    re.compile(r'buffer overrun', re.IGNORECASE),
+]
+BUFFER_OVERRUN_PREFILTER_KEYWORDS = ['overrun']
+
 # Logging configuration
 LOG_LEVEL = "DEBUG"
 LOG_FORMAT = '%(asctime)s %(levelname)s - %(message)s'
 LOG_DATE_FORMAT = '%H:%M'
 
-# Status publishing interval
-STATUS_PUBLISH_INTERVAL = 30  # seconds
+# Status publishing: topics are published when they change, after a short debounce window
+STATUS_PUBLISH_INTERVAL = 30  # seconds between Liquidsoap plan drift checks
+STATUS_DEBOUNCE_INTERVAL = 0.5  # seconds to coalesce bursts of changes into one publish
+STATUS_HEARTBEAT_INTERVAL = 300  # seconds between full refreshes of every status topic
+
+# Agent engine: "threaded" (one thread per task) or "asyncio" (all tasks on one event loop)
+AGENT_ENGINE = "threaded"
+
+# Asyncio engine configuration
+ASYNC_CONFIG = {
+    'executor_workers': 8,  # bounded pool for blocking work (SSH setup, Liquidsoap, restarts)
+    'shutdown_timeout': 10,  # seconds to wait for cancelled tasks on shutdown
+    'mqtt_reconnect_interval': 5,  # seconds between MQTT reconnect attempts
+    'stream_read_size': 65536,  # bytes read from an SSH channel per wakeup
+}
+
+# Persistent history of events and sculpture status samples (SQLite, WAL mode)
+HISTORY_CONFIG = {
+    'enabled': True,
+    'db_path': '/opt/sculpture-system/server-agent/history.db',
+    'batch_size': 500,  # records per write transaction
+    'flush_interval': 2,  # seconds before a partial batch is written
+    'max_queue': 10000,  # records buffered before new ones are dropped
+    'raw_retention_days': 2,  # full-resolution status samples
+    'rollup_retention_days': 90,  # one-minute min/max/avg rollups
+    'event_retention_days': 90,  # underruns, overruns and restarts
+    'retention_interval': 3600,  # seconds between retention passes
+}
+
+# Rolling event counters: per-second buckets for short windows, per-minute buckets for long ones
+ROLLING_COUNTER_CONFIG = {
+    'second_buckets': 300,  # 5 minutes at one-second resolution
+    'minute_buckets': 1440,  # 24 hours at one-minute resolution
+}
+
+def create_rolling_counter():
+    """Create a rolling event counter sized by ROLLING_COUNTER_CONFIG"""
+    return RollingCounter(ROLLING_COUNTER_CONFIG['second_buckets'], ROLLING_COUNTER_CONFIG['minute_buckets'])
 
 # Data structures for tracking statistics
 def create_underrun_stats():
@@ -102,7 +219,7 @@ def create_underrun_stats():
     return defaultdict(lambda: defaultdict(lambda: {
         'count': 0,
         'last_underrun': None,
-        'recent_underruns': deque(maxlen=100)  # Keep last 100 underruns
+        'recent_underruns': create_rolling_counter()  # Underruns per second/minute
     }))
 
 def create_darkice_stats():
@@ -110,7 +227,7 @@ def create_darkice_stats():
     return defaultdict(lambda: defaultdict(lambda: {
         'buffer_overrun_count': 0,
         'last_buffer_overrun': None,
-        'recent_buffer_overruns': deque(maxlen=50),  # Keep last 50 buffer overruns
+        'recent_buffer_overruns': create_rolling_counter(),  # Buffer overruns per second/minute
         'restart_attempts': 0,
         'last_restart_attempt': None,
         'consecutive_overruns': 0,
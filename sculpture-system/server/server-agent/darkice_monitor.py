@@ -1,36 +1,36 @@
 #!/usr/bin/env python3
 """
 DarkiceMonitor module for server-agent
-Handles SSH-based monitoring of darkice buffer overruns and automatic restart functionality
+Detects darkice buffer overruns in the shared log stream and handles automatic restarts
 """
 
 import logging
 import threading
 import time
 import json
-import paramiko
-import re
 from datetime import datetime, timedelta
-from collections import deque
 
 # Import configuration
 from config import (
-    DARKICE_SERVICES, CONNECTION_CONFIG, DARKICE_CONFIG, 
+    DARKICE_SERVICES, DARKICE_CONFIG, BUFFER_OVERRUN_PATTERNS, BUFFER_OVERRUN_PREFILTER_KEYWORDS,
     DARKICE_TOPIC, create_darkice_stats
 )
+from log_matcher import LogMatcher
 
 logger = logging.getLogger(__name__)
 
 class DarkiceMonitor:
     """Monitor darkice services for buffer overrun issues and handle restarts."""
     
-    def __init__(self, pi_systems):
+    def __init__(self, pi_systems, log_stream, history_store=None):
         self.pi_systems = pi_systems
-        self.ssh_connections = {}
-        self.monitoring_threads = {}
+        self.log_stream = log_stream  # Shared SSH connections and journal stream
+        self.history_store = history_store  # Optional persistent event history
         self.mqtt_client = None  # Will be set after initialization
-        self.buffer_overrun_pattern = re.compile(r'buffer overrun', re.IGNORECASE)
+        self.on_stats_changed = None  # Optional callable(key) told when the darkice summary changes
+        self.buffer_overrun_matcher = LogMatcher(BUFFER_OVERRUN_PATTERNS, BUFFER_OVERRUN_PREFILTER_KEYWORDS)
         self.restart_locks = {}  # Per-system restart locks
+        self.restart_runner = None  # Optional callable(func, *args) used instead of a restart thread
         self.darkice_stats = create_darkice_stats()
         
         # Initialize restart locks
@@ -38,74 +38,10 @@ class DarkiceMonitor:
             for service in DARKICE_SERVICES:
                 self.restart_locks[f"{system['name']}-{service}"] = threading.Lock()
         
-    def setup_ssh_connection(self, system):
-        """Setup SSH connection to a Pi system with multiple host fallbacks."""
-        system_name = system['name']
-        
-        for host in system['hosts']:
-            try:
-                logger.info(f"[DARKICE] Attempting SSH connection to {system_name} at {host} as user {system['user']}")
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                
-                connect_kwargs = {
-                    'hostname': host,
-                    'username': system['user'],
-                    'timeout': CONNECTION_CONFIG['ssh_timeout'],
-                }
-                
-                if CONNECTION_CONFIG['ssh_key_file']:
-                    connect_kwargs['key_filename'] = CONNECTION_CONFIG['ssh_key_file']
-                
-                ssh.connect(**connect_kwargs)
-                
-                # Test the connection
-                stdin, stdout, stderr = ssh.exec_command('echo "SSH connection test"', timeout=5)
-                test_result = stdout.read().decode().strip()
-                if test_result == "SSH connection test":
-                    self.ssh_connections[system_name] = ssh
-                    logger.info(f"[DARKICE] SSH connection established to {system_name} at {host}")
-                    return True
-                else:
-                    ssh.close()
-                    continue
-                    
-            except Exception as e:
-                logger.error(f"[DARKICE] Failed to connect to {system_name} at {host}: {e}")
-                if 'ssh' in locals():
-                    try:
-                        ssh.close()
-                    except:
-                        pass
-                continue
-        
-        logger.error(f"[DARKICE] All connection attempts failed for {system_name}")
-        return False
-    
-    def monitor_darkice_service(self, system_name, service):
-        """Monitor darkice service for buffer overrun issues."""
-        ssh = self.ssh_connections.get(system_name)
-        if not ssh:
-            return
-            
-        try:
-            # Use journalctl to follow the service logs
-            command = f"journalctl -u {service} -f -o cat --no-hostname"
-            stdin, stdout, stderr = ssh.exec_command(command)
-            
-            logger.info(f"[DARKICE] Started monitoring {service} on {system_name}")
-            
-            for line in iter(stdout.readline, ""):
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # Check for buffer overrun patterns
-                if self.buffer_overrun_pattern.search(line):
-                    self.handle_buffer_overrun(system_name, service, line)
-                    
-        except Exception as e:
-            logger.error(f"[DARKICE] Error monitoring {service} on {system_name}: {e}")
+    def handle_log_line(self, system_name, service, line):
+        """Check one journal line from the shared log stream for buffer overruns."""
+        if self.buffer_overrun_matcher.search(line):
+            self.handle_buffer_overrun(system_name, service, line)
     
     def handle_buffer_overrun(self, system_name, service, log_line):
         """Handle buffer overrun detection and restart logic."""
@@ -115,16 +51,13 @@ class DarkiceMonitor:
         stats = self.darkice_stats[system_name][service]
         stats['buffer_overrun_count'] += 1
         stats['last_buffer_overrun'] = timestamp
-        stats['recent_buffer_overruns'].append({
-            'timestamp': timestamp,
-            'log_line': log_line
-        })
+        stats['recent_buffer_overruns'].add()
+        if self.history_store:
+            self.history_store.record_event(system_name, service, 'overrun', timestamp.timestamp())
         stats['consecutive_overruns'] += 1
         
         # Check for spam condition
-        recent_window = timestamp - timedelta(seconds=DARKICE_CONFIG['overrun_spam_window'])
-        recent_count = sum(1 for overrun in stats['recent_buffer_overruns'] 
-                          if overrun['timestamp'] > recent_window)
+        recent_count = stats['recent_buffer_overruns'].count(DARKICE_CONFIG['overrun_spam_window'])
         
         if recent_count >= DARKICE_CONFIG['overrun_spam_threshold']:
             stats['overrun_spam_detected'] = True
@@ -135,6 +68,7 @@ class DarkiceMonitor:
         
         # Publish to MQTT
         self.publish_buffer_overrun_event(system_name, service, timestamp, log_line, stats)
+        self.notify_stats_changed()
         
         # Check if restart is needed
         if (stats['consecutive_overruns'] >= DARKICE_CONFIG['buffer_overrun_threshold'] or 
@@ -159,10 +93,15 @@ class DarkiceMonitor:
             
             stats['restart_attempts'] += 1
             stats['last_restart_attempt'] = datetime.now()
+            self.notify_stats_changed()
             
             logger.info(f"[DARKICE] Attempting to restart {service} on {system_name} (attempt {stats['restart_attempts']})")
             
-            # Use a separate thread for restart to avoid blocking monitoring
+            # Run the restart elsewhere to avoid blocking monitoring
+            if self.restart_runner:
+                self.restart_runner(self.perform_darkice_restart, system_name, service)
+                return
+            
             restart_thread = threading.Thread(
                 target=self.perform_darkice_restart,
                 args=(system_name, service),
@@ -172,7 +111,7 @@ class DarkiceMonitor:
     
     def perform_darkice_restart(self, system_name, service):
         """Perform the actual darkice restart with multiple strategies."""
-        ssh = self.ssh_connections.get(system_name)
+        ssh = self.log_stream.get_connection(system_name)
         if not ssh:
             logger.error(f"[DARKICE] No SSH connection available for restart of {system_name}/{service}")
             return
@@ -239,6 +178,12 @@ class DarkiceMonitor:
         stats['consecutive_overruns'] = 0
         stats['overrun_spam_detected'] = False
         logger.info(f"[DARKICE] Reset overrun counters for {system_name}/{service}")
+        self.notify_stats_changed()
+    
+    def notify_stats_changed(self):
+        """Tell the status publisher that the darkice summary has changed."""
+        if self.on_stats_changed:
+            self.on_stats_changed('darkice')
     
     def publish_buffer_overrun_event(self, system_name, service, timestamp, log_line, stats):
         """Publish buffer overrun event to MQTT."""
@@ -262,7 +207,10 @@ class DarkiceMonitor:
             logger.error(f"[DARKICE] Failed to publish buffer overrun event: {e}")
     
     def publish_restart_success(self, system_name, service):
-        """Publish restart success event to MQTT."""
+        """Record restart success in history and publish it to MQTT."""
+        if self.history_store:
+            self.history_store.record_event(system_name, service, 'restart_success')
+        
         try:
             restart_data = {
                 'system': system_name,
@@ -280,7 +228,10 @@ class DarkiceMonitor:
             logger.error(f"[DARKICE] Failed to publish restart success: {e}")
     
     def publish_restart_failure(self, system_name, service):
-        """Publish restart failure event to MQTT."""
+        """Record restart failure in history and publish it to MQTT."""
+        if self.history_store:
+            self.history_store.record_event(system_name, service, 'restart_failure')
+        
         try:
             restart_data = {
                 'system': system_name,
@@ -298,26 +249,9 @@ class DarkiceMonitor:
             logger.error(f"[DARKICE] Failed to publish restart failure: {e}")
     
     def start_monitoring(self):
-        """Start monitoring all systems and services."""
+        """Register buffer overrun detection with the shared log stream."""
         logger.info(f"[DARKICE] Starting darkice monitoring for {len(self.pi_systems)} systems")
-        
-        for system in self.pi_systems:
-            if self.setup_ssh_connection(system):
-                for service in DARKICE_SERVICES:
-                    thread_name = f"darkice-{system['name']}-{service}"
-                    thread = threading.Thread(
-                        target=self.monitor_darkice_service,
-                        args=(system['name'], service),
-                        daemon=True,
-                        name=thread_name
-                    )
-                    thread.start()
-                    self.monitoring_threads[thread_name] = thread
-                    logger.info(f"[DARKICE] Started monitoring thread: {thread_name}")
-            else:
-                logger.error(f"[DARKICE] Failed to establish SSH connection to {system['name']}")
-        
-        logger.info(f"[DARKICE] Total darkice monitoring threads created: {len(self.monitoring_threads)}")
+        self.log_stream.register_consumer(DARKICE_SERVICES, self.handle_log_line)
     
     def get_darkice_summary(self):
         """Get a summary of darkice statistics."""
@@ -325,8 +259,7 @@ class DarkiceMonitor:
         for system_name, services in self.darkice_stats.items():
             summary[system_name] = {}
             for service_name, stats in services.items():
-                recent_count = sum(1 for overrun in stats['recent_buffer_overruns'] 
-                                 if overrun['timestamp'] > datetime.now() - timedelta(hours=1))
+                recent_count = stats['recent_buffer_overruns'].count(60 * 60)
                 summary[system_name][service_name] = {
                     'total_buffer_overruns': stats['buffer_overrun_count'],
                     'recent_overruns_1h': recent_count,
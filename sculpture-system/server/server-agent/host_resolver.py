@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+HostResolver module for server-agent
+Picks a reachable address for each Pi system by racing TCP connects to all of its host names
+"""
+
+import logging
+import random
+import socket
+import threading
+import time
+
+# Import configuration
+from config import HOST_RESOLVER_CONFIG, CONNECTION_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class HostResolver:
+    """Happy-eyeballs style host selection with an address cache and per-system backoff.
+
+    connect() starts a resolve-and-connect attempt for every candidate host name of a system,
+    staggered by a fraction of a second (the last host that worked goes first), and returns
+    the first socket to connect; the losers are closed. An offline Pi therefore costs one
+    connect timeout instead of one SSH timeout per host name. Lookups are cached for
+    address_ttl (failed ones for negative_ttl), and a system that keeps failing is retried
+    with exponential backoff so offline sculptures are probed cheaply in the background.
+    """
+
+    def __init__(self, port=22):
+        self.port = port
+        self.connect_timeout = HOST_RESOLVER_CONFIG['connect_timeout']
+        self.stagger = HOST_RESOLVER_CONFIG['stagger']
+        self.address_ttl = HOST_RESOLVER_CONFIG['address_ttl']
+        self.negative_ttl = HOST_RESOLVER_CONFIG['negative_ttl']
+        self.backoff_initial = HOST_RESOLVER_CONFIG['backoff_initial']
+        self.backoff_max = CONNECTION_CONFIG['connection_retry_interval']
+        self.addresses = {}  # host -> (expires, [(family, sockaddr)] or None for a failed lookup)
+        self.failures = {}  # system name -> consecutive failed attempts
+        self.preferred = {}  # system name -> host that connected last
+        self.lock = threading.Lock()
+
+    def resolve(self, host):
+        """Resolve a host name to connectable addresses, using the cache while it is fresh."""
+        now = time.monotonic()
+        with self.lock:
+            cached = self.addresses.get(host)
+        if cached and cached[0] > now:
+            if cached[1] is None:
+                raise socket.gaierror(f"{host}: lookup failed recently (cached)")
+            return cached[1]
+
+        try:
+            infos = socket.getaddrinfo(host, self.port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            with self.lock:
+                self.addresses[host] = (time.monotonic() + self.negative_ttl, None)
+            raise
+        addresses = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+        with self.lock:
+            self.addresses[host] = (time.monotonic() + self.address_ttl, addresses)
+        return addresses
+
+    def forget(self, host):
+        """Drop a cached lookup, e.g. after its address stopped answering."""
+        with self.lock:
+            self.addresses.pop(host, None)
+
+    def _attempt(self, host, delay, race):
+        """Resolve and connect one candidate; the first to succeed claims the race."""
+        if race['done'].wait(delay):
+            return
+        try:
+            for family, sockaddr in self.resolve(host):
+                if race['done'].is_set():
+                    return
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.settimeout(self.connect_timeout)
+                try:
+                    sock.connect(sockaddr)
+                except OSError as e:
+                    sock.close()
+                    race['errors'][host] = str(e)
+                    continue
+                with self.lock:
+                    won = race['winner'] is None
+                    if won:
+                        race['winner'] = (host, sock)
+                if won:
+                    race['done'].set()
+                else:
+                    sock.close()
+                return
+            self.forget(host)  # Every address failed: re-resolve next time
+        except OSError as e:
+            race['errors'][host] = str(e)
+        finally:
+            with self.lock:
+                race['pending'] -= 1
+                if race['pending'] == 0:
+                    race['done'].set()
+
+    def connect(self, system):
+        """Race all hosts of a system; returns (host, connected socket) or (None, None)."""
+        system_name = system['name']
+        hosts = list(system['hosts'])
+        preferred = self.preferred.get(system_name)
+        if preferred in hosts:
+            hosts.remove(preferred)
+            hosts.insert(0, preferred)
+
+        race = {'done': threading.Event(), 'winner': None, 'pending': len(hosts), 'errors': {}}
+        started = time.monotonic()
+        for index, host in enumerate(hosts):
+            threading.Thread(target=self._attempt, args=(host, index * self.stagger, race),
+                             daemon=True, name=f"resolve-{host}").start()
+        race['done'].wait(self.connect_timeout + len(hosts) * self.stagger + 1)
+        with self.lock:
+            winner = race['winner']
+            race['winner'] = winner or (None, None)  # Late connects close their socket
+
+        if winner:
+            self.preferred[system_name] = winner[0]
+            logger.debug(f"[RESOLVER] {system_name} reachable via {winner[0]} in {(time.monotonic() - started) * 1000:.0f}ms")
+            return winner
+        self.record_failure(system_name)
+        logger.info(f"[RESOLVER] {system_name} unreachable: {race['errors'] or 'timed out'}")
+        return None, None
+
+    def record_success(self, system_name):
+        """Reset the backoff once a system is fully connected."""
+        self.failures.pop(system_name, None)
+
+    def record_failure(self, system_name):
+        self.failures[system_name] = self.failures.get(system_name, 0) + 1
+
+    def retry_delay(self, system_name):
+        """Seconds to wait before the next attempt: exponential in the failure count, with jitter."""
+        failures = self.failures.get(system_name, 0)
+        if not failures:
+            return self.backoff_initial
+        delay = min(self.backoff_max, self.backoff_initial * 2 ** (failures - 1))
+        return delay * random.uniform(0.9, 1.1)
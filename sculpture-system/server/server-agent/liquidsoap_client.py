@@ -6,41 +6,84 @@ Handles communication with Liquidsoap via telnet
 
 import logging
 import socket
+import threading
 
 # Import configuration
-from config import LIQUIDSOAP_HOST, LIQUIDSOAP_PORT
+from config import LIQUIDSOAP_HOST, LIQUIDSOAP_PORT, LIQUIDSOAP_CONFIG
 
 logger = logging.getLogger(__name__)
 
 class LiquidSoapClient:
-    """Simple client to communicate with Liquidsoap via telnet."""
+    """Client for Liquidsoap's telnet server over one persistent, pipelined connection."""
     
     def __init__(self, host=None, port=None):
         self.host = host or LIQUIDSOAP_HOST
         self.port = port or LIQUIDSOAP_PORT
+        self.sock = None
+        self.buffer = b''
+        self.lock = threading.Lock()  # One request/response exchange at a time
+    
+    def connect(self):
+        """Open the telnet connection."""
+        self.sock = socket.create_connection((self.host, self.port), timeout=LIQUIDSOAP_CONFIG['timeout'])
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b''
+        logger.debug(f"[LIQUIDSOAP] Connected to {self.host}:{self.port}")
+    
+    def close(self):
+        """Close the telnet connection; the next command reconnects."""
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.buffer = b''
+    
+    def read_response(self):
+        """Read one response, which Liquidsoap terminates with an END line."""
+        lines = []
+        while True:
+            while b'\n' not in self.buffer:
+                chunk = self.sock.recv(4096)
+                if not chunk:
+                    raise ConnectionError("connection closed by Liquidsoap")
+                self.buffer += chunk
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            line = line.decode(errors='replace').rstrip('\r')
+            if line == 'END':
+                return '\n'.join(lines).strip()
+            lines.append(line)
+    
+    def send_commands(self, commands):
+        """Send several commands in one write and return their responses in order (None on failure)."""
+        if not commands:
+            return []
+        
+        payload = ''.join(f"{command}\n" for command in commands).encode()
+        with self.lock:
+            for attempt in range(2):
+                reused = self.sock is not None
+                try:
+                    if not reused:
+                        self.connect()
+                    self.sock.sendall(payload)
+                    return [self.read_response() for _ in commands]
+                except Exception as e:
+                    self.close()
+                    # Liquidsoap drops idle clients, so a reused connection may be stale: retry once on a new one
+                    if reused and attempt == 0:
+                        logger.debug(f"[LIQUIDSOAP] Connection lost ({e}), reconnecting")
+                        continue
+                    logger.error(f"[LIQUIDSOAP] Failed to send command to Liquidsoap: {e}")
+                    return [None] * len(commands)
     
     def send_command(self, command, *args):
         """Send a command to Liquidsoap via telnet."""
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.settimeout(5)  # 5 second timeout
-                sock.connect((self.host, self.port))
-                
-                # Build command with arguments
-                if args:
-                    full_command = f"{command} {' '.join(str(arg) for arg in args)}"
-                else:
-                    full_command = command
-                
-                # Send command
-                sock.sendall(f"{full_command}\n".encode())
-                
-                # Read response
-                response = sock.recv(1024).decode().strip()
-                return response
-        except Exception as e:
-            logger.error(f"[LIQUIDSOAP] Failed to send command to Liquidsoap: {e}")
-            return None
+        # Build command with arguments
+        if args:
+            command = f"{command} {' '.join(str(arg) for arg in args)}"
+        return self.send_commands([command])[0]
     
     def set_plan(self, plan):
         """Set the current plan in Liquidsoap."""
@@ -51,6 +94,67 @@ class LiquidSoapClient:
         """Get the current plan from Liquidsoap."""
         return self.send_command("get_plan")
     
+    @staticmethod
+    def parse_params(response):
+        """Parse a get_all_params/set_params reply ("name=value,...") into floats; None if it is not one."""
+        if not response or '=' not in response:
+            return None
+        params = {}
+        for pair in response.split(','):
+            name, _, value = pair.partition('=')
+            try:
+                params[name.strip()] = float(value)
+            except ValueError:
+                return None
+        return params
+    
+    def get_all_params(self):
+        """Current value of every DSP parameter, or None on failure."""
+        return self.parse_params(self.send_command("get_all_params"))
+    
+    def set_params(self, params):
+        """Set several DSP parameters in one command (all or nothing).
+
+        Values must already be numbers. Returns every parameter's value afterwards, or None
+        if Liquidsoap is unreachable; raises ValueError with the reply if Liquidsoap rejected
+        the command.
+        """
+        response = self.send_command("set_params " + ','.join(f"{name}={value}" for name, value in params.items()))
+        if response is None:
+            return None
+        current = self.parse_params(response)
+        if current is None:
+            raise ValueError(response)
+        return current
+    
+    def get_metrics(self):
+        """Levels and state of every input and mix from get_metrics, as {name: {field: value}} (None on failure)."""
+        response = self.send_command("get_metrics")
+        if not response or response.startswith('ERROR'):
+            return None  # Unreachable, or an older main.liq without get_metrics
+        metrics = {}
+        for line in response.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            name, *fields = parts
+            # Only "<name> key=value ..." lines are metrics; anything else is not ours
+            if not fields or not all(field.partition('=')[1] and not field.startswith('=') for field in fields):
+                logger.debug(f"[LIQUIDSOAP] Ignoring get_metrics line: {line!r}")
+                continue
+            values = {}
+            for field in fields:
+                key, _, value = field.partition('=')
+                if value in ('true', 'false'):
+                    values[key] = value == 'true'
+                else:
+                    try:
+                        values[key] = float(value)
+                    except ValueError:
+                        values[key] = value
+            metrics[name] = values
+        return metrics or None
+    
     def test_connection(self):
         """Test the connection to Liquidsoap."""
         try:
@@ -63,4 +167,4 @@ class LiquidSoapClient:
                 return False
         except Exception as e:
             logger.error(f"[LIQUIDSOAP] Connection test failed: {e}")
-            return False 
\ No newline at end of file
+            return False
\ No newline at end of file
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+LiquidsoapMetrics module for server-agent
+Polls Liquidsoap's get_metrics command and publishes input and mix levels, flagging starving mixes
+"""
+
+import json
+import logging
+import math
+import threading
+import time
+
+# Import configuration
+from config import PI_SYSTEMS, LIQUIDSOAP_METRICS_TOPIC, LIQUIDSOAP_METRICS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+def level(value):
+    """A dB level clamped to the configured floor (Liquidsoap reports silence as -inf), to 0.1dB."""
+    floor = LIQUIDSOAP_METRICS_CONFIG['floor_db']
+    if not isinstance(value, float) or math.isnan(value):
+        return None
+    return round(max(value, floor), 1)
+
+class LiquidsoapMetricsPoller:
+    """Publishes Liquidsoap metering on LIQUIDSOAP_METRICS_TOPIC and records alarms in the history store.
+
+    Inputs s1..s3 (the sculpture microphones) carry ready, rms and peak; mixes to1..to3 carry
+    the source currently routed to them, rms and peak. A mix is starving when it is routed to
+    sculpture inputs and none of them is delivering audio; plans that route silence on purpose
+    (B2, B3) do not count. Encoder lag is not exposed by Liquidsoap: the Ogg readers of
+    StreamHealthMonitor measure it per mix mount on system/streams.
+    """
+
+    def __init__(self, liquidsoap_client, history_store=None):
+        self.liquidsoap_client = liquidsoap_client
+        self.history_store = history_store
+        self.sculptures = {str(number): system['name'] for number, system in enumerate(PI_SYSTEMS, 1)}
+        self.mqtt_client = None
+        self.running = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.alarms = set()
+
+    def set_mqtt_client(self, mqtt_client):
+        """Set the MQTT client reference."""
+        self.mqtt_client = mqtt_client
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.poll_loop, daemon=True, name="liquidsoap-metrics")
+        self.thread.start()
+        logger.info(f"[METRICS] Polling Liquidsoap metrics every {LIQUIDSOAP_METRICS_CONFIG['poll_interval']}s")
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+
+    def poll_loop(self):
+        while self.running:
+            try:
+                report = self.collect()
+                if report:
+                    self.publish(report)
+            except Exception as e:
+                logger.error(f"[METRICS] Liquidsoap metrics poll failed: {e}")
+            self.stop_event.wait(LIQUIDSOAP_METRICS_CONFIG['poll_interval'])
+
+    def collect(self):
+        metrics = self.liquidsoap_client.get_metrics()
+        if metrics is None:
+            return None  # Liquidsoap down or an older main.liq without get_metrics
+        inputs, mixes = {}, {}
+        for name, values in metrics.items():
+            entry = {'rms': level(values.get('rms')), 'peak': level(values.get('peak'))}
+            if name.startswith('to'):
+                entry['source'] = values.get('source')
+                mixes[name] = entry
+            else:
+                entry['ready'] = bool(values.get('ready'))
+                inputs[name] = entry
+
+        alarms = {}
+        for name, entry in inputs.items():
+            if not entry['ready']:
+                alarms[name] = ['offline']
+        for name, entry in mixes.items():
+            feeds = [part for part in str(entry['source']).split('+') if part in inputs]
+            entry['starving'] = bool(feeds) and not any(inputs[feed]['ready'] for feed in feeds)
+            if entry['starving']:
+                alarms[name] = ['starving']
+
+        report = {'time': round(time.time()), 'inputs': inputs, 'mixes': mixes}
+        if alarms:
+            report['alarms'] = alarms
+        self.record_alarms(alarms)
+        return report
+
+    def record_alarms(self, alarms):
+        """Log alarm transitions and store new ones as history events."""
+        current = {(name, alarm) for name, names in alarms.items() for alarm in names}
+        for name, alarm in sorted(current - self.alarms):
+            sculpture = self.sculptures.get(name.removeprefix('to').removeprefix('s'), name)
+            logger.warning(f"[METRICS] {name} ({sculpture}): {alarm}")
+            if self.history_store:
+                self.history_store.record_event(sculpture, f"liquidsoap-{name}", f"liquidsoap_{alarm}")
+        for name, alarm in sorted(self.alarms - current):
+            logger.info(f"[METRICS] {name}: {alarm} cleared")
+        self.alarms = current
+
+    def publish(self, report):
+        if self.mqtt_client:
+            self.mqtt_client.publish(LIQUIDSOAP_METRICS_TOPIC, json.dumps(report, separators=(',', ':')), retain=True)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+LogMatcher module for server-agent
+Single-pass matching of journal lines against a set of regexes behind a literal pre-filter
+"""
+
+import re
+
+class LogMatcher:
+    """Match lines against several patterns with one compiled alternation.
+
+    Almost every journal line is a miss, so a line is only handed to the regex engine
+    when it contains one of the (case-insensitive) pre-filter keywords. Every pattern
+    must contain at least one keyword for the pre-filter to be exact.
+    """
+
+    def __init__(self, patterns, keywords):
+        # Patterns may be compiled regexes (config.py) or plain strings (config.py.example)
+        sources = [getattr(pattern, 'pattern', pattern) for pattern in patterns]
+        self.pattern = re.compile('|'.join(f"(?:{source})" for source in sources), re.IGNORECASE)
+        self.keywords = tuple(keyword.lower() for keyword in keywords)
+
+        for source in sources:
+            if not any(keyword in source.lower() for keyword in self.keywords):
+                raise ValueError(f"Pattern {source!r} contains none of the pre-filter keywords {self.keywords}")
+
+    def might_match(self, line):
+        """Cheap literal check; False means the line cannot match any pattern."""
+        lowered = line.lower()
+        for keyword in self.keywords:
+            if keyword in lowered:
+                return True
+        return False
+
+    def search(self, line):
+        """Return the regex match for the first matching pattern, or None."""
+        if not self.might_match(line):
+            return None
+        return self.pattern.search(line)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+LogStreamPool module for server-agent
+Holds one SSH connection per Pi system and fans a single journalctl stream out to monitors
+"""
+
+import logging
+import threading
+import time
+import json
+import paramiko
+from datetime import datetime
+
+# Import configuration
+from config import CONNECTION_CONFIG
+from host_resolver import HostResolver
+
+logger = logging.getLogger(__name__)
+
+class LogStreamPool:
+    """Shared SSH connection pool and journal log multiplexer for remote Pi systems."""
+
+    def __init__(self, pi_systems):
+        self.pi_systems = pi_systems
+        self.ssh_connections = {}
+        self.stream_threads = {}
+        self.consumers = []  # (services, callback) pairs registered by monitors
+        self.connection_states = {}  # Track connection state for each system
+        self.resolver = HostResolver()  # Host selection, address cache and reconnect backoff
+        self.line_counts = {}
+        self.running = False
+
+        # Initialize connection states
+        for system in self.pi_systems:
+            self.connection_states[system['name']] = {
+                'connected': False,
+                'last_attempt': None,
+                'successful_host': None,
+                'connection_count': 0
+            }
+            self.line_counts[system['name']] = 0
+
+    def register_consumer(self, services, callback):
+        """Register a callback(system_name, service, line) for journal lines of the given services."""
+        self.consumers.append((set(services), callback))
+        logger.info(f"[LOGSTREAM] Registered consumer for services: {sorted(services)}")
+
+    def get_stream_services(self):
+        """Get the services covered by the shared journal stream, in registration order."""
+        services = []
+        for consumer_services, _ in self.consumers:
+            for service in sorted(consumer_services):
+                if service not in services:
+                    services.append(service)
+        return services
+
+    def build_stream_command(self):
+        """Build the single journalctl command that follows every registered service."""
+        units = ' '.join(f"-u {service}" for service in self.get_stream_services())
+        return f"journalctl -f -o json --output-fields=_SYSTEMD_UNIT,UNIT,MESSAGE {units}"
+
+    def setup_ssh_connection(self, system):
+        """Setup SSH connection to a Pi system over whichever of its hosts answers first."""
+        system_name = system['name']
+        state = self.connection_states[system_name]
+        state['last_attempt'] = datetime.now()
+
+        # Race TCP connects to every host name; an offline Pi costs one connect timeout
+        host, sock = self.resolver.connect(system)
+        if not sock:
+            state['connected'] = False
+            return False
+
+        ssh = None
+        try:
+            logger.info(f"[LOGSTREAM] Attempting SSH connection to {system_name} at {host} as user {system['user']}")
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+            connect_kwargs = {
+                'hostname': host,
+                'username': system['user'],
+                'timeout': CONNECTION_CONFIG['ssh_timeout'],
+                'sock': sock,
+            }
+
+            if CONNECTION_CONFIG['ssh_key_file']:
+                connect_kwargs['key_filename'] = CONNECTION_CONFIG['ssh_key_file']
+
+            ssh.connect(**connect_kwargs)
+
+            # Test the connection with a simple command
+            if CONNECTION_CONFIG['test_connection']:
+                stdin, stdout, stderr = ssh.exec_command('echo "SSH connection test"', timeout=5)
+                test_result = stdout.read().decode().strip()
+                if test_result != "SSH connection test":
+                    raise ConnectionError("SSH connection test failed")
+
+            # Report service status for every streamed service in one round-trip
+            services = self.get_stream_services()
+            if services:
+                stdin, stdout, stderr = ssh.exec_command(f"systemctl is-active {' '.join(services)}", timeout=5)
+                statuses = stdout.read().decode().split()
+                for service, service_status in zip(services, statuses):
+                    logger.info(f"[LOGSTREAM] Service {service} status on {system_name}: {service_status}")
+
+            # Connection successful
+            self.ssh_connections[system_name] = ssh
+            self.resolver.record_success(system_name)
+            state['connected'] = True
+            state['successful_host'] = host
+            state['connection_count'] += 1
+
+            logger.info(f"[LOGSTREAM] SSH connection established successfully to {system_name} at {host}")
+            return True
+
+        except Exception as e:
+            logger.error(f"[LOGSTREAM] Failed to connect to {system_name} at {host}: {str(e)}")
+            self.resolver.record_failure(system_name)
+            if ssh:
+                try:
+                    ssh.close()
+                except:
+                    pass
+            sock.close()
+
+        state['connected'] = False
+        return False
+
+    def retry_delay(self, system_name):
+        """Seconds before the next connection attempt (backs off while a system stays offline)."""
+        return self.resolver.retry_delay(system_name)
+
+    def get_connection(self, system_name):
+        """Get the shared SSH connection for a system, or None if it is not connected."""
+        return self.ssh_connections.get(system_name)
+
+    def drop_connection(self, system_name):
+        """Close and forget the shared SSH connection for a system."""
+        ssh = self.ssh_connections.pop(system_name, None)
+        if ssh:
+            try:
+                ssh.close()
+            except:
+                pass
+        self.connection_states[system_name]['connected'] = False
+
+    def dispatch_journal_line(self, system_name, raw_line):
+        """Parse one `journalctl -o json` line and hand its message to matching consumers."""
+        raw_line = raw_line.strip()
+        if not raw_line:
+            return
+
+        self.line_counts[system_name] += 1
+
+        try:
+            entry = json.loads(raw_line)
+        except ValueError:
+            # stderr is combined into the stream, so journalctl errors arrive here
+            logger.warning(f"[LOGSTREAM] Non-journal output from {system_name}: {raw_line}")
+            return
+
+        # Service output carries _SYSTEMD_UNIT, systemd's own messages about a unit carry UNIT
+        unit = entry.get('UNIT') or entry.get('_SYSTEMD_UNIT') or ''
+        service = unit[:-len('.service')] if unit.endswith('.service') else unit
+
+        message = entry.get('MESSAGE')
+        if isinstance(message, list):
+            # journald encodes non-UTF-8 messages as byte arrays
+            message = bytes(message).decode('utf-8', errors='replace')
+        if not message:
+            return
+        message = message.strip()
+
+        for services, callback in self.consumers:
+            if service in services:
+                try:
+                    callback(system_name, service, message)
+                except Exception as e:
+                    logger.error(f"[LOGSTREAM] Consumer error for {system_name}/{service}: {e}")
+
+    def open_stream_channel(self, system_name, ssh):
+        """Open an SSH channel running the shared journal stream command."""
+        command = self.build_stream_command()
+        logger.info(f"[LOGSTREAM] Starting log stream on {system_name} with command: {command}")
+        channel = ssh.get_transport().open_session()
+        channel.set_combine_stderr(True)
+        channel.exec_command(command)
+        return channel
+
+    def stream_system_logs(self, system):
+        """Follow the shared journal stream for one system with reconnection logic."""
+        system_name = system['name']
+
+        while self.running:
+            ssh = self.get_connection(system_name)
+            if not ssh and not self.setup_ssh_connection(system):
+                time.sleep(self.retry_delay(system_name))
+                continue
+            ssh = self.get_connection(system_name)
+
+            try:
+                channel = self.open_stream_channel(system_name, ssh)
+                stdout = channel.makefile('r')
+
+                last_heartbeat = time.time()
+                for line in iter(stdout.readline, ""):
+                    self.dispatch_journal_line(system_name, line)
+
+                    # Heartbeat every specified interval to show monitoring is active
+                    current_time = time.time()
+                    if current_time - last_heartbeat >= CONNECTION_CONFIG['heartbeat_interval']:
+                        logger.info(f"[LOGSTREAM] Monitoring active - {system_name}: {self.line_counts[system_name]} lines processed")
+                        last_heartbeat = current_time
+
+                # If we reach here, the stdout stream ended
+                logger.warning(f"[LOGSTREAM] Log stream ended for {system_name}")
+
+            except Exception as e:
+                logger.error(f"[LOGSTREAM] Error streaming logs from {system_name}: {str(e)}")
+                import traceback
+                logger.debug(f"[LOGSTREAM] Stream traceback: {traceback.format_exc()}")
+
+            # Mark connection as failed so the next pass reconnects
+            self.drop_connection(system_name)
+
+            if self.running:
+                delay = self.retry_delay(system_name)
+                logger.info(f"[LOGSTREAM] Waiting {delay:.0f}s before restarting log stream for {system_name}")
+                time.sleep(delay)
+
+    def start(self):
+        """Start one log stream thread per system."""
+        self.running = True
+        logger.info(f"[LOGSTREAM] Starting shared log streams for {len(self.pi_systems)} systems: {[s['name'] for s in self.pi_systems]}")
+        logger.info(f"[LOGSTREAM] Streamed services: {self.get_stream_services()}")
+
+        for system in self.pi_systems:
+            thread_name = f"logstream-{system['name']}"
+            thread = threading.Thread(
+                target=self.stream_system_logs,
+                args=(system,),
+                daemon=True,
+                name=thread_name
+            )
+            thread.start()
+            self.stream_threads[thread_name] = thread
+            logger.info(f"[LOGSTREAM] Started log stream thread: {thread_name}")
+
+        health_thread = threading.Thread(target=self.monitor_stream_health, daemon=True, name="logstream-health-monitor")
+        health_thread.start()
+        logger.info(f"[LOGSTREAM] Started stream health monitor")
+
+    def monitor_stream_health(self):
+        """Periodically log stream thread and connection health."""
+        while self.running:
+            time.sleep(60)  # Check every minute
+            dead_threads = [name for name, thread in self.stream_threads.items() if not thread.is_alive()]
+
+            if dead_threads:
+                logger.warning(f"[LOGSTREAM] {len(dead_threads)} log stream threads have died: {dead_threads}")
+            else:
+                logger.debug(f"[LOGSTREAM] All {len(self.stream_threads)} log stream threads are alive")
+
+            self.log_connection_status()
+
+    def log_connection_status(self):
+        """Log how many systems are connected and how."""
+        connected_count = sum(1 for state in self.connection_states.values() if state['connected'])
+        logger.info(f"[LOGSTREAM] Connection status: {connected_count}/{len(self.pi_systems)} systems connected")
+
+        for system_name, state in self.connection_states.items():
+            if state['connected']:
+                logger.debug(f"[LOGSTREAM] {system_name}: Connected via {state['successful_host']} ({state['connection_count']} connections)")
+            else:
+                logger.debug(f"[LOGSTREAM] {system_name}: Disconnected (last attempt: {state['last_attempt']})")
+
+    def get_connection_status(self):
+        """Get connection status for all systems."""
+        return {
+            'connected_systems': sum(1 for state in self.connection_states.values() if state['connected']),
+            'total_systems': len(self.pi_systems),
+            'systems': {
+                name: {
+                    'connected': state['connected'],
+                    'successful_host': state['successful_host'],
+                    'connection_count': state['connection_count']
+                } for name, state in self.connection_states.items()
+            }
+        }
+
+    def close(self):
+        """Stop streaming and close all shared SSH connections."""
+        self.running = False
+        for system_name in list(self.ssh_connections):
+            self.drop_connection(system_name)
+        logger.info("[LOGSTREAM] Closed all shared SSH connections")
@@ -8,24 +8,36 @@ import json
 import time
 import logging
 import subprocess
+import threading
 from datetime import timedelta
 
 # Import configuration
 from config import (
     CMD_TOPIC, STATUS_TOPIC, PLAN_TOPIC, UNDERRUN_TOPIC, DARKICE_TOPIC,
-    STATUS_PUBLISH_INTERVAL
+    HISTORY_TOPIC, SCULPTURE_STATUS_TOPIC, DISPATCH_TOPIC, STATUS_PUBLISH_INTERVAL,
+    STATUS_DEBOUNCE_INTERVAL, STATUS_HEARTBEAT_INTERVAL, AUDIO_PARAMS, CLOCK_PING_TOPIC, PLAN_SCHEDULE_CONFIG,
+    AUDIO_PARAMS_TOPIC
 )
 
+from command_dispatcher import PRIORITY_CONTROL, PRIORITY_BACKGROUND
+
 logger = logging.getLogger(__name__)
 
 class MQTTHandlers:
     """Handles MQTT callbacks and message processing."""
     
-    def __init__(self, plan_manager, liquidsoap_client, underrun_monitor, darkice_monitor):
+    def __init__(self, plan_manager, liquidsoap_client, underrun_monitor, darkice_monitor, param_coalescer,
+                 dispatcher, history_store=None, preset_store=None):
         self.plan_manager = plan_manager
         self.liquidsoap_client = liquidsoap_client
+        self.param_coalescer = param_coalescer
+        self.dispatcher = dispatcher
+        self.processing_enabled = None  # Last processing state reported by Liquidsoap
         self.underrun_monitor = underrun_monitor
         self.darkice_monitor = darkice_monitor
+        self.history_store = history_store
+        self.preset_store = preset_store
+        self.sculpture_status = {}  # sculpture id -> last known full status (keyframe plus later deltas)
     
     def on_connect(self, client, userdata, flags, rc, properties=None):
         """MQTT connection callback."""
@@ -33,9 +45,15 @@ class MQTTHandlers:
         client.subscribe(CMD_TOPIC)
         client.subscribe("system/broadcast")  # Listen for plan broadcasts
         client.subscribe("system/audio/cmd")  # Listen for audio commands
+        client.subscribe(CLOCK_PING_TOPIC)  # Pis measuring their clock offset
+        if self.history_store:
+            client.subscribe(SCULPTURE_STATUS_TOPIC)  # Record sculpture status history
         
         # Publish initial plan status
         self.publish_plan_status(client)
+        # ...and the full DSP parameter set, which dashboards sync their sliders from
+        self.dispatcher.submit("audio:get_params", self.publish_audio_params_snapshot, client,
+                               priority=PRIORITY_BACKGROUND)
     
     def on_message(self, client, userdata, msg):
         """MQTT message callback."""
@@ -43,18 +61,41 @@ class MQTTHandlers:
             payload = msg.payload.decode()
             data = json.loads(payload)
             
+            if msg.topic == CLOCK_PING_TOPIC:
+                # Answered on the network thread: a queued reply would inflate the round trip
+                self.answer_clock_ping(client, data)
+                return
+            
+            # Anything that may block (systemctl, Liquidsoap, SQLite queries) runs on the dispatcher
             if msg.topic == CMD_TOPIC:
-                self.handle_command_message(client, data)
+                # Identical commands queued twice (repeated button clicks) run once
+                self.dispatcher.submit(f"cmd:{json.dumps(data, sort_keys=True)}", self.handle_command_message,
+                                       client, data, priority=PRIORITY_BACKGROUND)
             elif msg.topic == "system/broadcast":
-                self.handle_broadcast_message(client, data)
+                self.dispatcher.submit("plan", self.handle_broadcast_message, client, data, priority=PRIORITY_CONTROL)
             elif msg.topic == "system/audio/cmd":
-                self.handle_audio_command_message(client, data)
+                self.dispatch_audio_command(client, data)
+            elif msg.topic.startswith("sculpture/") and msg.topic.endswith("/status"):
+                self.handle_sculpture_status(msg.topic, data)
             else:
                 logger.warning(f"[MQTT] Unknown topic: {msg.topic}")
                 
         except Exception as e:
             logger.error(f"[MQTT] Message handling error: {e}")
     
+    def dispatch_audio_command(self, client, data):
+        """Queue Liquidsoap audio commands; parameter updates go straight to the coalescer."""
+        for command in ('processing_toggle', 'reset', 'get_processing_status', 'get_params',
+                        'load_preset', 'save_preset', 'delete_preset'):
+            if command in data:
+                priority = PRIORITY_BACKGROUND if command.startswith('get_') else PRIORITY_CONTROL
+                # Only the latest get_params/load_preset matters; saves and deletes of different presets all must run
+                key = f"audio:{command}:{data[command]}" if command in ('save_preset', 'delete_preset') else f"audio:{command}"
+                self.dispatcher.submit(key, self.handle_audio_command_message,
+                                       client, data, priority=priority)
+                return
+        self.handle_audio_command_message(client, data)
+    
     def handle_command_message(self, client, data):
         """Handle command messages."""
         try:
@@ -80,6 +121,14 @@ class MQTTHandlers:
                 logger.info("[MQTT] Darkice summary requested")
                 self.publish_darkice_summary(client)
             
+            elif 'dispatch_metrics' in data:
+                logger.info("[MQTT] Dispatch metrics requested")
+                self.publish_dispatch_metrics(client)
+            
+            elif 'history' in data:
+                logger.info(f"[MQTT] History query requested: {data['history']}")
+                self.publish_history(client, data['history'])
+            
             elif 'darkice_restart' in data:
                 system = data.get('system')
                 service = data.get('service', 'darkice')
@@ -95,6 +144,62 @@ class MQTTHandlers:
         except Exception as e:
             logger.error(f"[MQTT] Command handling error: {e}")
     
+    def publish_dispatch_metrics(self, client):
+        """Publish command queue depth and per-command latency metrics."""
+        try:
+            metrics_data = {
+                'timestamp': time.time(),
+                'source': 'server-agent',
+                **self.dispatcher.get_metrics()
+            }
+            client.publish(DISPATCH_TOPIC, json.dumps(metrics_data))
+            logger.info(f"[MQTT] Published dispatch metrics for {len(metrics_data['commands'])} commands")
+        except Exception as e:
+            logger.error(f"[MQTT] Failed to publish dispatch metrics: {e}")
+    
+    def handle_sculpture_status(self, topic, data):
+        """Record a sculpture status message in the history store.
+
+        Deltas carry only the fields that changed (null for a field that went away), so they
+        are merged into the last known status and the merged state is recorded; otherwise
+        steady values would only be sampled with each keyframe and the averages would lean
+        towards changes.
+        """
+        if self.history_store:
+            sculpture_id = str(data.get('id') or topic.split('/')[1])
+            if data.get('delta'):
+                status = dict(self.sculpture_status.get(sculpture_id, {}))
+                for field, value in data.items():
+                    if value is None:
+                        status.pop(field, None)
+                    elif field != 'delta':
+                        status[field] = value
+            else:
+                status = data
+            self.sculpture_status[sculpture_id] = status
+            self.history_store.record_status(sculpture_id, status)
+    
+    def publish_history(self, client, request):
+        """Answer a history query on HISTORY_TOPIC (or the request's reply_topic)."""
+        if not isinstance(request, dict):
+            request = {}
+        reply_topic = request.get('reply_topic', HISTORY_TOPIC)
+        try:
+            if not self.history_store:
+                raise RuntimeError("history store is disabled")
+            result = self.history_store.query(request)
+            response = {
+                'request': request,
+                'timestamp': time.time(),
+                'source': 'server-agent',
+                **result
+            }
+            logger.info(f"[MQTT] Publishing history query result ({len(result['rows'])} rows) to {reply_topic}")
+        except Exception as e:
+            logger.error(f"[MQTT] History query failed: {e}")
+            response = {'request': request, 'error': str(e), 'timestamp': time.time(), 'source': 'server-agent'}
+        client.publish(reply_topic, json.dumps(response))
+    
     def handle_broadcast_message(self, client, data):
         """Handle broadcast messages."""
         try:
@@ -104,11 +209,15 @@ class MQTTHandlers:
                 
                 logger.info(f"[MQTT] Received plan broadcast: {plan} (mode: {mode})")
                 
-                # Update Liquidsoap with plan (Liquidsoap doesn't care about mode)
-                self.handle_plan_command(client, plan)
+                # Announce the switch ahead of time so every pi-agent applies it at apply_at
+                apply_at = time.time() + PLAN_SCHEDULE_CONFIG['lead_time']
+                self.forward_to_sculptures(client, plan, mode, apply_at)
                 
-                # Forward complete message to pi-agents for mode switching
-                self.forward_to_sculptures(client, plan, mode)
+                # Update Liquidsoap with plan at the same instant (Liquidsoap doesn't care about mode)
+                delay = apply_at - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                self.handle_plan_command(client, plan)
             else:
                 logger.warning(f"[MQTT] Broadcast message missing plan: {data}")
                 
@@ -144,21 +253,48 @@ class MQTTHandlers:
                 if response:
                     logger.info(f"[MQTT] Audio reset response: {response}")
                     self.publish_audio_processing_status(client)
+                    self.publish_audio_params_snapshot(client)
                 else:
                     logger.error(f"[MQTT] Failed to reset audio processing")
                     
+            elif 'get_params' in data:
+                self.publish_audio_params_snapshot(client)
+                
+            elif 'load_preset' in data:
+                name = data['load_preset']
+                preset = self.preset_store.get(name) if self.preset_store else None
+                if preset is None:
+                    logger.warning(f"[MQTT] Unknown audio preset: {name}")
+                    return
+                logger.info(f"[MQTT] Loading audio preset '{name}'")
+                # One set_params round-trip; pending slider values for the same parameters are dropped
+                if self.param_coalescer.apply_now(preset):
+                    self.publish_audio_params_snapshot(client, preset=name)
+                else:
+                    logger.error(f"[MQTT] Failed to load audio preset '{name}'")
+                
+            elif 'save_preset' in data:
+                name = data['save_preset']
+                params = self.liquidsoap_client.get_all_params()
+                if not self.preset_store or not name or params is None:
+                    logger.error(f"[MQTT] Cannot save audio preset '{name}'")
+                    return
+                self.preset_store.save(name, params)
+                self.publish_audio_params_snapshot(client, params=params, preset=name)
+                
+            elif 'delete_preset' in data:
+                if self.preset_store and self.preset_store.delete(data['delete_preset']):
+                    self.publish_audio_params_snapshot(client)
+                else:
+                    logger.warning(f"[MQTT] Unknown audio preset: {data['delete_preset']}")
+                
             else:
-                # Handle individual audio parameter commands
-                for param, value in data.items():
-                    if param in ['compress_ratio', 'compress_threshold', 'attack_time', 'release_time',
-                               'highpass_freq', 'lowpass_freq', 'delay_time', 'delay_feedback',
-                               'gate_threshold', 'normalize_target']:
-                        command = f"set_{param}"
-                        response = self.liquidsoap_client.send_command(command, str(value))
-                        if response:
-                            logger.info(f"[MQTT] Set {param} to {value}: {response}")
-                        else:
-                            logger.error(f"[MQTT] Failed to set {param} to {value}")
+                # Individual audio parameters are coalesced and applied off the MQTT thread
+                params = {param: value for param, value in data.items() if param in AUDIO_PARAMS}
+                if params:
+                    self.param_coalescer.submit(params)
+                else:
+                    logger.warning(f"[MQTT] Unknown audio command: {data}")
                 
         except Exception as e:
             logger.error(f"[MQTT] Audio command handling error: {e}")
@@ -170,6 +306,7 @@ class MQTTHandlers:
             if response:
                 # Response is 'enabled' or 'disabled'
                 is_enabled = response.strip() == 'enabled'
+                self.processing_enabled = is_enabled
                 status_data = {
                     'processing_enabled': is_enabled,
                     'timestamp': time.time(),
@@ -182,6 +319,48 @@ class MQTTHandlers:
         except Exception as e:
             logger.error(f"[MQTT] Failed to publish audio processing status: {e}")
     
+    def publish_audio_params_snapshot(self, client, params=None, preset=None):
+        """Publish every DSP parameter's current value and the saved preset names on AUDIO_PARAMS_TOPIC (retained).
+
+        Unlike the per-burst updates on system/audio/status, this is only sent on connect, on
+        request (get_params) and after resets and preset changes, so dashboards can move their
+        sliders to it without echoing their own updates back.
+        """
+        try:
+            if params is None:
+                params = self.liquidsoap_client.get_all_params()
+            if params is None:
+                logger.error("[MQTT] Failed to get audio parameters from Liquidsoap")
+                return
+            snapshot = {
+                'params': params,
+                'presets': self.preset_store.names() if self.preset_store else [],
+                'timestamp': time.time(),
+                'source': 'server-agent'
+            }
+            if preset:
+                snapshot['preset'] = preset
+            client.publish(AUDIO_PARAMS_TOPIC, json.dumps(snapshot), retain=True)
+            logger.info(f"[MQTT] Published audio parameter snapshot{f' (preset {preset})' if preset else ''}")
+        except Exception as e:
+            logger.error(f"[MQTT] Failed to publish audio parameter snapshot: {e}")
+    
+    def publish_audio_params(self, client, updated, applied):
+        """Publish DSP parameter values Liquidsoap has applied on the audio status topic."""
+        try:
+            status_data = {
+                'params': applied,
+                'updated': updated,
+                'timestamp': time.time(),
+                'source': 'server-agent'
+            }
+            if self.processing_enabled is not None:
+                status_data['processing_enabled'] = self.processing_enabled
+            client.publish("system/audio/status", json.dumps(status_data), retain=True)
+            logger.debug(f"[MQTT] Published applied audio parameters: {updated}")
+        except Exception as e:
+            logger.error(f"[MQTT] Failed to publish applied audio parameters: {e}")
+    
     def handle_plan_command(self, client, plan):
         """Handle plan selection command."""
         if not self.plan_manager.is_valid_plan(plan):
@@ -201,8 +380,8 @@ class MQTTHandlers:
         else:
             logger.error(f"[MQTT] Failed to set plan in Liquidsoap")
     
-    def forward_to_sculptures(self, client, plan, mode):
-        """Forward plan and mode information to all pi-agents."""
+    def forward_to_sculptures(self, client, plan, mode, apply_at=None):
+        """Forward plan and mode information to all pi-agents, to be applied at apply_at (server time)."""
         try:
             message_data = {
                 'plan': plan,
@@ -210,6 +389,8 @@ class MQTTHandlers:
                 'timestamp': time.time(),
                 'source': 'server-agent'
             }
+            if apply_at is not None:
+                message_data['apply_at'] = apply_at
             
             # Publish to system/plan topic for pi-agents
             client.publish("system/plan", json.dumps(message_data), retain=True)
@@ -218,6 +399,14 @@ class MQTTHandlers:
         except Exception as e:
             logger.error(f"[MQTT] Failed to forward plan to sculptures: {e}")
     
+    def answer_clock_ping(self, client, data):
+        """Reply to a pi-agent clock ping with our time so it can estimate its offset."""
+        try:
+            reply = {'t0': data['t0'], 'server_time': time.time()}
+            client.publish(f"sculpture/{data['id']}/clock", json.dumps(reply))
+        except (KeyError, TypeError) as e:
+            logger.warning(f"[MQTT] Malformed clock ping {data}: {e}")
+    
     def publish_plan_status(self, client):
         """Publish current plan status to MQTT."""
         try:
@@ -280,38 +469,108 @@ class MQTTHandlers:
             logger.error(f"[MQTT] Failed to publish darkice summary: {e}")
 
 class StatusPublisher:
-    """Handles periodic status publishing."""
+    """Publishes status topics when they change, with a debounce window and a slow heartbeat."""
+    
+    # Status topics that can be marked dirty, in publish order
+    STATUS_KEYS = ('plan', 'audio', 'underruns', 'darkice')
     
     def __init__(self, mqtt_handlers, plan_manager, liquidsoap_client):
         self.mqtt_handlers = mqtt_handlers
         self.plan_manager = plan_manager
         self.liquidsoap_client = liquidsoap_client
+        self.condition = threading.Condition()
+        self.wakeup = None  # Optional callable notified (from any thread) when something is marked dirty
+        
+        # Publish everything once at startup
+        self.dirty = set(self.STATUS_KEYS)
+        self.dirty_since = 0
+        self.next_sync = 0
+        self.next_heartbeat = time.time() + STATUS_HEARTBEAT_INTERVAL
+    
+    def mark_dirty(self, *keys):
+        """Schedule the given status topics for publishing after the debounce window."""
+        with self.condition:
+            if not self.dirty:
+                self.dirty_since = time.time()
+            self.dirty.update(keys)
+            self.condition.notify()
+        if self.wakeup:
+            self.wakeup()
+    
+    def seconds_until_due(self, now):
+        """Seconds until the next drift sync, heartbeat or debounced publish."""
+        with self.condition:
+            deadlines = [self.next_sync, self.next_heartbeat]
+            if self.dirty:
+                deadlines.append(self.dirty_since + STATUS_DEBOUNCE_INTERVAL)
+        return max(0.0, min(deadlines) - now)
+    
+    def take_due(self, now):
+        """Return (sync_due, keys_to_publish) and reset the schedule for whatever is due."""
+        with self.condition:
+            sync_due = now >= self.next_sync
+            if sync_due:
+                self.next_sync = now + STATUS_PUBLISH_INTERVAL
+            
+            keys = set()
+            if now >= self.next_heartbeat:
+                keys.update(self.STATUS_KEYS)
+                self.next_heartbeat = now + STATUS_HEARTBEAT_INTERVAL
+            if self.dirty and now >= self.dirty_since + STATUS_DEBOUNCE_INTERVAL:
+                keys.update(self.dirty)
+                self.dirty.clear()
+            elif keys:
+                # The heartbeat covers anything that was waiting for its debounce window
+                self.dirty.clear()
+        return sync_due, keys
+    
+    def sync_plan(self):
+        """Check Liquidsoap for plan drift; returns True if the agent's plan was corrected."""
+        liquidsoap_plan = self.liquidsoap_client.get_plan()
+        current_plan = self.plan_manager.get_plan()
+        
+        if liquidsoap_plan and liquidsoap_plan != current_plan:
+            logger.info(f"[STATUS] Plan drift detected. Liquidsoap: {liquidsoap_plan}, Agent: {current_plan}")
+            # Update our state to match Liquidsoap (Liquidsoap is source of truth)
+            self.plan_manager.set_plan(liquidsoap_plan)
+            return True
+        return False
+    
+    def publish_status(self, client, keys=STATUS_KEYS, sync=True):
+        """Optionally sync plan state with Liquidsoap, then publish the given status topics."""
+        keys = set(keys)
+        if sync:
+            try:
+                if self.sync_plan():
+                    keys.add('plan')
+            except Exception as e:
+                logger.error(f"[STATUS] Plan sync error: {e}")
+        
+        if keys:
+            logger.debug(f"[STATUS] Publishing: {[key for key in self.STATUS_KEYS if key in keys]}")
+        
+        if 'plan' in keys:
+            self.mqtt_handlers.publish_plan_status(client)
+        if 'audio' in keys:
+            self.mqtt_handlers.publish_audio_processing_status(client)
+        if 'underruns' in keys:
+            self.mqtt_handlers.publish_underrun_summary(client)
+        if 'darkice' in keys:
+            self.mqtt_handlers.publish_darkice_summary(client)
+    
+    def run_pending(self, client):
+        """Do whatever is due now: drift sync, heartbeat and debounced publishes."""
+        sync_due, keys = self.take_due(time.time())
+        if sync_due or keys:
+            self.publish_status(client, keys, sync=sync_due)
     
     def status_publisher_thread(self, client):
-        """Background thread to periodically publish status and sync with Liquidsoap."""
+        """Background thread that publishes status changes and syncs with Liquidsoap."""
         while True:
+            with self.condition:
+                self.condition.wait(timeout=self.seconds_until_due(time.time()))
+            
             try:
-                # Periodically sync plan state with Liquidsoap
-                liquidsoap_plan = self.liquidsoap_client.get_plan()
-                current_plan = self.plan_manager.get_plan()
-                
-                if liquidsoap_plan and liquidsoap_plan != current_plan:
-                    logger.info(f"[STATUS] Plan drift detected. Liquidsoap: {liquidsoap_plan}, Agent: {current_plan}")
-                    # Update our state to match Liquidsoap (Liquidsoap is source of truth)
-                    self.plan_manager.set_plan(liquidsoap_plan)
-                    self.mqtt_handlers.publish_plan_status(client)
-                
-                # Regular status publish
-                self.mqtt_handlers.publish_plan_status(client)
-                
-                # Publish audio processing status
-                self.mqtt_handlers.publish_audio_processing_status(client)
-                
-                # Publish monitoring summaries
-                self.mqtt_handlers.publish_underrun_summary(client)
-                self.mqtt_handlers.publish_darkice_summary(client)
-                
+                self.run_pending(client)
             except Exception as e:
                 logger.error(f"[STATUS] Publisher error: {e}")
-            
-            time.sleep(STATUS_PUBLISH_INTERVAL) 
\ No newline at end of file
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+ParamCoalescer module for server-agent
+Collapses bursts of DSP parameter updates and applies the latest values to Liquidsoap off the MQTT thread
+"""
+
+import logging
+import math
+import threading
+import time
+
+# Import configuration
+from config import PARAM_COALESCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class ParamCoalescer:
+    """Latest-value-wins buffer between dashboard sliders and Liquidsoap's set_* commands."""
+
+    def __init__(self, liquidsoap_client, on_applied=None):
+        self.liquidsoap_client = liquidsoap_client
+        self.on_applied = on_applied  # Optional callable(updated, applied) after each burst reaches Liquidsoap
+        self.pending = {}  # param -> latest requested value
+        self.pending_since = None
+        self.applied = {}  # param -> last value Liquidsoap accepted
+        self.condition = threading.Condition()
+        self.apply_lock = threading.Lock()  # One burst or preset at a time, in the order its values were taken
+        self.worker_thread = None
+        self.running = False
+        self.stats = {'submitted': 0, 'applied': 0, 'failed': 0, 'bursts': 0}
+
+    def start(self):
+        """Start the worker that applies coalesced updates."""
+        self.running = True
+        self.worker_thread = threading.Thread(target=self.worker_loop, daemon=True, name="param-coalescer")
+        self.worker_thread.start()
+        logger.info(f"[PARAMS] Parameter coalescer started ({PARAM_COALESCE_CONFIG['window'] * 1000:.0f}ms window)")
+
+    def stop(self):
+        """Stop the worker; updates still pending are dropped."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    @staticmethod
+    def numeric(params):
+        """params with every value as a finite float; other values are dropped with an error."""
+        valid = {}
+        for name, value in params.items():
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                number = math.nan
+            if isinstance(value, bool) or not math.isfinite(number):
+                logger.error(f"[PARAMS] Ignoring non-numeric value for {name}: {value!r}")
+                continue
+            valid[name] = number
+        return valid
+
+    def submit(self, params):
+        """Queue parameter values; a newer value for the same parameter replaces an older one."""
+        params = self.numeric(params)
+        if not params:
+            return
+        with self.condition:
+            if not self.pending:
+                self.pending_since = time.time()
+            self.pending.update(params)
+            self.stats['submitted'] += len(params)
+            self.condition.notify()
+
+    def wait_for_burst(self):
+        """Wait for updates and let the coalescing window fill."""
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait()
+
+            while self.running and self.pending:
+                remaining = self.pending_since + PARAM_COALESCE_CONFIG['window'] - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(timeout=remaining)
+
+    def take_pending(self):
+        """Take everything pending (caller holds apply_lock)."""
+        with self.condition:
+            params, self.pending = self.pending, {}
+            self.pending_since = None
+            return params
+
+    def apply_now(self, params):
+        """Apply a complete parameter set (e.g. a preset) immediately, superseding pending values for it.
+
+        Runs under apply_lock like the worker's bursts: a burst taken before the preset is
+        applied before it, and slider values still pending for its parameters are dropped.
+        """
+        params = self.numeric(params)
+        if not params:
+            return {}
+        with self.apply_lock:
+            with self.condition:
+                for name in params:
+                    self.pending.pop(name, None)
+                self.stats['submitted'] += len(params)
+            return self.apply(params)
+
+    def worker_loop(self):
+        """Apply each coalesced burst to Liquidsoap in one round-trip."""
+        while self.running:
+            self.wait_for_burst()
+            # Taking and applying under one lock keeps a burst from landing after a newer preset
+            with self.apply_lock:
+                params = self.take_pending()
+                if params and self.running:
+                    try:
+                        self.apply(params)
+                    except Exception as e:
+                        logger.error(f"[PARAMS] Failed to apply parameters {params}: {e}")
+
+    def apply(self, params):
+        """Send a burst to Liquidsoap in one set_params command and report what it accepted; returns the updates.
+
+        Callers hold apply_lock, which also guards applied and the applied/failed/bursts counts.
+        Values are already floats (see numeric), so a ValueError here is Liquidsoap's reject.
+        """
+        try:
+            current = self.liquidsoap_client.set_params(params)
+        except ValueError as e:
+            logger.warning(f"[PARAMS] set_params rejected ({e}), setting parameters one by one")
+            current = False
+        if current:
+            updated = {name: current.get(name, params[name]) for name in params}
+            logger.info(f"[PARAMS] Set {updated}")
+            self.applied.update(current)  # Liquidsoap returns the whole set
+        elif current is None:
+            updated = {}
+            self.stats['failed'] += len(params)
+            logger.error(f"[PARAMS] Failed to set {params}: Liquidsoap unreachable")
+        else:
+            # Older main.liq without set_params: one pipelined set_<param> command per parameter
+            names = list(params)
+            responses = self.liquidsoap_client.send_commands([f"set_{name} {params[name]}" for name in names])
+            updated = {}
+            for name, response in zip(names, responses):
+                if response:
+                    updated[name] = params[name]
+                    logger.info(f"[PARAMS] Set {name} to {params[name]}: {response}")
+                else:
+                    self.stats['failed'] += 1
+                    logger.error(f"[PARAMS] Failed to set {name} to {params[name]}")
+            self.applied.update(updated)
+
+        self.stats['bursts'] += 1
+        self.stats['applied'] += len(updated)
+
+        if updated and self.on_applied:
+            self.on_applied(updated, dict(self.applied))
+        return updated
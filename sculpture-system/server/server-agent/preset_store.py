@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Preset store module for server-agent
+Persists named DSP parameter sets in a JSON file, replaced atomically on every change
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+# Import configuration
+from config import AUDIO_PRESETS_FILE, AUDIO_PARAMS
+
+logger = logging.getLogger(__name__)
+
+class PresetStore:
+    """Named parameter sets ({name: {param: value}}) saved with save_preset and applied with load_preset."""
+
+    def __init__(self, path=None):
+        self.path = path or AUDIO_PRESETS_FILE
+        self.lock = threading.Lock()
+        self.presets = self.load()
+
+    def load(self):
+        """Read the presets file; a missing or unreadable file means no presets."""
+        try:
+            with open(self.path, 'r') as f:
+                presets = json.load(f)
+            logger.info(f"[PRESETS] Loaded {len(presets)} audio presets from {self.path}")
+            return presets
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"[PRESETS] Failed to load audio presets: {e}")
+            return {}
+
+    def write(self, presets):
+        """Write all presets to a temporary file and rename it over the old one, so readers never see a partial file."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.audio_presets-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(presets, f, indent=2, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def names(self):
+        with self.lock:
+            return sorted(self.presets)
+
+    def get(self, name):
+        """Parameters of a preset, or None if there is no such preset."""
+        with self.lock:
+            preset = self.presets.get(name)
+            return dict(preset) if preset is not None else None
+
+    def save(self, name, params):
+        """Store (or replace) a preset; only known DSP parameters are kept."""
+        preset = {param: float(value) for param, value in params.items() if param in AUDIO_PARAMS}
+        with self.lock:
+            presets = dict(self.presets, **{name: preset})
+            self.write(presets)
+            self.presets = presets
+        logger.info(f"[PRESETS] Saved audio preset '{name}': {preset}")
+        return preset
+
+    def delete(self, name):
+        """Remove a preset; returns False if it did not exist."""
+        with self.lock:
+            if name not in self.presets:
+                return False
+            presets = {key: value for key, value in self.presets.items() if key != name}
+            self.write(presets)
+            self.presets = presets
+        logger.info(f"[PRESETS] Deleted audio preset '{name}'")
+        return True
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+RollingCounter module for server-agent
+Fixed-memory event counter with per-second and per-minute buckets for rolling window rates
+"""
+
+import threading
+import time
+
+class _Ring:
+    """Running totals for a ring of consecutive seconds or minutes.
+
+    Each slot holds the number of events recorded before its stamp, so the events
+    between two stamps are a difference of two slots rather than a sum over buckets.
+    """
+
+    def __init__(self, size):
+        self.bases = [0] * size
+        self.newest = None  # Stamp of the most recent add()
+        self.total = 0
+
+    def add(self, stamp, amount):
+        size = len(self.bases)
+        if self.newest is None or stamp > self.newest:
+            # Stamps without events since the last add start at the same total (at most one pass)
+            first = stamp if self.newest is None else max(self.newest + 1, stamp - size + 1)
+            for skipped in range(first, stamp + 1):
+                self.bases[skipped % size] = self.total
+            self.newest = stamp
+        # Late events (the clock stepped back) count towards the newest stamp
+        self.total += amount
+
+    def before(self, stamp):
+        """Events recorded before stamp, not counting any older than the ring."""
+        if self.newest is None or stamp > self.newest:
+            return self.total
+        return self.bases[max(stamp, self.newest - len(self.bases) + 1) % len(self.bases)]
+
+    def count(self, newest, span):
+        """Events in the span stamps ending at newest."""
+        return self.before(newest + 1) - self.before(newest - span + 1)
+
+class RollingCounter:
+    """Count events over arbitrary trailing windows in constant memory.
+
+    Events land in two rings: one slot per second and one per minute. add() is O(1)
+    amortized (it touches one slot per second or minute that passed since the last
+    event) and count() is O(1) for any window, so rates can be queried on every event.
+    Counts never saturate no matter how many events arrive. Windows up to the
+    per-second span are exact to the second; longer windows are counted in whole
+    minutes, including the current one.
+    """
+
+    def __init__(self, second_buckets=300, minute_buckets=1440):
+        self.seconds = _Ring(second_buckets)
+        self.minutes = _Ring(minute_buckets)
+        self.lock = threading.Lock()
+
+    def add(self, amount=1, now=None):
+        """Record amount events at now (epoch seconds, default current time)."""
+        second = int(time.time() if now is None else now)
+        with self.lock:
+            self.seconds.add(second, amount)
+            self.minutes.add(second // 60, amount)
+
+    def count(self, window_seconds, now=None):
+        """Number of events in the last window_seconds (capped at the per-minute span)."""
+        second = int(time.time() if now is None else now)
+        with self.lock:
+            if window_seconds <= len(self.seconds.bases):
+                return self.seconds.count(second, int(window_seconds))
+            window_minutes = min(-(-int(window_seconds) // 60), len(self.minutes.bases))
+            return self.minutes.count(second // 60, window_minutes)
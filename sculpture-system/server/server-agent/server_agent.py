@@ -15,12 +15,19 @@ import sys
 
 # Import our modules
 from config import (
-    MQTT_BROKER, MQTT_PORT, PI_SYSTEMS, LOG_PATHS, 
-    LOG_LEVEL, LOG_FORMAT, LOG_DATE_FORMAT, load_config_overrides
+    MQTT_BROKER, MQTT_PORT, PI_SYSTEMS, LOG_PATHS, AGENT_ENGINE, HISTORY_CONFIG, DISPATCH_CONFIG, STREAM_HEALTH_CONFIG,
+    LIQUIDSOAP_METRICS_CONFIG, LOG_LEVEL, LOG_FORMAT, LOG_DATE_FORMAT, load_config_overrides
 )
+from log_stream import LogStreamPool
+from timeseries_store import TimeSeriesStore
 from underrun_monitor import UnderrunMonitor
 from darkice_monitor import DarkiceMonitor
+from stream_health import StreamHealthMonitor
+from liquidsoap_metrics import LiquidsoapMetricsPoller
 from liquidsoap_client import LiquidSoapClient
+from param_coalescer import ParamCoalescer
+from preset_store import PresetStore
+from command_dispatcher import CommandDispatcher
 from plan_manager import PlanManager
 from mqtt_handlers import MQTTHandlers, StatusPublisher
 
@@ -38,15 +45,30 @@ class ServerAgent:
         # Initialize components
         self.plan_manager = PlanManager()
         self.liquidsoap_client = LiquidSoapClient()
-        self.underrun_monitor = UnderrunMonitor(PI_SYSTEMS)
-        self.darkice_monitor = DarkiceMonitor(PI_SYSTEMS)
+        self.param_coalescer = ParamCoalescer(self.liquidsoap_client, on_applied=self.publish_applied_params)
+        self.dispatcher = CommandDispatcher("server", DISPATCH_CONFIG['workers'], DISPATCH_CONFIG['max_pending'])
+        self.log_stream = LogStreamPool(PI_SYSTEMS)
+        self.history_store = None
+        if HISTORY_CONFIG['enabled']:
+            self.history_store = TimeSeriesStore()
+            if not self.history_store.start():
+                self.history_store = None
+        self.underrun_monitor = UnderrunMonitor(PI_SYSTEMS, self.log_stream, self.history_store)
+        self.darkice_monitor = DarkiceMonitor(PI_SYSTEMS, self.log_stream, self.history_store)
+        self.stream_health = StreamHealthMonitor(self.history_store) if STREAM_HEALTH_CONFIG['enabled'] else None
+        self.liquidsoap_metrics = LiquidsoapMetricsPoller(self.liquidsoap_client, self.history_store) \
+            if LIQUIDSOAP_METRICS_CONFIG['enabled'] else None
         
         # Initialize MQTT handlers
         self.mqtt_handlers = MQTTHandlers(
             self.plan_manager,
             self.liquidsoap_client,
             self.underrun_monitor,
-            self.darkice_monitor
+            self.darkice_monitor,
+            self.param_coalescer,
+            self.dispatcher,
+            self.history_store,
+            PresetStore()
         )
         self.status_publisher = StatusPublisher(
             self.mqtt_handlers,
@@ -54,6 +76,10 @@ class ServerAgent:
             self.liquidsoap_client
         )
         
+        # Publish summaries as soon as the monitors see something new
+        self.underrun_monitor.on_stats_changed = self.status_publisher.mark_dirty
+        self.darkice_monitor.on_stats_changed = self.status_publisher.mark_dirty
+        
         # MQTT client
         self.mqtt_client = None
         
@@ -70,6 +96,10 @@ class ServerAgent:
             # Set MQTT client references in monitors
             self.underrun_monitor.set_mqtt_client(self.mqtt_client)
             self.darkice_monitor.set_mqtt_client(self.mqtt_client)
+            if self.stream_health:
+                self.stream_health.set_mqtt_client(self.mqtt_client)
+            if self.liquidsoap_metrics:
+                self.liquidsoap_metrics.set_mqtt_client(self.mqtt_client)
             
             # Connect to broker
             self.mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
@@ -81,6 +111,11 @@ class ServerAgent:
         
         return True
     
+    def publish_applied_params(self, updated, applied):
+        """Report DSP parameters applied by the coalescer on the audio status topic."""
+        if self.mqtt_client:
+            self.mqtt_handlers.publish_audio_params(self.mqtt_client, updated, applied)
+    
     def start_log_tailing(self):
         """Start log tailing threads for server services."""
         for name, path in LOG_PATHS.items():
@@ -118,6 +153,10 @@ class ServerAgent:
         logger.info("[MAIN] Starting darkice monitoring...")
         self.darkice_monitor.start_monitoring()
         
+        # Start the shared log streams once all monitors have registered
+        logger.info("[MAIN] Starting shared log streams...")
+        self.log_stream.start()
+        
         logger.info("[MAIN] All monitoring services started")
     
     def start_status_publisher(self):
@@ -150,18 +189,23 @@ class ServerAgent:
             self.mqtt_client.disconnect()
             logger.info("[MAIN] MQTT client disconnected")
         
-        # Close SSH connections
-        for ssh in self.underrun_monitor.ssh_connections.values():
-            try:
-                ssh.close()
-            except:
-                pass
+        # Close shared SSH connections
+        self.log_stream.close()
         
-        for ssh in self.darkice_monitor.ssh_connections.values():
-            try:
-                ssh.close()
-            except:
-                pass
+        # Stop command workers and audio parameter updates
+        self.dispatcher.stop()
+        self.param_coalescer.stop()
+        if self.stream_health:
+            self.stream_health.stop()
+        if self.liquidsoap_metrics:
+            self.liquidsoap_metrics.stop()
+        
+        # Close the Liquidsoap telnet connection
+        self.liquidsoap_client.close()
+        
+        # Flush pending history writes
+        if self.history_store:
+            self.history_store.close()
         
         logger.info("[MAIN] Shutdown complete")
     
@@ -171,6 +215,20 @@ class ServerAgent:
         logger.info("Server Agent starting up...")
         logger.info("=" * 60)
         
+        # Command dispatch, audio parameter updates, stream health and Liquidsoap metrics use their own
+        # threads under either engine
+        self.dispatcher.start()
+        self.param_coalescer.start()
+        if self.stream_health:
+            self.stream_health.start()
+        if self.liquidsoap_metrics:
+            self.liquidsoap_metrics.start()
+        
+        if AGENT_ENGINE == "asyncio":
+            from async_core import AsyncAgentCore
+            logger.info("[MAIN] Using asyncio engine")
+            return AsyncAgentCore(self).run()
+        
         # Setup signal handlers
         self.setup_signal_handlers()
         
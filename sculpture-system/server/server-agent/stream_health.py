@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+StreamHealthMonitor module for server-agent
+Polls Icecast for every sculpture mount and reads the Ogg streams to detect stalls, gaps and silence
+"""
+
+import base64
+import http.client
+import json
+import logging
+import struct
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+
+# Import configuration
+from config import ICECAST_HOST, ICECAST_PORT, PI_SYSTEMS, STREAMS_TOPIC, STREAM_HEALTH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+OGG_HEADER = struct.Struct('<4sBBqIIIB')  # capture pattern, version, flags, granule, serial, sequence, crc, segments
+OGG_BOS = 0x02
+
+# Numeric per-mount fields taken from Icecast's statistics
+ICECAST_FIELDS = ('listeners', 'listener_peak', 'slow_listeners', 'total_bytes_read', 'total_bytes_sent',
+                  'bitrate', 'audio_bitrate', 'audio_samplerate', 'audio_channels')
+
+def default_mounts():
+    """Microphone input and mix output mounts for every configured sculpture: mount -> (sculpture, kind)."""
+    mounts = {}
+    for number, system in enumerate(PI_SYSTEMS, 1):
+        mounts[f"/s{number}-mic.ogg"] = (system['name'], 'mic')
+        mounts[f"/mix-for-{number}.ogg"] = (system['name'], 'mix')
+    return mounts
+
+def parse_admin_stats(body):
+    """Per-mount numbers from /admin/stats (XML)."""
+    stats = {}
+    for source in ET.fromstring(body).iter('source'):
+        fields = {}
+        for field in ICECAST_FIELDS:
+            text = source.findtext(field)
+            if text:
+                try:
+                    fields[field] = float(text) if '.' in text else int(text)
+                except ValueError:
+                    pass
+        stats[source.get('mount')] = fields
+    return stats
+
+def parse_status_json(body):
+    """Per-mount numbers from the public /status-json.xsl (no byte counters)."""
+    sources = json.loads(body).get('icestats', {}).get('source', [])
+    if isinstance(sources, dict):
+        sources = [sources]  # A single mount is not wrapped in a list
+    stats = {}
+    for source in sources:
+        mount = '/' + source.get('listenurl', '').split('/', 3)[-1]
+        stats[mount] = {field: source[field] for field in ICECAST_FIELDS if isinstance(source.get(field), (int, float))}
+    return stats
+
+class OggStreamReader:
+    """Listens to one mount and times its Ogg pages against the wall clock.
+
+    Granule positions give the audio time carried by each page. The offset between wall
+    time and audio time since the reader attached is tracked: its growth over the best
+    offset seen is the latency the stream has accumulated, and a jump between two pages
+    is a gap. Silence is inferred without decoding from the VBR payload rate, which
+    collapses to a few hundred bytes per second when the encoder is fed silence.
+    """
+
+    def __init__(self, mount):
+        self.mount = mount
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.reset()
+        self.connected = False
+        self.gaps = 0
+        self.last_gap_ms = None
+        self.reconnects = 0
+
+    def reset(self):
+        """Forget timing baselines, e.g. when a new logical stream (source reconnect) starts."""
+        self.serial = None
+        self.samplerate = None
+        self.first_granule = None
+        self.first_wall = None
+        self.last_granule = None
+        self.last_wall = None
+        self.last_page = None
+        self.last_sequence = None
+        self.min_offset = None
+        self.offset = None
+        self.payload = deque()  # (wall time, payload bytes, audio seconds) per page
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True, name=f"ogg-reader{self.mount.replace('/', '-')}")
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            try:
+                self.read_stream()
+            except Exception as e:
+                logger.debug(f"[STREAMS] Reader for {self.mount} disconnected: {e}")
+            with self.lock:
+                self.connected = False
+                self.reset()
+                self.reconnects += 1
+            if self.running:
+                time.sleep(STREAM_HEALTH_CONFIG['stall_timeout'])
+
+    def read_stream(self):
+        connection = http.client.HTTPConnection(ICECAST_HOST, ICECAST_PORT, timeout=STREAM_HEALTH_CONFIG['stall_timeout'])
+        try:
+            connection.request('GET', self.mount, headers={'User-Agent': 'server-agent stream health'})
+            response = connection.getresponse()
+            if response.status != 200:
+                raise ConnectionError(f"HTTP {response.status}")
+            with self.lock:
+                self.connected = True
+            while self.running:
+                header = self.read_exact(response, OGG_HEADER.size)
+                capture, version, flags, granule, serial, sequence, _, segments = OGG_HEADER.unpack(header)
+                if capture != b'OggS':
+                    raise ValueError("lost Ogg page sync")
+                body_size = sum(self.read_exact(response, segments))
+                body = self.read_exact(response, body_size)
+                self.handle_page(flags, granule, serial, sequence, body, time.monotonic())
+        finally:
+            connection.close()
+
+    @staticmethod
+    def read_exact(response, size):
+        data = response.read(size)
+        if len(data) < size:
+            raise ConnectionError("stream ended")
+        return data
+
+    def handle_page(self, flags, granule, serial, sequence, body, now):
+        with self.lock:
+            if flags & OGG_BOS or serial != self.serial:
+                self.reset()
+                self.serial = serial
+                if body.startswith(b'\x01vorbis') and len(body) >= 16:
+                    self.samplerate = struct.unpack_from('<I', body, 12)[0]
+                elif body.startswith(b'OpusHead'):
+                    self.samplerate = 48000  # Opus granules always count 48kHz samples
+                else:
+                    self.samplerate = self.samplerate or 44100
+            elif self.last_sequence is not None and sequence != (self.last_sequence + 1) & 0xFFFFFFFF:
+                self.gaps += 1  # Pages lost between Icecast and us
+            self.last_sequence = sequence
+            self.last_page = now
+
+            if granule < 0 or not self.samplerate:
+                return  # Header pages and pages without a finished packet carry no time
+            if self.first_granule is None:
+                self.first_granule, self.first_wall = granule, now
+                self.last_granule, self.last_wall = granule, now
+                self.min_offset = self.offset = 0.0
+                return
+
+            audio_seconds = (granule - self.last_granule) / self.samplerate
+            jump = (now - self.last_wall) - audio_seconds
+            if jump >= STREAM_HEALTH_CONFIG['gap_threshold']:
+                self.gaps += 1
+                self.last_gap_ms = round(jump * 1000)
+
+            # Positive when the stream falls behind real time; the minimum is the burst-free baseline
+            self.offset = (now - self.first_wall) - (granule - self.first_granule) / self.samplerate
+            self.min_offset = min(self.min_offset, self.offset)
+            self.payload.append((now, len(body), audio_seconds))
+            while self.payload and now - self.payload[0][0] > STREAM_HEALTH_CONFIG['silence_seconds']:
+                self.payload.popleft()
+            self.last_granule, self.last_wall = granule, now
+
+    def metrics(self, now):
+        with self.lock:
+            audio = sum(seconds for _, _, seconds in self.payload)
+            payload_bps = round(sum(size for _, size, _ in self.payload) / audio) if audio >= 1 else None
+            return {
+                'connected': self.connected,
+                'samplerate': self.samplerate,
+                'seconds_since_page': round(now - self.last_page, 1) if self.last_page else None,
+                'latency_ms': round((self.offset - self.min_offset) * 1000) if self.offset is not None else None,
+                'gaps': self.gaps,
+                'last_gap_ms': self.last_gap_ms,
+                'payload_bps': payload_bps,
+                'silent': payload_bps is not None and payload_bps < STREAM_HEALTH_CONFIG['silence_bytes_per_sec']
+                          and audio >= STREAM_HEALTH_CONFIG['silence_seconds'] * 0.8,
+                'reconnects': self.reconnects,
+            }
+
+class StreamHealthMonitor:
+    """Publishes per-mount stream health on STREAMS_TOPIC and records alarms in the history store."""
+
+    def __init__(self, history_store=None, mounts=None):
+        self.history_store = history_store
+        self.mounts = mounts or default_mounts()
+        self.readers = {mount: OggStreamReader(mount) for mount in self.mounts} \
+            if STREAM_HEALTH_CONFIG['ogg_readers'] else {}
+        self.mqtt_client = None
+        self.running = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.previous = {}  # mount -> (monotonic time, total_bytes_read) of the last poll
+        self.last_progress = {}  # mount -> monotonic time bytes_read last increased
+        self.alarms = set()
+        self.source = None
+
+    def set_mqtt_client(self, mqtt_client):
+        """Set the MQTT client reference."""
+        self.mqtt_client = mqtt_client
+
+    def start(self):
+        """Start the Icecast poller and one Ogg reader per mount."""
+        self.running = True
+        for reader in self.readers.values():
+            reader.start()
+        self.thread = threading.Thread(target=self.poll_loop, daemon=True, name="stream-health")
+        self.thread.start()
+        logger.info(f"[STREAMS] Monitoring {len(self.mounts)} mounts ({len(self.readers)} with Ogg readers)")
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+        for reader in self.readers.values():
+            reader.stop()
+
+    def fetch_stats(self):
+        """Icecast per-mount statistics from the admin XML, or the public JSON when admin is refused."""
+        connection = http.client.HTTPConnection(ICECAST_HOST, ICECAST_PORT, timeout=5)
+        try:
+            credentials = f"{STREAM_HEALTH_CONFIG['admin_user']}:{STREAM_HEALTH_CONFIG['admin_password']}"
+            connection.request('GET', '/admin/stats', headers={
+                'Authorization': 'Basic ' + base64.b64encode(credentials.encode()).decode()
+            })
+            response = connection.getresponse()
+            body = response.read()
+            if response.status == 200:
+                self.source = 'admin'
+                return parse_admin_stats(body)
+            connection.request('GET', '/status-json.xsl')
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise ConnectionError(f"HTTP {response.status}")
+            self.source = 'status-json'
+            return parse_status_json(body)
+        finally:
+            connection.close()
+
+    def poll_loop(self):
+        while self.running:
+            try:
+                self.publish(self.collect())
+            except Exception as e:
+                logger.error(f"[STREAMS] Health poll failed: {e}")
+            self.stop_event.wait(STREAM_HEALTH_CONFIG['poll_interval'])
+
+    def collect(self):
+        now = time.monotonic()
+        try:
+            stats = self.fetch_stats()
+            icecast_error = None
+        except Exception as e:
+            stats, icecast_error = {}, str(e)
+
+        mounts = {}
+        for mount, (sculpture, kind) in self.mounts.items():
+            fields = stats.get(mount)
+            health = {'sculpture': sculpture, 'kind': kind, 'connected': fields is not None}
+            if fields:
+                health.update(fields)
+                bytes_read = fields.get('total_bytes_read')
+                if bytes_read is not None:
+                    previous = self.previous.get(mount)
+                    if previous and bytes_read >= previous[1] and now > previous[0]:
+                        health['kbps_in'] = round((bytes_read - previous[1]) * 8 / 1000 / (now - previous[0]), 1)
+                    if not previous or bytes_read > previous[1]:
+                        self.last_progress[mount] = now
+                    self.previous[mount] = (now, bytes_read)
+            else:
+                self.previous.pop(mount, None)
+                self.last_progress.pop(mount, None)
+
+            if mount in self.readers:
+                health['reader'] = self.readers[mount].metrics(now)
+            health['alarms'] = self.mount_alarms(mount, health, now)
+            mounts[mount] = health
+
+        report = {'time': round(time.time()), 'source': self.source, 'mounts': mounts}
+        if icecast_error:
+            report['error'] = icecast_error
+        self.record_alarms(mounts)
+        return report
+
+    def mount_alarms(self, mount, health, now):
+        """Alarm names for one mount: missing source, stalled input, stalled reader, silence."""
+        if not health['connected']:
+            return ['missing'] if self.source else []  # Without stats we cannot tell
+        alarms = []
+        stall_timeout = STREAM_HEALTH_CONFIG['stall_timeout']
+        if mount in self.last_progress and now - self.last_progress[mount] >= stall_timeout:
+            alarms.append('stalled')
+        reader = health.get('reader')
+        if reader:
+            if reader['seconds_since_page'] is not None and reader['seconds_since_page'] >= stall_timeout \
+                    and 'stalled' not in alarms:
+                alarms.append('stalled')
+            if reader['silent']:
+                alarms.append('silent')
+        return alarms
+
+    def record_alarms(self, mounts):
+        """Log alarm transitions and store new ones as history events."""
+        current = {(mount, alarm) for mount, health in mounts.items() for alarm in health['alarms']}
+        for mount, alarm in sorted(current - self.alarms):
+            sculpture = self.mounts[mount][0]
+            logger.warning(f"[STREAMS] {mount} ({sculpture}): {alarm}")
+            if self.history_store:
+                self.history_store.record_event(sculpture, mount.lstrip('/'), f"stream_{alarm}")
+        for mount, alarm in sorted(self.alarms - current):
+            logger.info(f"[STREAMS] {mount}: {alarm} cleared")
+        self.alarms = current
+
+    def publish(self, report):
+        if self.mqtt_client:
+            self.mqtt_client.publish(STREAMS_TOPIC, json.dumps(report), retain=True)
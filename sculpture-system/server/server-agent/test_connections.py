@@ -2,24 +2,32 @@
 """
 Connection test script for server-agent underrun monitoring
 This script tests SSH connections and service availability before running the full server-agent.
+All systems (and every host of a system) are probed concurrently over one SSH session per host,
+so a fleet check is bounded by the slowest host rather than the sum of all timeouts.
 """
 
+import argparse
+import http.client
+import json
+import math
 import paramiko
-import subprocess
-import sys
 import socket
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 # Import configuration from config module
 try:
     from config import PI_SYSTEMS, MONITORED_SERVICES, CONNECTION_CONFIG
+    from config import MQTT_BROKER, MQTT_PORT, LIQUIDSOAP_HOST, LIQUIDSOAP_PORT, ICECAST_HOST, ICECAST_PORT
     SSH_TIMEOUT = CONNECTION_CONFIG['ssh_timeout']
+    SSH_KEY_FILE = CONNECTION_CONFIG.get('ssh_key_file')
 except ImportError:
     # Fallback configuration if config module not available
     PI_SYSTEMS = [
         {
-            "name": "sculpture1", 
+            "name": "sculpture1",
             "hosts": [
                 "sculpture1.local",
                 "sculpture1",
@@ -28,7 +36,7 @@ except ImportError:
             "user": "pi"
         },
         {
-            "name": "sculpture2", 
+            "name": "sculpture2",
             "hosts": [
                 "sculpture2.local",
                 "sculpture2",
@@ -37,7 +45,7 @@ except ImportError:
             "user": "pi"
         },
         {
-            "name": "sculpture3", 
+            "name": "sculpture3",
             "hosts": [
                 "sculpture3.local",
                 "sculpture3",
@@ -47,167 +55,324 @@ except ImportError:
         },
     ]
     MONITORED_SERVICES = ["player-live", "player-loop"]
+    MQTT_BROKER, MQTT_PORT = "localhost", 1883
+    LIQUIDSOAP_HOST, LIQUIDSOAP_PORT = "localhost", 1234
+    ICECAST_HOST, ICECAST_PORT = "localhost", 8000
     SSH_TIMEOUT = 10
+    SSH_KEY_FILE = None
+
+SSH_PORT = 22
+
+def percentiles(samples):
+    """Summarise latency samples (seconds) as min/p50/p90/max in milliseconds (nearest rank)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    def rank(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+    return {
+        'count': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 1),
+        'p50_ms': round(rank(50) * 1000, 1),
+        'p90_ms': round(rank(90) * 1000, 1),
+        'max_ms': round(ordered[-1] * 1000, 1),
+    }
+
+def is_ip_address(host):
+    try:
+        socket.inet_pton(socket.AF_INET6 if ':' in host else socket.AF_INET, host)
+        return True
+    except OSError:
+        return False
 
-def test_dns_resolution(hostname):
-    """Test DNS resolution for a hostname."""
+def probe_host(host, timeout):
+    """Resolve a host and open a TCP connection to its SSH port; the socket is handed on to paramiko."""
+    result = {'host': host, 'dns': None, 'address': None, 'tcp_ms': None, 'error': None}
     try:
-        ip = socket.gethostbyname(hostname)
-        return True, ip
+        if is_ip_address(host):
+            result['dns'] = 'skipped'
+            addresses = [(socket.AF_INET6 if ':' in host else socket.AF_INET, (host, SSH_PORT))]
+        else:
+            start = time.monotonic()
+            infos = socket.getaddrinfo(host, SSH_PORT, type=socket.SOCK_STREAM)
+            result['dns'] = round((time.monotonic() - start) * 1000, 1)
+            addresses = [(family, address) for family, _, _, _, address in infos]
+        result['address'] = addresses[0][1][0]
+
+        family, address = addresses[0]
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        start = time.monotonic()
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        result['tcp_ms'] = round((time.monotonic() - start) * 1000, 1)
+        return result, sock
     except socket.gaierror as e:
-        return False, str(e)
+        result['error'] = f"DNS resolution failed: {e}"
+    except OSError as e:
+        result['error'] = f"SSH port unreachable: {e}"
+    return result, None
+
+def run_command(ssh, command, timeout=10):
+    """Run a command over an open session; returns (exit status, stdout, seconds)."""
+    start = time.monotonic()
+    stdin, stdout, stderr = ssh.exec_command(command, timeout=timeout)
+    output = stdout.read().decode(errors='replace').strip()
+    status = stdout.channel.recv_exit_status()
+    return status, output, time.monotonic() - start
+
+def test_system(system, options):
+    """Probe every host of a system at once, then run all checks over one session to the fastest."""
+    report = {
+        'name': system['name'],
+        'ok': False,
+        'hosts': [],
+        'connected_host': None,
+        'ssh_handshake_ms': None,
+        'command_rtt': None,
+        'services': {},
+        'follow': None,
+        'error': None,
+    }
+
+    # Race the hosts: the first to accept on the SSH port is used, the others are reported
+    ssh = None
+    with ThreadPoolExecutor(max_workers=len(system['hosts'])) as pool:
+        futures = [pool.submit(probe_host, host, options.timeout) for host in system['hosts']]
+        for future in as_completed(futures):
+            host_result, sock = future.result()
+            report['hosts'].append(host_result)
+            if sock is None:
+                continue
+            if ssh is not None:
+                sock.close()
+                continue
+            try:
+                client = paramiko.SSHClient()
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                connect_kwargs = {
+                    'hostname': host_result['host'],
+                    'username': system['user'],
+                    'timeout': options.timeout,
+                    'banner_timeout': options.timeout,
+                    'auth_timeout': options.timeout,
+                    'sock': sock,
+                }
+                if SSH_KEY_FILE:
+                    connect_kwargs['key_filename'] = SSH_KEY_FILE
+                start = time.monotonic()
+                client.connect(**connect_kwargs)
+                host_result['ssh_ms'] = round((time.monotonic() - start) * 1000, 1)
+                report['ssh_handshake_ms'] = host_result['ssh_ms']
+                report['connected_host'] = host_result['host']
+                ssh = client
+            except Exception as e:
+                host_result['error'] = f"SSH connection failed: {e}"
+                sock.close()
+    report['hosts'].sort(key=lambda host_result: system['hosts'].index(host_result['host']))
+
+    if ssh is None:
+        report['error'] = "no host reachable over SSH"
+        return report
 
-def test_ssh_connection(host, user, timeout=10):
-    """Test SSH connection to a host."""
     try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(hostname=host, username=user, timeout=timeout)
-        
-        # Test with a simple command
-        stdin, stdout, stderr = ssh.exec_command('echo "SSH test successful"', timeout=5)
-        result = stdout.read().decode().strip()
-        ssh.close()
-        
-        return True, result
+        # Command round trips over the established session
+        samples = []
+        for _ in range(options.samples):
+            status, output, elapsed = run_command(ssh, 'true', timeout=5)
+            samples.append(elapsed)
+        report['command_rtt'] = percentiles(samples)
+
+        # All service states in one round trip, then recent logs per service
+        status, output, _ = run_command(ssh, f"systemctl is-active {' '.join(MONITORED_SERVICES)}", timeout=5)
+        for service, state in zip(MONITORED_SERVICES, output.split()):
+            status, logs, _ = run_command(ssh, f'journalctl -u {service} -n 3 --no-pager', timeout=10)
+            report['services'][service] = {'state': state, 'recent_logs': [line for line in logs.split('\n') if line.strip()]}
+
+        # Test journalctl follow capability
+        if options.follow > 0:
+            status, output, _ = run_command(
+                ssh, f'timeout {options.follow} journalctl -u {MONITORED_SERVICES[0]} -f -o cat --no-hostname',
+                timeout=options.follow + 5
+            )
+            # timeout(1) exits 124 when the follow ran for the whole duration
+            report['follow'] = {
+                'ok': status in (0, 124),
+                'lines': len(output.splitlines()) if output else 0,
+                'sample': output.splitlines()[0][:80] if output else None,
+            }
+
+        report['ok'] = len(report['services']) == len(MONITORED_SERVICES) and \
+            (report['follow'] is None or report['follow']['ok'])
     except Exception as e:
-        return False, str(e)
+        report['error'] = str(e)
+    finally:
+        ssh.close()
+    return report
+
+def test_mqtt(samples, timeout):
+    """MQTT CONNECT, then PINGREQ/PINGRESP round trips."""
+    with socket.create_connection((MQTT_BROKER, MQTT_PORT), timeout=timeout) as sock:
+        client_id = b'test-connections'
+        variable_header = b'\x00\x04MQTT\x04\x02\x00\x3c'  # MQTT 3.1.1, clean session, 60s keepalive
+        payload = len(client_id).to_bytes(2, 'big') + client_id
+        sock.sendall(bytes([0x10, len(variable_header) + len(payload)]) + variable_header + payload)
+        connack = sock.recv(4)
+        if len(connack) < 4 or connack[0] != 0x20 or connack[3] != 0:
+            raise ConnectionError(f"broker refused the connection ({connack.hex()})")
+        rtts = []
+        for _ in range(samples):
+            start = time.monotonic()
+            sock.sendall(b'\xc0\x00')
+            if sock.recv(2) != b'\xd0\x00':
+                raise ConnectionError("unexpected reply to PINGREQ")
+            rtts.append(time.monotonic() - start)
+        sock.sendall(b'\xe0\x00')  # DISCONNECT
+    return rtts
 
-def test_service_status(host, user, service, timeout=10):
-    """Test service status on a remote host."""
+def test_liquidsoap(samples, timeout):
+    """Liquidsoap telnet 'uptime' round trips."""
+    with socket.create_connection((LIQUIDSOAP_HOST, LIQUIDSOAP_PORT), timeout=timeout) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        rtts = []
+        buffer = b''
+        for _ in range(samples):
+            start = time.monotonic()
+            sock.sendall(b'uptime\n')
+            while b'END' not in buffer:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise ConnectionError("connection closed by Liquidsoap")
+                buffer += chunk
+            buffer = buffer.split(b'END', 1)[1]
+            rtts.append(time.monotonic() - start)
+        sock.sendall(b'quit\n')
+    return rtts
+
+def test_icecast(samples, timeout):
+    """Icecast status-json.xsl requests over one keep-alive connection."""
+    connection = http.client.HTTPConnection(ICECAST_HOST, ICECAST_PORT, timeout=timeout)
+    rtts = []
     try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(hostname=host, username=user, timeout=timeout)
-        
-        # Check service status
-        stdin, stdout, stderr = ssh.exec_command(f'systemctl is-active {service}', timeout=5)
-        status = stdout.read().decode().strip()
-        
-        # Get recent log lines
-        stdin, stdout, stderr = ssh.exec_command(f'journalctl -u {service} -n 3 --no-pager', timeout=10)
-        recent_logs = stdout.read().decode().strip()
-        
-        ssh.close()
-        
-        return True, status, recent_logs
-    except Exception as e:
-        return False, str(e), ""
+        for _ in range(samples):
+            start = time.monotonic()
+            connection.request('GET', '/status-json.xsl')
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                raise ConnectionError(f"HTTP {response.status}")
+            rtts.append(time.monotonic() - start)
+    finally:
+        connection.close()
+    return rtts
 
-def test_journalctl_follow(host, user, service, duration=10):
-    """Test journalctl follow capability."""
+INFRA_CHECKS = {
+    'mqtt': (test_mqtt, lambda: f"{MQTT_BROKER}:{MQTT_PORT}"),
+    'liquidsoap': (test_liquidsoap, lambda: f"{LIQUIDSOAP_HOST}:{LIQUIDSOAP_PORT}"),
+    'icecast': (test_icecast, lambda: f"{ICECAST_HOST}:{ICECAST_PORT}"),
+}
+
+def test_infra(name, options):
+    check, target = INFRA_CHECKS[name]
+    report = {'name': name, 'target': target(), 'ok': False, 'rtt': None, 'error': None}
     try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(hostname=host, username=user, timeout=SSH_TIMEOUT)
-        
-        # Test journalctl follow for a short duration
-        stdin, stdout, stderr = ssh.exec_command(f'timeout {duration} journalctl -u {service} -f -o cat --no-hostname')
-        
-        lines = []
-        start_time = time.time()
-        while time.time() - start_time < duration:
-            line = stdout.readline()
-            if line:
-                lines.append(line.strip())
-            else:
-                break
-        
-        ssh.close()
-        return True, lines
+        report['rtt'] = percentiles(check(options.samples, options.timeout))
+        report['ok'] = True
     except Exception as e:
-        return False, str(e)
+        report['error'] = str(e)
+    return report
 
-def main():
-    """Main test function."""
+def run_diagnostics(options):
+    """Run every check concurrently and return the report."""
+    started = time.monotonic()
+    report = {'started': datetime.now().isoformat(timespec='seconds'), 'systems': [], 'infrastructure': []}
+    infra = list(INFRA_CHECKS) if options.infra else []
+    with ThreadPoolExecutor(max_workers=len(PI_SYSTEMS) + len(infra) or 1) as pool:
+        system_futures = [pool.submit(test_system, system, options) for system in PI_SYSTEMS]
+        infra_futures = [pool.submit(test_infra, name, options) for name in infra]
+        report['systems'] = [future.result() for future in system_futures]
+        report['infrastructure'] = [future.result() for future in infra_futures]
+
+    handshakes = [s['ssh_handshake_ms'] / 1000 for s in report['systems'] if s['ssh_handshake_ms'] is not None]
+    report['ssh_handshake'] = percentiles(handshakes)
+    report['all_passed'] = all(s['ok'] for s in report['systems']) and all(i['ok'] for i in report['infrastructure'])
+    report['duration_s'] = round(time.monotonic() - started, 2)
+    return report
+
+def format_rtt(rtt):
+    if not rtt:
+        return "n/a"
+    return f"p50 {rtt['p50_ms']}ms, p90 {rtt['p90_ms']}ms, max {rtt['max_ms']}ms ({rtt['count']} samples)"
+
+def print_report(report):
     print("=" * 80)
     print("Server-Agent Connection Test")
     print("=" * 80)
-    print(f"Test started at: {datetime.now()}")
+    print(f"Test started at: {report['started']}")
     print()
-    
-    all_tests_passed = True
-    
-    for system in PI_SYSTEMS:
+
+    for system in report['systems']:
         print(f"Testing system: {system['name']}")
         print("-" * 40)
-        
-        successful_host = None
-        
-        # Test each host
         for host in system['hosts']:
-            print(f"  Testing host: {host}")
-            
-            # Test DNS resolution
-            if not host.replace('.', '').isdigit():  # Not an IP address
-                dns_ok, dns_result = test_dns_resolution(host)
-                if dns_ok:
-                    print(f"    DNS resolution: OK -> {dns_result}")
-                else:
-                    print(f"    DNS resolution: FAILED -> {dns_result}")
-                    continue
-            else:
+            print(f"  Host: {host['host']}")
+            if host['dns'] == 'skipped':
                 print(f"    DNS resolution: SKIPPED (IP address)")
-            
-            # Test SSH connection
-            ssh_ok, ssh_result = test_ssh_connection(host, system['user'], SSH_TIMEOUT)
-            if ssh_ok:
-                print(f"    SSH connection: OK -> {ssh_result}")
-                successful_host = host
-                break
-            else:
-                print(f"    SSH connection: FAILED -> {ssh_result}")
-        
-        if successful_host:
-            print(f"  ✓ Successfully connected to {system['name']} via {successful_host}")
-            
-            # Test services
-            for service in MONITORED_SERVICES:
-                print(f"    Testing service: {service}")
-                service_ok, status, logs = test_service_status(successful_host, system['user'], service)
-                if service_ok:
-                    print(f"      Service status: {status}")
-                    if logs:
-                        print(f"      Recent logs: {len(logs.split())} lines")
-                        # Show first few lines
-                        for line in logs.split('\n')[:2]:
-                            if line.strip():
-                                print(f"        {line[:80]}...")
-                    else:
-                        print(f"      Recent logs: No logs found")
-                else:
-                    print(f"      Service test: FAILED -> {status}")
-                    all_tests_passed = False
-            
-            # Test journalctl follow capability
-            print(f"    Testing journalctl follow for {MONITORED_SERVICES[0]} (10s test)...")
-            follow_ok, follow_result = test_journalctl_follow(successful_host, system['user'], MONITORED_SERVICES[0], 10)
-            if follow_ok:
-                print(f"      Follow test: OK -> Captured {len(follow_result)} lines")
-                if follow_result:
-                    print(f"      Sample line: {follow_result[0][:80]}...")
-            else:
-                print(f"      Follow test: FAILED -> {follow_result}")
-                all_tests_passed = False
+            elif host['dns'] is not None:
+                print(f"    DNS resolution: OK -> {host['address']} ({host['dns']}ms)")
+            if host['tcp_ms'] is not None:
+                print(f"    SSH port: OK ({host['tcp_ms']}ms)")
+            if host.get('ssh_ms') is not None:
+                print(f"    SSH handshake: OK ({host['ssh_ms']}ms)")
+            if host['error']:
+                print(f"    FAILED -> {host['error']}")
+
+        if system['connected_host']:
+            print(f"  ✓ Successfully connected to {system['name']} via {system['connected_host']}")
+            print(f"    Command RTT: {format_rtt(system['command_rtt'])}")
+            for service, info in system['services'].items():
+                print(f"    Service {service}: {info['state']}")
+                for line in info['recent_logs'][:2]:
+                    print(f"        {line[:80]}...")
+            if system['follow']:
+                follow = system['follow']
+                print(f"    Follow test: {'OK' if follow['ok'] else 'FAILED'} -> Captured {follow['lines']} lines")
+                if follow['sample']:
+                    print(f"      Sample line: {follow['sample']}...")
+            if system['error']:
+                print(f"    FAILED -> {system['error']}")
         else:
             print(f"  ✗ Failed to connect to {system['name']} via any host")
-            all_tests_passed = False
-        
         print()
-    
+
+    if report['infrastructure']:
+        print("Infrastructure")
+        print("-" * 40)
+        for infra in report['infrastructure']:
+            if infra['ok']:
+                print(f"  ✓ {infra['name']} ({infra['target']}): {format_rtt(infra['rtt'])}")
+            else:
+                print(f"  ✗ {infra['name']} ({infra['target']}): {infra['error']}")
+        print()
+
     # Summary
     print("=" * 80)
     print("TEST SUMMARY")
     print("=" * 80)
-    
-    if all_tests_passed:
+    print(f"SSH handshake across the fleet: {format_rtt(report['ssh_handshake'])}")
+    print(f"Completed in {report['duration_s']}s")
+    print()
+
+    if report['all_passed']:
         print("✓ All tests passed! The server-agent should be able to connect and monitor.")
         print()
         print("Next steps:")
         print("1. Update the IP addresses in config.py if needed")
         print("2. Start the server-agent: sudo systemctl start server-agent")
         print("3. Monitor the logs: journalctl -u server-agent -f")
-        sys.exit(0)
     else:
         print("✗ Some tests failed. Please check the following:")
         print("1. Verify the IP addresses are correct")
@@ -215,7 +380,23 @@ def main():
         print("3. Check that the services are running on the sculptures")
         print("4. Verify network connectivity")
         print("5. Consider setting up SSH key authentication")
-        sys.exit(1)
+
+def main():
+    """Main test function."""
+    parser = argparse.ArgumentParser(description="Check connectivity to all sculptures (and optionally the server services)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON instead of text")
+    parser.add_argument('--infra', action='store_true', help="also check MQTT, Liquidsoap and Icecast reachability and RTT")
+    parser.add_argument('--timeout', type=float, default=min(SSH_TIMEOUT, 5), help="connect timeout per host in seconds")
+    parser.add_argument('--samples', type=int, default=5, help="round trips measured per connection")
+    parser.add_argument('--follow', type=int, default=2, help="seconds to test journalctl follow (0 to skip)")
+    options = parser.parse_args()
+
+    report = run_diagnostics(options)
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    sys.exit(0 if report['all_passed'] else 1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
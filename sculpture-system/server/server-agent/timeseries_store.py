@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+TimeSeriesStore module for server-agent
+Persists monitoring events and sculpture status samples in SQLite with downsampling and retention
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+# Import configuration
+from config import HISTORY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Sculpture status fields kept as samples
+SAMPLE_METRICS = ['cpu', 'temp', 'mic', 'output', 'mem']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    ts REAL NOT NULL,
+    system TEXT NOT NULL,
+    service TEXT NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+
+CREATE TABLE IF NOT EXISTS samples (
+    ts REAL NOT NULL,
+    sculpture TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_metric_ts ON samples (metric, ts);
+
+CREATE TABLE IF NOT EXISTS samples_1m (
+    minute INTEGER NOT NULL,
+    sculpture TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (metric, minute, sculpture)
+) WITHOUT ROWID;
+"""
+
+# Raw samples are rolled into one row per sculpture, metric and minute as they are written
+ROLLUP_SQL = """
+INSERT INTO samples_1m (minute, sculpture, metric, count, total, min, max)
+VALUES (?, ?, ?, 1, ?, ?, ?)
+ON CONFLICT (metric, minute, sculpture) DO UPDATE SET
+    count = count + 1,
+    total = total + excluded.total,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max)
+"""
+
+class TimeSeriesStore:
+    """Append-only event and sample history written by one background thread in batches."""
+
+    def __init__(self, path=None):
+        self.path = path or HISTORY_CONFIG['db_path']
+        self.write_queue = queue.Queue(maxsize=HISTORY_CONFIG['max_queue'])
+        self.writer_thread = None
+        self.running = False
+        self.dropped = 0
+
+    def connect(self):
+        """Open a connection in WAL mode so queries never block the writer."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        """Create the schema and start the writer thread."""
+        try:
+            with closing(self.connect()) as conn:
+                conn.executescript(SCHEMA)
+        except Exception as e:
+            logger.error(f"[HISTORY] Failed to open history database {self.path}: {e}")
+            return False
+
+        self.running = True
+        self.writer_thread = threading.Thread(target=self.writer_loop, daemon=True, name="history-writer")
+        self.writer_thread.start()
+        logger.info(f"[HISTORY] History store started: {self.path}")
+        return True
+
+    def close(self):
+        """Flush pending writes and stop the writer thread."""
+        if not self.running:
+            return
+        self.running = False
+        self.write_queue.put(None)
+        self.writer_thread.join(timeout=HISTORY_CONFIG['flush_interval'] + 5)
+        logger.info("[HISTORY] History store closed")
+
+    def _enqueue(self, item):
+        try:
+            self.write_queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"[HISTORY] Write queue full, dropped {self.dropped} records")
+
+    def record_event(self, system_name, service, kind, timestamp=None):
+        """Queue a monitoring event (underrun, overrun, restart_success, restart_failure)."""
+        self._enqueue(('event', (timestamp or time.time(), system_name, service, kind)))
+
+    def record_status(self, sculpture_id, status):
+        """Queue the numeric fields of a sculpture status message as samples."""
+        timestamp = status.get('time') or time.time()
+        for metric in SAMPLE_METRICS:
+            value = status.get(metric)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self._enqueue(('sample', (timestamp, str(sculpture_id), metric, float(value))))
+
+    def writer_loop(self):
+        """Drain the queue into one transaction per batch and run retention periodically."""
+        conn = self.connect()
+        last_retention = 0
+        stopping = False
+
+        while not stopping:
+            batch = []
+            try:
+                item = self.write_queue.get(timeout=HISTORY_CONFIG['flush_interval'])
+                deadline = time.time() + HISTORY_CONFIG['flush_interval']
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= HISTORY_CONFIG['batch_size'] or time.time() >= deadline:
+                        break
+                    item = self.write_queue.get(timeout=max(0.0, deadline - time.time()))
+                stopping = item is None
+            except queue.Empty:
+                pass
+
+            if batch:
+                self.write_batch(conn, batch)
+
+            if time.time() - last_retention >= HISTORY_CONFIG['retention_interval']:
+                self.apply_retention(conn)
+                last_retention = time.time()
+
+        conn.close()
+
+    def write_batch(self, conn, batch):
+        """Write a batch of queued records in a single transaction."""
+        events = [record for kind, record in batch if kind == 'event']
+        samples = [record for kind, record in batch if kind == 'sample']
+        try:
+            with conn:
+                if events:
+                    conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?)", events)
+                if samples:
+                    conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?)", samples)
+                    conn.executemany(ROLLUP_SQL, [
+                        (int(ts // 60), sculpture, metric, value, value, value)
+                        for ts, sculpture, metric, value in samples
+                    ])
+            logger.debug(f"[HISTORY] Wrote {len(events)} events and {len(samples)} samples")
+        except Exception as e:
+            logger.error(f"[HISTORY] Failed to write batch of {len(batch)} records: {e}")
+
+    def apply_retention(self, conn):
+        """Delete raw samples, rollups and events that are past their retention."""
+        now = time.time()
+        try:
+            with conn:
+                conn.execute("DELETE FROM samples WHERE ts < ?",
+                             (now - HISTORY_CONFIG['raw_retention_days'] * 86400,))
+                conn.execute("DELETE FROM samples_1m WHERE minute < ?",
+                             (int((now - HISTORY_CONFIG['rollup_retention_days'] * 86400) // 60),))
+                conn.execute("DELETE FROM events WHERE ts < ?",
+                             (now - HISTORY_CONFIG['event_retention_days'] * 86400,))
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            logger.error(f"[HISTORY] Retention failed: {e}")
+
+    def query(self, request):
+        """Answer a history query.
+
+        request keys: 'type' ('events' or 'samples'), 'start'/'end' (epoch seconds,
+        default the last 24h), 'bucket' (seconds per row, default 3600), optional
+        'system'/'sculpture' filter, and 'kind' (events) or 'metric' (samples).
+        """
+        end = float(request.get('end') or time.time())
+        start = float(request.get('start') or end - 86400)
+        bucket = max(60, int(request.get('bucket', 3600))) // 60 * 60  # Whole minutes, like the rollups
+
+        with closing(self.connect()) as conn:
+            if request.get('type', 'events') == 'events':
+                rows = self.query_events(conn, start, end, bucket, request)
+            else:
+                rows = self.query_samples(conn, start, end, bucket, request)
+
+        return {'start': start, 'end': end, 'bucket': bucket, 'rows': rows}
+
+    def query_events(self, conn, start, end, bucket, request):
+        """Count events per bucket and system."""
+        sql = ("SELECT CAST(ts / ? AS INTEGER) * ?, system, COUNT(*) FROM events "
+               "WHERE kind = ? AND ts >= ? AND ts < ?")
+        params = [bucket, bucket, request.get('kind', 'underrun'), start, end]
+        if request.get('system'):
+            sql += " AND system = ?"
+            params.append(request['system'])
+        sql += " GROUP BY 1, 2 ORDER BY 1, 2"
+        return [{'ts': ts, 'system': system, 'count': count}
+                for ts, system, count in conn.execute(sql, params)]
+
+    def query_samples(self, conn, start, end, bucket, request):
+        """Aggregate per-minute rollups into avg/min/max per bucket and sculpture."""
+        bucket_minutes = bucket // 60
+        sql = ("SELECT (minute / ?) * ?, sculpture, SUM(total) / SUM(count), MIN(min), MAX(max), SUM(count) "
+               "FROM samples_1m WHERE metric = ? AND minute >= ? AND minute < ?")
+        params = [bucket_minutes, bucket, request.get('metric', 'temp'), int(start // 60), int(end // 60) + 1]
+        if request.get('sculpture'):
+            sql += " AND sculpture = ?"
+            params.append(str(request['sculpture']))
+        sql += " GROUP BY 1, 2 ORDER BY 1, 2"
+        return [{'ts': ts, 'sculpture': sculpture, 'avg': round(avg, 2), 'min': low, 'max': high, 'count': count}
+                for ts, sculpture, avg, low, high, count in conn.execute(sql, params)]